@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from database import SessionLocal, init_db
 from models import Data
+from neyro_sync import record_data_change
 
 
 def load_parquet_to_data(parquet_path: str, 
@@ -76,6 +77,7 @@ def load_parquet_to_data(parquet_path: str,
             # Обрабатываем данные пакетами
             for i in range(0, total_records, batch_size):
                 batch_df = df.iloc[i:i+batch_size]
+                batch_items = []
                 
                 for _, row in batch_df.iterrows():
                     try:
@@ -90,10 +92,16 @@ def load_parquet_to_data(parquet_path: str,
                         # Создаем запись в таблице Data
                         data_item = Data(title=title, description=description)
                         db.add(data_item)
+                        batch_items.append(data_item)
                         imported_count += 1
                     except Exception as e:
                         errors.append(f"Ошибка при обработке строки: {str(e)}")
                 
+                # Новые записи попадают в журнал изменений для синхронизации с нейросервисом
+                db.flush()
+                for data_item in batch_items:
+                    record_data_change(db, data_item.id, "upsert")
+                
                 # Сохраняем пакет в БД
                 db.commit()
             
@@ -127,4 +127,18 @@ class Data(Base):
     title = Column(Text, nullable=False, index=True)
     description = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow) 
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow) 
+
+
+class DataChange(Base):
+    """
+    Журнал изменений записей Data (outbox) для синхронизации базы знаний с нейросервисом.
+    Запись добавляется в одной транзакции с изменением Data и удаляется после
+    подтверждения нейросервисом (см. neyro_sync.py)
+    """
+    __tablename__ = "data_changes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    data_id = Column(Integer, nullable=False, index=True)
+    operation = Column(String(10), nullable=False)  # "upsert" или "delete"
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,295 @@
+"""
+Синхронизация базы знаний (таблица Data) с нейросервисом.
+
+Эндпоинты изменения Data в той же транзакции добавляют запись в журнал
+изменений DataChange (outbox). Отдельный процесс (python neyro_sync.py) читает
+журнал пакетами, для каждой записи Data берет последнюю операцию и текущее
+содержимое и отправляет пакет в эндпоинт /ingest нейросервиса. Записи журнала
+удаляются только после подтверждения, поэтому при недоступности нейросервиса
+пакет отправляется повторно; нейросервис пропускает статьи, не отличающиеся
+от уже загруженных, и повторная отправка ничего не меняет.
+
+Журнал отправляет только один процесс: в веб-воркерах Backend синхронизация
+не запускается, а процессы синхронизации удерживают advisory-блокировку
+PostgreSQL. Иначе два процесса прочли бы одни и те же записи журнала, и более
+старая версия статьи могла бы прийти в нейросервис после более новой.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+import requests
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, engine
+
+logger = logging.getLogger("neyro_sync")
+
+# Параметры синхронизации (переменные окружения)
+NEYRO_INGEST_URL = os.environ.get("NEYRO_INGEST_URL", "http://localhost:7777/ingest")
+NEYRO_INGEST_TOKEN = os.environ.get("NEYRO_INGEST_TOKEN", "")  # Общий ключ с нейросервисом (заголовок X-Ingest-Token)
+NEYRO_SYNC_INTERVAL = float(os.environ.get("NEYRO_SYNC_INTERVAL", "5"))  # Пауза между проверками журнала, сек
+NEYRO_SYNC_BATCH_SIZE = int(os.environ.get("NEYRO_SYNC_BATCH_SIZE", "100"))  # Записей журнала в одном пакете
+NEYRO_SYNC_TIMEOUT = float(os.environ.get("NEYRO_SYNC_TIMEOUT", "300"))  # Таймаут отправки пакета, сек
+NEYRO_SYNC_MAX_BACKOFF = float(os.environ.get("NEYRO_SYNC_MAX_BACKOFF", "300"))  # Максимальная пауза между повторами, сек
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+SYNC_LOCK_KEY = 0x4E45594F  # Ключ advisory-блокировки PostgreSQL процесса синхронизации
+
+
+def record_data_change(db: Session, data_id: int, operation: str) -> None:
+    """
+    Добавление записи в журнал изменений Data. Фиксируется вместе с изменением
+    Data вызывающим кодом (db.commit), поэтому изменение не может потеряться
+
+    Args:
+        db: Сессия базы данных
+        data_id: ID записи Data
+        operation: "upsert" (создание или изменение) или "delete"
+    """
+    db.add(models.DataChange(data_id=data_id, operation=operation))
+
+
+def build_batch(db: Session, batch_size: int = NEYRO_SYNC_BATCH_SIZE) -> Optional[Dict[str, Any]]:
+    """
+    Пакет изменений из начала журнала
+
+    Args:
+        db: Сессия базы данных
+        batch_size: Максимум записей журнала в пакете
+
+    Returns:
+        dict: Пакет с полями change_ids (записи журнала), upserts (статьи id/title/description)
+            и deletes (ID удаленных статей) или None, если журнал пуст
+    """
+    changes = db.query(models.DataChange).order_by(models.DataChange.id).limit(batch_size).all()
+    if not changes:
+        return None
+
+    # Несколько изменений одной записи схлопываются: важна только последняя операция
+    operations = {}
+    for change in changes:
+        operations[change.data_id] = change.operation
+
+    # Содержимое берется на момент отправки: повтор пакета отправляет актуальную версию статьи
+    upsert_ids = [data_id for data_id, operation in operations.items() if operation == UPSERT]
+    rows = {
+        row.id: row
+        for row in db.query(models.Data).filter(models.Data.id.in_(upsert_ids)).all()
+    } if upsert_ids else {}
+    upserts = [
+        {"id": data_id, "title": rows[data_id].title, "description": rows[data_id].description}
+        for data_id in upsert_ids if data_id in rows
+    ]
+    # Запись, удаленная после изменения, удаляется и из нейросервиса
+    deletes = [data_id for data_id in operations if data_id not in rows]
+
+    return {
+        "change_ids": [change.id for change in changes],
+        "upserts": upserts,
+        "deletes": deletes,
+    }
+
+
+def send_batch(batch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Отправка пакета изменений в нейросервис
+
+    Args:
+        batch: Пакет изменений (см. build_batch)
+
+    Returns:
+        dict: Ответ нейросервиса
+
+    Raises:
+        requests.exceptions.RequestException: Нейросервис недоступен или отклонил пакет
+    """
+    headers = {"accept": "application/json"}
+    if NEYRO_INGEST_TOKEN:
+        headers["X-Ingest-Token"] = NEYRO_INGEST_TOKEN
+    response = requests.post(
+        NEYRO_INGEST_URL,
+        json={"upserts": batch["upserts"], "deletes": batch["deletes"]},
+        headers=headers,
+        timeout=NEYRO_SYNC_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def sync_once(batch_size: int = NEYRO_SYNC_BATCH_SIZE) -> int:
+    """
+    Отправка всех накопленных изменений пакетами
+
+    Args:
+        batch_size: Максимум записей журнала в пакете
+
+    Returns:
+        int: Количество обработанных записей журнала
+
+    Raises:
+        requests.exceptions.RequestException: Пакет не отправлен (записи журнала сохраняются)
+    """
+    processed = 0
+    db = SessionLocal()
+    try:
+        while True:
+            batch = build_batch(db, batch_size)
+            if batch is None:
+                return processed
+            result = send_batch(batch)
+            # Удаляются только отправленные записи: изменения, добавленные во время отправки, остаются в журнале
+            db.query(models.DataChange).filter(
+                models.DataChange.id.in_(batch["change_ids"])
+            ).delete(synchronize_session=False)
+            db.commit()
+            processed += len(batch["change_ids"])
+            logger.info(
+                f"Синхронизировано с нейросервисом: {len(batch['upserts'])} статей обновлено, "
+                f"{len(batch['deletes'])} удалено, версия модели {result.get('model_version')}"
+            )
+    finally:
+        db.close()
+
+
+@contextmanager
+def sync_lock() -> Iterator[bool]:
+    """
+    Блокировка отправки журнала: advisory-блокировка PostgreSQL на отдельном
+    соединении. Освобождается при выходе из блока, а также сервером, если
+    процесс или соединение оборвались. Для SQLite (разработка) не требуется:
+    журнал отправляет единственный процесс синхронизации
+
+    Yields:
+        bool: Блокировка получена (False — журнал отправляет другой процесс)
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    with engine.connect() as connection:
+        acquired = bool(connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": SYNC_LOCK_KEY}
+        ).scalar())
+        connection.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SYNC_LOCK_KEY})
+                connection.commit()
+
+
+def run_sync_loop(stop_event: Optional[threading.Event] = None) -> None:
+    """
+    Цикл синхронизации: журнал проверяется каждые NEYRO_SYNC_INTERVAL секунд,
+    при ошибке отправки пауза удваивается до NEYRO_SYNC_MAX_BACKOFF. Пока журнал
+    отправляет другой процесс, цикл ждет освобождения блокировки (см. sync_lock)
+
+    Args:
+        stop_event: Событие остановки цикла
+    """
+    stop_event = stop_event or threading.Event()
+    delay = NEYRO_SYNC_INTERVAL
+    waiting = False
+    while not stop_event.is_set():
+        try:
+            # После ошибки блокировка берется заново: соединение с ней могло оборваться
+            with sync_lock() as acquired:
+                if not acquired and not waiting:
+                    logger.info("Журнал изменений отправляет другой процесс синхронизации, ожидание")
+                waiting = not acquired
+                while acquired and not stop_event.is_set():
+                    sync_once()
+                    delay = NEYRO_SYNC_INTERVAL
+                    stop_event.wait(delay)
+        except requests.exceptions.RequestException as e:
+            delay = min(delay * 2, NEYRO_SYNC_MAX_BACKOFF)
+            logger.warning(f"Нейросервис недоступен ({e}), повтор через {delay:.0f} с")
+        except Exception as e:
+            delay = min(delay * 2, NEYRO_SYNC_MAX_BACKOFF)
+            logger.error(f"Ошибка синхронизации базы знаний: {e}")
+        stop_event.wait(delay)
+
+
+def enqueue_all(batch_size: int = 1000) -> int:
+    """
+    Добавление в журнал всех записей Data (первичная загрузка нейросервиса)
+
+    Args:
+        batch_size: Записей в одной транзакции
+
+    Returns:
+        int: Количество добавленных записей журнала
+    """
+    db = SessionLocal()
+    try:
+        data_ids = [data_id for (data_id,) in db.query(models.Data.id).order_by(models.Data.id)]
+        for start in range(0, len(data_ids), batch_size):
+            for data_id in data_ids[start:start + batch_size]:
+                record_data_change(db, data_id, UPSERT)
+            db.commit()
+        return len(data_ids)
+    finally:
+        db.close()
+
+
+def export_dataset(path: str) -> int:
+    """
+    Выгрузка таблицы Data в parquet в формате датасета нейросервиса (со столбцом id),
+    чтобы ID статей обученной модели совпадали с ID записей Data
+
+    Args:
+        path: Путь к parquet-файлу
+
+    Returns:
+        int: Количество выгруженных записей
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Data.id, models.Data.title, models.Data.description).order_by(models.Data.id).all()
+    finally:
+        db.close()
+    dataset = pd.DataFrame(rows, columns=["id", "Заголовок статьи", "Описание"])
+    dataset.to_parquet(path)
+    return len(dataset)
+
+
+def main():
+    """
+    Запуск синхронизации из командной строки
+    """
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Синхронизация таблицы Data с нейросервисом")
+    parser.add_argument("--once", action="store_true", help="Отправить накопленные изменения и завершиться")
+    parser.add_argument("--backfill", action="store_true", help="Добавить в журнал все записи Data")
+    parser.add_argument("--export", metavar="PATH", help="Выгрузить Data в parquet для обучения нейросервиса")
+    args = parser.parse_args()
+
+    if args.export:
+        print(f"Выгружено записей: {export_dataset(args.export)}")
+        return
+    if args.backfill:
+        print(f"Добавлено в журнал записей: {enqueue_all()}")
+    if args.once:
+        with sync_lock() as acquired:
+            if not acquired:
+                print("Журнал изменений отправляет другой процесс синхронизации")
+                return
+            print(f"Отправлено записей журнала: {sync_once()}")
+        return
+    logger.info(f"Синхронизация базы знаний с {NEYRO_INGEST_URL} запущена")
+    run_sync_loop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Path, Query, Body, BackgroundTasks, Request, Cookie, Security
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
@@ -28,6 +28,7 @@ import models
 import schemas
 from auth import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash, SECRET_KEY, ALGORITHM, get_current_active_user
 from load_parquet_to_data import load_parquet_to_data
+from neyro_sync import record_data_change
 
 app = FastAPI(title="TenderHack API", version="1.0.0")
 
@@ -970,6 +971,8 @@ async def create_data(
     """
     new_data = models.Data(**data.dict())
     db.add(new_data)
+    db.flush()  # ID записи нужен для журнала изменений
+    record_data_change(db, new_data.id, "upsert")
     db.commit()
     db.refresh(new_data)
     return new_data
@@ -1013,6 +1016,7 @@ async def update_data(
     for key, value in update_data.items():
         setattr(data, key, value)
     
+    record_data_change(db, data.id, "upsert")
     db.commit()
     db.refresh(data)
     return data
@@ -1034,6 +1038,7 @@ async def delete_data(
         )
     
     db.delete(data)
+    record_data_change(db, data_id, "delete")
     db.commit()
     
     return {
@@ -1061,7 +1066,8 @@ async def query_ai_service(
 
     ai_service_url = "http://localhost:7777/query"
     encoded_query = urllib.parse.quote(user_query)
-    full_url = f"{ai_service_url}?query={encoded_query}"
+    # Чат показывает только ответ, поэтому объяснение (второй проход LLM) не генерируется
+    full_url = f"{ai_service_url}?query={encoded_query}&reasoning=skip"
 
     logger.info(f"Запрос к AI сервису: {full_url} от пользователя {current_user.id}")
 
@@ -1103,6 +1109,68 @@ async def query_ai_service(
         )
 
 
+# Эндпоинт для потокового ответа AI (Server-Sent Events)
+@app.post("/api/ai-query/stream")
+async def query_ai_service_stream(
+    request: Request,
+    payload: Dict[str, str] = Body(...),
+    current_user: models.User = Depends(get_api_user)
+):
+    """
+    Проксирует потоковый ответ AI-сервиса клиенту в формате Server-Sent Events:
+    события context (источники), token (фрагменты ответа по мере генерации), done и error.
+    """
+    user_query = payload.get("query")
+    if not user_query:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Параметр 'query' обязателен."
+        )
+
+    ai_service_url = "http://localhost:7777/query/stream"
+    full_url = f"{ai_service_url}?query={urllib.parse.quote(user_query)}"
+
+    logger.info(f"Потоковый запрос к AI сервису: {full_url} от пользователя {current_user.id}")
+
+    try:
+        # Таймаут на соединение и на паузу между событиями, а не на весь ответ
+        response = requests.get(
+            full_url, headers={'accept': 'text/event-stream'}, stream=True, timeout=(5, 60)
+        )
+        response.raise_for_status()
+    except requests.exceptions.Timeout:
+        logger.error(f"Ошибка: Таймаут при подключении к AI сервису {full_url}")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="AI сервис не ответил вовремя."
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Ошибка при запросе к AI сервису {full_url}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Не удалось связаться с AI сервисом: {str(e)}"
+        )
+
+    def relay_events():
+        # Синхронный генератор: Starlette выполняет его в пуле потоков, не блокируя цикл событий
+        try:
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk:
+                    yield chunk
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Обрыв потока AI сервиса {full_url}: {str(e)}")
+            error = json.dumps({"detail": f"Обрыв соединения с AI сервисом: {str(e)}"}, ensure_ascii=False)
+            yield f"event: error\ndata: {error}\n\n".encode("utf-8")
+        finally:
+            response.close()
+
+    return StreamingResponse(
+        relay_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # Эндпоинты для импорта данных
 @app.post("/api/import-parquet", response_model=Dict[str, Any])
 async def import_parquet(
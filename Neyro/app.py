@@ -2,17 +2,30 @@
 Приложение для ответов на вопросы пользователей с использованием гибридного подхода
 """
 
+import hmac
+import json
 import os
-import time
-import pandas as pd
-from model import Model
 import fastapi
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import numpy as np
 import uvicorn
+import serving
+import tracing
+import cache
+import reasoning_jobs
+import inference_server
+from assistant import HybridAssistant
+from model import DocumentIdsError
 
 app = fastapi.FastAPI()
 
+# Общий ключ с Backend для эндпоинта /ingest (пустой — эндпоинт отключен)
+INGEST_TOKEN = os.getenv("NEYRO_INGEST_TOKEN", "")
+# Ключ эндпоинтов /admin/model (пустой — эндпоинты отключены)
+ADMIN_TOKEN = os.getenv("NEYRO_ADMIN_TOKEN", "")
+# Количество HTTP-воркеров uvicorn в режиме пула remote
+HTTP_WORKERS = int(os.getenv("NEYRO_HTTP_WORKERS", "4"))
+
 # Добавляем middleware для CORS
 app.add_middleware(
     CORSMiddleware,
@@ -22,151 +35,230 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class HybridAssistant:
+# Модель обслуживается пулом: в режиме thread — общий объект в этом процессе,
+# в режиме process — отдельный объект в каждом процессе пула, в режиме remote —
+# один объект в процессе инференса, к которому обращаются все HTTP-воркеры
+if serving.POOL_KIND == "process":
+    assistant = None
+    pool = serving.InferencePool(factory=HybridAssistant, kind="process")
+elif serving.POOL_KIND == "remote":
+    assistant = None
+    pool = serving.RemotePool()
+else:
+    assistant = HybridAssistant()
+    pool = serving.InferencePool(target=assistant, kind="thread")
+
+async def run_in_pool(method, *args, **kwargs):
+    """Выполнение метода ассистента в пуле с переводом отказов пула в HTTP-ответы."""
+    try:
+        return await pool.call(method, *args, **kwargs)
+    except serving.PoolBusyError as e:
+        raise fastapi.HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(serving.RETRY_AFTER)}
+        )
+    except serving.PoolTimeoutError as e:
+        raise fastapi.HTTPException(status_code=504, detail=str(e))
+
+async def call_assistant(method, *args, **kwargs):
+    """Вызов управляющего метода ассистента вне очереди инференса: в этом процессе или в процессе инференса."""
+    if pool.kind == "remote":
+        try:
+            return await pool.control(method, *args, **kwargs)
+        except serving.InferenceUnavailableError as e:
+            raise fastapi.HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": str(serving.RETRY_AFTER)}
+            )
+    return await run_in_threadpool(getattr(assistant, method), *args, **kwargs)
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    pool.shutdown()
+
+@app.get("/health")
+async def health_endpoint():
+    """Проверка доступности сервиса; не обращается к модели и не ждет пула."""
+    if pool.kind == "remote":
+        try:
+            inference = await pool.control("health")
+        except serving.InferenceUnavailableError:
+            inference = {"model_initialized": None, "model_version": None, "pool": None, "llm": None}
+        return {"status": "ok", **inference, "worker": pool.stats()}
+    return {
+        "status": "ok",
+        "model_initialized": assistant.is_initialized if assistant is not None else None,
+        "model_version": assistant.model.model_version if assistant is not None and assistant.is_initialized else None,
+        "pool": pool.stats(),
+        "llm": assistant.llm_stats() if assistant is not None else None,
+    }
+
+@app.get("/query")
+async def get_answer_endpoint(query: str, reasoning: str = None):
     """
-    Класс для работы с гибридной моделью ответов на вопросы пользователей.
-    Предназначен для интеграции в бэкенд-приложения.
+    Основной эндпоинт для получения сгенерированного ответа.
+    reasoning: sync — объяснение в ответе, skip — без объяснения, parallel — объяснение
+    генерируется одновременно с ответом, background — объяснение запрашивается позже
+    через /reasoning/{reasoning_id}.
     """
-    
-    def __init__(self, model_path="model.pkl", dataset_path="docs/dataset.parquet", retrain=False):
-        """
-        Инициализация ассистента
-        
-        Args:
-            model_path (str): Путь к файлу модели
-            dataset_path (str): Путь к файлу с данными
-            retrain (bool): Флаг необходимости переобучения модели
-        """
-        self.model_path = model_path
-        self.dataset_path = dataset_path
-        self.model = None
-        self.is_initialized = False
-        
-        # Инициализация модели при создании объекта
-        if retrain:
-            self.retrain_model()
-        else:
-            self.initialize_model()
-    
-    def initialize_model(self):
-        """
-        Инициализация модели из существующего файла
-        
-        Returns:
-            bool: Успешность инициализации
-        """
-        if not os.path.exists(self.dataset_path):
-            raise FileNotFoundError(f"Файл с данными {self.dataset_path} не найден!")
-        
-        start_time = time.time()
-        
-        if not os.path.exists(self.model_path):
-            return self.retrain_model()
-        
+    try:
+        reasoning_mode = reasoning_jobs.resolve_reasoning_mode(reasoning)
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
+    if reasoning_mode == "background" and pool.kind == "process":
+        # Фоновая задача осталась бы в одном из процессов пула, а запрос за ней может попасть в другой
+        reasoning_mode = "parallel"
+    return await run_in_pool("get_answer", query, reasoning_mode=reasoning_mode)
+
+@app.get("/reasoning/{reasoning_id}")
+async def get_reasoning_endpoint(reasoning_id: str):
+    """Объяснение, запрошенное в режиме reasoning=background (status: pending, done или error)."""
+    if pool.kind == "process":
+        raise fastapi.HTTPException(status_code=404, detail="Фоновые объяснения недоступны в режиме пула process")
+    # Чтение готового результата не требует инференса и выполняется без пула
+    result = await call_assistant("get_reasoning", reasoning_id)
+    if result is None:
+        raise fastapi.HTTPException(status_code=404, detail="Объяснение не найдено или устарело")
+    return result
+
+def sse_event(event, data):
+    """Форматирование события Server-Sent Events с данными в JSON."""
+    payload = json.dumps(data, ensure_ascii=False, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+@app.get("/query/stream")
+async def stream_answer_endpoint(query: str, top_n: int = 5, top_k_fragments: int = 7):
+    """Потоковый ответ (Server-Sent Events): источники, затем токены ответа LLM по мере генерации."""
+    if pool.kind in ("thread", "remote"):
         try:
-            self.model = Model.load_model(self.model_path)
-            self.is_initialized = True
-            return True
-        except Exception as e:
-            self.is_initialized = False
-            raise RuntimeError(f"Ошибка при загрузке модели: {e}")
-    
-    def retrain_model(self):
-        """
-        Создание и обучение новой модели
-        
-        Returns:
-            bool: Успешность обучения
-        """
-        if not os.path.exists(self.dataset_path):
-            raise FileNotFoundError(f"Файл с данными {self.dataset_path} не найден!")
-        
-        start_time = time.time()
+            events = pool.stream("stream_answer", query, top_n=top_n, top_k_fragments=top_k_fragments)
+            if pool.kind == "remote":
+                # Процесс инференса сначала подтверждает, что запрос принят очередью допуска
+                events = await events
+        except serving.PoolBusyError as e:
+            raise fastapi.HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": str(serving.RETRY_AFTER)}
+            )
+    else:
+        # Генераторы не передаются между процессами: ответ целиком, отданный одним токеном
+        answer_data = await run_in_pool("get_answer", query, top_n=top_n, top_k_fragments=top_k_fragments)
         
+        async def single_answer():
+            yield "context", {"sources": answer_data.get("sources", []), "fragments": answer_data.get("fragments", [])}
+            yield "token", {"text": answer_data.get("answer", "")}
+            yield "done", answer_data
+        events = single_answer()
+    
+    async def event_source():
         try:
-            self.model = Model(self.dataset_path, use_bert=True, use_llm=True)
-            self.model.train()
-            self.model.save_model(self.model_path)
-            self.is_initialized = True
-            return True
+            async for event, data in events:
+                yield sse_event(event, data)
+        except serving.PoolTimeoutError as e:
+            yield sse_event("error", {"detail": str(e)})
         except Exception as e:
-            self.is_initialized = False
-            raise RuntimeError(f"Ошибка при создании модели: {e}")
+            yield sse_event("error", {"detail": f"Ошибка при обработке запроса: {e}"})
     
-    def analyze_query(self, query):
-        """
-        Анализ запроса пользователя
-        
-        Args:
-            query (str): Запрос пользователя
-            
-        Returns:
-            dict: Результаты анализа запроса
-        """
-        if not self.is_initialized:
-            raise RuntimeError("Модель не инициализирована")
-        
-        return self.model.text_processor.classify_query(query)
-    
-    def get_answer(self, query, top_n=5, top_k_fragments=7):
-        """
-        Получение ответа на запрос пользователя
-        
-        Args:
-            query (str): Запрос пользователя
-            top_n (int): Количество релевантных документов для поиска
-            top_k_fragments (int): Количество фрагментов для анализа
-            
-        Returns:
-            dict: Ответ на запрос с метаданными
-        """
-        if not self.is_initialized:
-            raise RuntimeError("Модель не инициализирована")
-        
-        if not query.strip():
-            return {"answer": "Пустой запрос", "fragments": [], "sources": []}
-        
-        start_time = time.time()
-        
-        # Анализ запроса
-        query_analysis = self.analyze_query(query)
-        
-        # Генерация ответа
-        answer_data = self.model.generate_answer(query, top_n=top_n, top_k_fragments=top_k_fragments)
-        
-        # Добавляем время выполнения и анализ запроса
-        answer_data["execution_time"] = time.time() - start_time
-        answer_data["query_analysis"] = query_analysis
-        
-        return answer_data
-
-assistant = HybridAssistant()
-
-@app.get("/query")
-async def get_answer_endpoint(query: str):
-    """Основной эндпоинт для получения сгенерированного ответа."""
-    return assistant.get_answer(query)
+    return fastapi.responses.StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/recommendations")
 async def get_recommendations_endpoint(query: str, top_n: int = 10):
     """Эндпоинт для получения релевантных статей с промежуточными оценками."""
-    if not assistant.is_initialized:
+    if assistant is not None and not assistant.is_initialized:
         raise fastapi.HTTPException(status_code=503, detail="Модель не инициализирована")
     
     if not query.strip():
         raise fastapi.HTTPException(status_code=400, detail="Пустой запрос")
         
     try:
-        # Используем метод get_recommendations напрямую
-        recommendations_df = assistant.model.get_recommendations(query, top_n=top_n)
-        # Преобразуем DataFrame в список словарей для JSON-ответа
-        # Обрабатываем NaN значения, чтобы избежать ошибок сериализации
-        recommendations_list = recommendations_df.replace({np.nan: None}).to_dict('records')
-        return {"recommendations": recommendations_list}
+        return await run_in_pool("get_recommendations", query, top_n=top_n)
+    except fastapi.HTTPException:
+        raise
     except Exception as e:
         # Логируем ошибку на сервере (опционально)
         # print(f"Ошибка при получении рекомендаций: {e}")
         raise fastapi.HTTPException(status_code=500, detail=f"Ошибка при обработке запроса: {e}")
 
+@app.post("/ingest")
+async def ingest_endpoint(changes: dict = fastapi.Body(...), x_ingest_token: str = fastapi.Header(None)):
+    """
+    Изменения базы знаний от Backend: upserts — статьи с полями id, title, description,
+    deletes — идентификаторы удаленных статей. Повторная отправка пакета ничего не меняет.
+    """
+    if not INGEST_TOKEN:
+        # Сервис доступен по сети: без ключа любой клиент мог бы изменять и удалять статьи
+        raise fastapi.HTTPException(status_code=503, detail="Обновление базы знаний отключено: не задан NEYRO_INGEST_TOKEN")
+    if not hmac.compare_digest(x_ingest_token or "", INGEST_TOKEN):
+        raise fastapi.HTTPException(status_code=401, detail="Неверный ключ синхронизации")
+    if pool.kind == "process":
+        # Каждый процесс пула хранит свою копию модели: изменение попало бы только в один из них
+        raise fastapi.HTTPException(status_code=409, detail="Обновление базы знаний недоступно в режиме пула process")
+    if assistant is not None and not assistant.is_initialized:
+        raise fastapi.HTTPException(status_code=503, detail="Модель не инициализирована")
+    
+    upserts = changes.get("upserts", [])
+    if any(not isinstance(document, dict) or "id" not in document or "title" not in document for document in upserts):
+        raise fastapi.HTTPException(status_code=400, detail="Статья должна содержать поля id и title")
+    # Обновление индексов не занимает места в пуле инференса: запросы обрабатываются параллельно
+    try:
+        return await call_assistant("apply_changes", upserts, changes.get("deletes", []))
+    except DocumentIdsError as e:
+        # Пакет остается в журнале Backend и будет применен после обучения модели на выгрузке Data
+        raise fastapi.HTTPException(status_code=409, detail=str(e))
+
+def check_admin(x_admin_token):
+    """Проверка ключа администратора и доступности реестра модели в этом процессе."""
+    if not ADMIN_TOKEN:
+        # Без ключа любой сетевой клиент мог бы запустить переобучение на сервере инференса
+        raise fastapi.HTTPException(status_code=503, detail="Управление моделью отключено: не задан NEYRO_ADMIN_TOKEN")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise fastapi.HTTPException(status_code=401, detail="Неверный ключ администратора")
+    if pool.kind == "process":
+        # Каждый процесс пула хранит свой реестр поколений модели
+        raise fastapi.HTTPException(status_code=409, detail="Управление моделью недоступно в режиме пула process")
+
+@app.get("/admin/model")
+async def model_status_endpoint(x_admin_token: str = fastapi.Header(None)):
+    """Активная версия модели, выводимые поколения и состояние фоновой сборки."""
+    check_admin(x_admin_token)
+    return await call_assistant("model_status")
+
+@app.post("/admin/model/reload", status_code=202)
+async def model_reload_endpoint(retrain: bool = False, x_admin_token: str = fastapi.Header(None)):
+    """
+    Фоновая сборка нового поколения модели: загрузка каталога модели или, с retrain=true,
+    переобучение на текущих статьях модели. Запросы обслуживает текущее поколение до подмены; ход сборки — в /admin/model.
+    """
+    check_admin(x_admin_token)
+    try:
+        started = await call_assistant("reload_model", retrain)
+    except (RuntimeError, FileNotFoundError) as e:
+        raise fastapi.HTTPException(status_code=503, detail=str(e))
+    if not started:
+        raise fastapi.HTTPException(status_code=409, detail="Сборка поколения модели уже выполняется")
+    return await call_assistant("model_status")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Гистограммы времени этапов и статистика кэша запросов в формате Prometheus."""
+    if pool.kind == "remote":
+        # Этапы выполняются в процессе инференса, метрики собираются там же
+        content = await call_assistant("metrics")
+    else:
+        content = tracing.metrics.render_prometheus() + cache.render_prometheus()
+    return fastapi.responses.PlainTextResponse(
+        content,
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=7777)
+    if serving.POOL_KIND == "remote":
+        # Модели загружаются один раз в процессе инференса; воркеры uvicorn только пересылают запросы
+        inference_process = inference_server.start_process()
+        try:
+            uvicorn.run("app:app", host="0.0.0.0", port=7777, workers=HTTP_WORKERS)
+        finally:
+            inference_process.terminate()
+    else:
+        uvicorn.run("app:app", host="0.0.0.0", port=7777)
@@ -0,0 +1,418 @@
+"""
+Гибридный ассистент для ответов на вопросы пользователей: загрузка или обучение модели и обработка запросов
+"""
+
+import os
+import threading
+import time
+import numpy as np
+from change_log import ChangeLog
+from model import Model
+from registry import ModelRegistry
+import tracing
+
+class HybridAssistant:
+    """
+    Класс для работы с гибридной моделью ответов на вопросы пользователей.
+    Предназначен для интеграции в бэкенд-приложения.
+    
+    Модель хранится в реестре поколений (registry.ModelRegistry): каждый запрос
+    работает с поколением, активным в момент его начала, а переобучение и
+    перезагрузка собирают новое поколение в фоне и подменяют активное без
+    остановки обработки запросов.
+    """
+    
+    def __init__(self, model_path="model.bundle", dataset_path="docs/dataset.parquet", retrain=False,
+                 legacy_model_path="model.pkl"):
+        """
+        Инициализация ассистента
+        
+        Args:
+            model_path (str): Путь к каталогу модели
+            dataset_path (str): Путь к файлу с данными
+            retrain (bool): Флаг необходимости переобучения модели
+            legacy_model_path (str): Файл модели в прежнем формате pickle; если каталога
+                модели еще нет, модель загружается из него и сохраняется в каталог
+        """
+        self.model_path = model_path
+        self.legacy_model_path = legacy_model_path
+        self.dataset_path = dataset_path
+        self.registry = ModelRegistry()
+        self.is_initialized = False
+        # Изменения базы знаний и сохранение модели выполняются по очереди; во время
+        # сборки нового поколения изменения запоминаются и применяются к нему перед подменой
+        self._changes_lock = threading.Lock()
+        self._pending_changes = None
+        # Пакеты изменений дописываются в журнал, а каталог модели сохраняется целиком
+        # только при уплотнении, сборке поколения и переполнении журнала
+        self.change_log = ChangeLog(f"{model_path}.changes.jsonl")
+        self._saved_version = None  # Версия каталога модели на диске
+        self._build_lock = threading.Lock()  # Одновременно собирается только одно поколение
+        
+        # Инициализация модели при создании объекта
+        if retrain:
+            self.retrain_model()
+        else:
+            self.initialize_model()
+    
+    @property
+    def model(self):
+        """Модель активного поколения"""
+        return self.registry.active_model
+    
+    def initialize_model(self):
+        """
+        Инициализация модели из существующего файла
+        
+        Returns:
+            bool: Успешность инициализации
+        """
+        if not os.path.exists(self.dataset_path):
+            raise FileNotFoundError(f"Файл с данными {self.dataset_path} не найден!")
+        
+        start_time = time.time()
+        
+        if not os.path.exists(self.model_path):
+            if self.legacy_model_path and os.path.exists(self.legacy_model_path):
+                return self.migrate_legacy_model()
+            return self.retrain_model()
+        
+        try:
+            with self._changes_lock:
+                model = self._load_model()
+            self.registry.publish(model, source="load")
+            self.is_initialized = True
+            return True
+        except Exception as e:
+            self.is_initialized = False
+            raise RuntimeError(f"Ошибка при загрузке модели: {e}")
+    
+    def migrate_legacy_model(self):
+        """
+        Перенос модели из файла pickle в каталог модели без переобучения
+        
+        Returns:
+            bool: Успешность переноса
+        """
+        try:
+            model = Model.load_model(self.legacy_model_path)
+            with self._changes_lock:
+                self._save_model(model)
+            self.registry.publish(model, source="migrate")
+            self.is_initialized = True
+            return True
+        except Exception as e:
+            self.is_initialized = False
+            raise RuntimeError(f"Ошибка при переносе модели из {self.legacy_model_path}: {e}")
+    
+    def retrain_model(self):
+        """
+        Создание и обучение новой модели. Если модель уже работает, новая модель
+        обучается на ее текущих статьях и подменяет ее после прогрева (см. _build_generation)
+        
+        Returns:
+            bool: Успешность обучения
+        """
+        if self.model is None and not os.path.exists(self.dataset_path):
+            raise FileNotFoundError(f"Файл с данными {self.dataset_path} не найден!")
+        
+        try:
+            self._build_generation("retrain")
+            self.is_initialized = True
+            return True
+        except Exception as e:
+            self.is_initialized = self.model is not None
+            raise RuntimeError(f"Ошибка при создании модели: {e}")
+    
+    def reload_model(self, retrain=False):
+        """
+        Фоновая сборка нового поколения модели: переобучение на текущих статьях
+        модели или загрузка каталога модели (например, обученного в другом процессе).
+        Запросы обслуживает текущее поколение, пока новое не будет собрано и прогрето
+        
+        Args:
+            retrain (bool): Переобучить модель на ее текущих статьях вместо загрузки model_path
+            
+        Returns:
+            bool: Сборка запущена (False — уже выполняется другая)
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        if not retrain and not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Файл {self.model_path} не найден!")
+        source = "retrain" if retrain else "reload"
+        return self.registry.start_build(source, lambda: self._build_generation(source))
+    
+    def model_status(self):
+        """
+        Состояние поколений модели: активная версия, выводимые поколения и фоновая сборка
+        
+        Returns:
+            dict: Состояние реестра модели
+        """
+        return self.registry.status()
+    
+    def _build_generation(self, source):
+        """
+        Сборка, прогрев и публикация поколения модели. Загруженные SentenceTransformer,
+        CrossEncoder и LLM берутся у активного поколения. Изменения базы знаний,
+        пришедшие во время сборки, применяются к новому поколению перед подменой
+        
+        Args:
+            source (str): "retrain" — обучение на текущих статьях активной модели (без нее —
+                на dataset_path), "reload" — загрузка model_path
+        """
+        with self._build_lock:
+            shared = self.model
+            try:
+                if source == "retrain":
+                    # Статьи снимаются вместе с началом записи изменений: изменения из /ingest,
+                    # примененные к активной модели, входят в обучение, а пришедшие позже — в pending
+                    with self._changes_lock:
+                        documents = shared.live_documents() if shared is not None else None
+                        self._pending_changes = []
+                    model = Model(self.dataset_path, use_bert=True, use_llm=True, shared=shared, dataset=documents)
+                    model.train()
+                else:
+                    # Каталог читается под блокировкой изменений: сохранение модели подменило бы его во время чтения
+                    with self._changes_lock:
+                        model = self._load_model(shared=shared)
+                        self._pending_changes = []
+                if shared is not None:
+                    self.registry.warm_up(model)
+                
+                with self._changes_lock:
+                    for upserts, deletes in self._pending_changes:
+                        self._apply_changes(model, upserts, deletes)
+                    if source == "retrain" or self._pending_changes:
+                        self._save_model(model)
+                    self.registry.publish(model, source=source)
+            finally:
+                with self._changes_lock:
+                    self._pending_changes = None
+    
+    def upsert_documents(self, documents):
+        """
+        Добавление и изменение статей базы знаний без переобучения модели
+        
+        Args:
+            documents (list): Статьи с полями id, title, description и, необязательно, url
+            
+        Returns:
+            dict: Состояние индекса модели
+        """
+        return self.apply_changes(upserts=documents)
+    
+    def delete_documents(self, ids):
+        """
+        Удаление статей базы знаний без переобучения модели
+        
+        Args:
+            ids (list): Идентификаторы статей
+            
+        Returns:
+            dict: Состояние индекса модели
+        """
+        return self.apply_changes(deletes=ids)
+    
+    def apply_changes(self, upserts=(), deletes=()):
+        """
+        Применение пакета изменений базы знаний (см. Backend/neyro_sync.py).
+        Статьи, не отличающиеся от загруженных, пропускаются, поэтому повторная
+        отправка пакета ничего не меняет. Изменивший модель пакет дописывается
+        в журнал изменений; каталог модели сохраняется, когда журнал переполнен
+        
+        Args:
+            upserts (list): Новые и измененные статьи с полями id, title, description
+            deletes (list): Идентификаторы удаленных статей
+            
+        Returns:
+            dict: Состояние индекса модели
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        upserts, deletes = list(upserts), list(deletes)
+        with self._changes_lock:
+            model = self.model
+            version = model.model_version
+            stats = self._apply_changes(model, upserts, deletes)
+            if stats["model_version"] != version:
+                self.change_log.append(self._saved_version, upserts, deletes)
+                if self._pending_changes is not None:
+                    self._pending_changes.append((upserts, deletes))
+                elif self.change_log.full:
+                    # Во время сборки поколения модель сохраняется при его публикации
+                    self._save_model(model)
+        return stats
+    
+    @staticmethod
+    def _apply_changes(model, upserts, deletes):
+        """Применение изменений базы знаний к модели"""
+        stats = model.upsert_documents(upserts)
+        if deletes:
+            stats = model.delete_documents(deletes)
+        return stats
+    
+    def compact_index(self):
+        """
+        Уплотнение индексов модели после удалений статей
+        
+        Returns:
+            dict: Состояние индекса модели
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        with self._changes_lock:
+            model = self.model
+            stats = model.compact()
+            self._save_model(model)
+        return stats
+    
+    def _load_model(self, shared=None):
+        """
+        Загрузка каталога модели и повтор изменений из журнала (вызывается под _changes_lock)
+        
+        Args:
+            shared (Model): Работающая модель, чьи SentenceTransformer, CrossEncoder и LLM используются
+            
+        Returns:
+            Model: Загруженная модель
+        """
+        model = Model.load_model(self.model_path, shared=shared)
+        self._saved_version = model.model_version
+        for upserts, deletes in self.change_log.read(self._saved_version):
+            self._apply_changes(model, upserts, deletes)
+        return model
+    
+    def _save_model(self, model):
+        """Сохранение каталога модели и очистка журнала изменений (вызывается под _changes_lock)"""
+        model.save_model(self.model_path)
+        self._saved_version = model.model_version
+        self.change_log.clear()
+    
+    def llm_stats(self):
+        """
+        Среда выполнения LLM и состояние планировщика генерации
+        
+        Returns:
+            dict: Описание LLM или None, если LLM не загружена
+        """
+        model = self.model
+        if not self.is_initialized or model.llm is None:
+            return None
+        return model.llm.describe()
+    
+    def analyze_query(self, query):
+        """
+        Анализ запроса пользователя
+        
+        Args:
+            query (str): Запрос пользователя
+            
+        Returns:
+            dict: Результаты анализа запроса
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        
+        with self.registry.acquire() as model:
+            return model.classify_query(query)
+    
+    def get_answer(self, query, top_n=5, top_k_fragments=7, reasoning_mode=None):
+        """
+        Получение ответа на запрос пользователя
+        
+        Args:
+            query (str): Запрос пользователя
+            top_n (int): Количество релевантных документов для поиска
+            top_k_fragments (int): Количество фрагментов для анализа
+            reasoning_mode (str): Режим генерации объяснения ("sync", "skip", "background", "parallel")
+            
+        Returns:
+            dict: Ответ на запрос с метаданными
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        
+        if not query.strip():
+            return {"answer": "Пустой запрос", "fragments": [], "sources": []}
+        
+        start_time = time.time()
+        
+        with self.registry.acquire() as model, tracing.start_trace() as trace:
+            # Анализ запроса
+            with tracing.span("classify_query", items=1):
+                query_analysis = model.classify_query(query)
+            
+            # Генерация ответа
+            answer_data = model.generate_answer(
+                query, top_n=top_n, top_k_fragments=top_k_fragments, reasoning_mode=reasoning_mode
+            )
+        
+        # Добавляем время выполнения, замеры этапов и анализ запроса
+        answer_data["execution_time"] = time.time() - start_time
+        answer_data["timings"] = trace.to_dict()
+        answer_data["query_analysis"] = query_analysis
+        
+        return answer_data
+    
+    def get_reasoning(self, reasoning_id):
+        """
+        Получение объяснения, сгенерированного в фоновом режиме
+        
+        Args:
+            reasoning_id (str): Идентификатор объяснения из ответа get_answer
+            
+        Returns:
+            dict: Статус и текст объяснения или None, если идентификатор неизвестен
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        
+        # Пул объяснений общий для поколений модели (см. Model._share_runtime)
+        with self.registry.acquire() as model:
+            return model.get_reasoning(reasoning_id)
+    
+    def stream_answer(self, query, top_n=5, top_k_fragments=7):
+        """
+        Потоковое получение ответа на запрос пользователя
+        
+        Args:
+            query (str): Запрос пользователя
+            top_n (int): Количество релевантных документов для поиска
+            top_k_fragments (int): Количество фрагментов для анализа
+            
+        Yields:
+            tuple: Событие ("context", "token", "done" или "error") и его данные;
+                событие "done" дополнено замерами этапов
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        
+        # Поколение удерживается до конца потока, даже если за это время его подменят
+        with self.registry.acquire() as model, tracing.start_trace() as trace:
+            for event, data in model.generate_answer_stream(query, top_n=top_n, top_k_fragments=top_k_fragments):
+                if event == "done":
+                    data["timings"] = trace.to_dict()
+                yield event, data
+    
+    def get_recommendations(self, query, top_n=10):
+        """
+        Получение релевантных статей с промежуточными оценками
+        
+        Args:
+            query (str): Запрос пользователя
+            top_n (int): Количество статей
+            
+        Returns:
+            dict: Список статей и замеры этапов поиска
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Модель не инициализирована")
+        
+        with self.registry.acquire() as model, tracing.start_trace() as trace:
+            recommendations_df = model.get_recommendations(query, top_n=top_n)
+        # Преобразуем DataFrame в список словарей для JSON-ответа
+        # Обрабатываем NaN значения, чтобы избежать ошибок сериализации
+        recommendations_list = recommendations_df.replace({np.nan: None}).to_dict('records')
+        return {"recommendations": recommendations_list, "timings": trace.to_dict()}
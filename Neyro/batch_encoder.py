@@ -0,0 +1,135 @@
+"""
+Модуль динамического пакетирования запросов к SentenceTransformer
+"""
+
+# Импорт стандартных библиотек
+import queue  # Очередь запросов на кодирование
+import threading  # Фоновый поток пакетной обработки
+import time  # Для ожидания пакета
+from concurrent.futures import Future  # Результат кодирования для вызывающего потока
+
+# Импорт библиотек для работы с данными
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+
+class BatchingEncoder:
+    """
+    Сервис кодирования текстов, объединяющий одновременные вызовы в один пакет.
+
+    Вызовы encode() из разных потоков складываются в очередь. Фоновый поток берет
+    первый запрос, дожидается остальных не дольше max_wait_ms (или до max_batch_size
+    запросов), кодирует их одним вызовом model.encode и возвращает каждому
+    вызывающему его вектор. Одинаковые тексты в пакете кодируются один раз.
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        """
+        Args:
+            model: Модель с методом encode(list_of_texts, batch_size=...) (SentenceTransformer)
+            max_batch_size (int): Максимальный размер пакета (1 — кодирование без пакетирования)
+            max_wait_ms (float): Максимальное ожидание пополнения пакета после первого запроса, мс
+        """
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Кодирование одного текста (блокирует вызывающий поток до готовности пакета)
+
+        Args:
+            text (str): Текст
+
+        Returns:
+            np.ndarray: Эмбеддинг текста
+        """
+        if self.max_batch_size == 1:
+            return np.asarray(self.model.encode(text))
+        future: Future = Future()
+        # Проверка и постановка в очередь — под той же блокировкой, что и close():
+        # запрос не может попасть в очередь после признака остановки и остаться без ответа
+        with self._lock:
+            queued = not self._closed
+            if queued:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="neyro-batch-encoder", daemon=True)
+                    self._thread.start()
+                self._queue.put((text, future))
+        if not queued:
+            return np.asarray(self.model.encode(text))
+        return future.result()
+
+    def _collect_batch(self):
+        """Ожидание первого запроса и добор пакета в пределах max_wait"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        """Цикл фонового потока: сбор пакета и одно кодирование на пакет до признака остановки"""
+        try:
+            while True:
+                batch = self._collect_batch()
+                stop = any(future is None for _, future in batch)
+                batch = [(text, future) for text, future in batch if future is not None]
+                if batch:
+                    self._encode_batch(batch)
+                if stop:
+                    return
+        finally:
+            self._drain()
+
+    def _encode_batch(self, batch) -> None:
+        """Кодирование пакета и передача векторов вызывающим потокам (ошибка передается каждому)"""
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = np.asarray(self.model.encode(unique_texts, batch_size=len(unique_texts)))
+            positions = {text: i for i, text in enumerate(unique_texts)}
+            for text, future in batch:
+                future.set_result(embeddings[positions[text]])
+        except Exception as e:
+            logger.error("Ошибка пакетного кодирования (%d текстов): %s", len(unique_texts), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(batch) > 1:
+            logger.debug("Пакет кодирования: %d запросов, %d уникальных текстов", len(batch), len(unique_texts))
+
+    def _drain(self) -> None:
+        """Кодирование по одному запросов, оставшихся в очереди после остановки потока"""
+        while True:
+            try:
+                text, future = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if future is None or future.done():
+                continue
+            try:
+                future.set_result(np.asarray(self.model.encode(text)))
+            except Exception as e:
+                future.set_exception(e)
+
+    def close(self) -> None:
+        """Остановка фонового потока (последующие вызовы кодируются напрямую)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put((None, None))
@@ -0,0 +1,364 @@
+"""
+Модуль с инвертированным индексом BM25 для поиска по базе знаний Портала поставщиков
+"""
+
+# Импорт библиотек для работы с данными и математических операций
+import json  # Для сохранения параметров индекса
+import os  # Для работы с файловой системой
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+from scipy import sparse  # Разреженные матрицы для хранения постингов
+
+# Импорт типов для аннотаций
+from typing import Dict, Iterable, List, Tuple  # Для типизации кода
+
+
+class BM25Index:
+    """
+    Индекс BM25 (вариант Okapi), хранящийся в виде разреженной матрицы постингов.
+
+    Строка матрицы постингов соответствует термину словаря, столбцы — документам,
+    значения — заранее вычисленные веса BM25. Оценки полностью совпадают с
+    rank_bm25.BM25Okapi с теми же параметрами k1, b и epsilon.
+    """
+    # Имена файлов индекса на диске
+    META_FILE = "meta.json"
+    VOCABULARY_FILE = "vocabulary.txt"
+    ARRAY_FILES = (
+        "postings_data", "postings_indices", "postings_indptr",
+        "tf_data", "tf_indices", "tf_indptr",
+        "idf", "doc_len",
+    )
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """
+        Инициализация пустого индекса
+
+        Args:
+            k1 (float): Параметр насыщения частоты термина
+            b (float): Параметр нормализации по длине документа
+            epsilon (float): Доля среднего IDF, подставляемая вместо отрицательных IDF
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.vocabulary: Dict[str, int] = {}  # Термин -> номер строки в матрице постингов
+        self.term_frequencies = None  # Частоты терминов (документ x термин), нужны для перестроения весов
+        self.postings = None  # Веса BM25 (термин x документ)
+        self.idf = np.zeros(0)  # IDF терминов словаря
+        self.doc_len = np.zeros(0)  # Длины документов в токенах
+        self.avgdl = 0.0  # Средняя длина непустого документа
+
+    @property
+    def num_docs(self) -> int:
+        """Количество документов в индексе (включая пустые)"""
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, tokenized_corpus: Iterable[List[str]], k1: float = 1.5, b: float = 0.75,
+              epsilon: float = 0.25) -> 'BM25Index':
+        """
+        Построение индекса по токенизированному корпусу
+
+        Args:
+            tokenized_corpus (Iterable[List[str]]): Списки токенов документов.
+                Пустые документы сохраняют свою позицию, но не учитываются в статистиках,
+                как если бы они были отфильтрованы перед обучением BM25Okapi.
+            k1 (float): Параметр насыщения частоты термина
+            b (float): Параметр нормализации по длине документа
+            epsilon (float): Доля среднего IDF для отрицательных IDF
+
+        Returns:
+            BM25Index: Построенный индекс
+        """
+        index = cls(k1=k1, b=b, epsilon=epsilon)
+
+        rows, cols = [], []
+        num_docs = 0
+        for doc_idx, tokens in enumerate(tokenized_corpus):
+            num_docs = doc_idx + 1
+            for token in tokens:
+                term_id = index.vocabulary.setdefault(token, len(index.vocabulary))
+                rows.append(doc_idx)
+                cols.append(term_id)
+
+        # Повторяющиеся пары (документ, термин) суммируются при приведении к CSR
+        index.term_frequencies = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(num_docs, len(index.vocabulary))
+        )
+        index.term_frequencies.sum_duplicates()
+        index._compute_weights()
+        return index
+
+    def with_documents(self, tokenized_corpus: Iterable[List[str]], removed: Iterable[int] = ()) -> 'BM25Index':
+        """
+        Новый индекс с добавленными документами и удаленными документами.
+
+        Добавленные документы получают позиции после существующих. Частоты терминов
+        удаленных документов обнуляются: документ остается на своей позиции как
+        пустой и, как при обучении, не учитывается в статистиках и не находится.
+        Частоты остальных документов не пересчитываются; веса BM25 (зависящие
+        от IDF и средней длины) пересчитываются векторно по матрице частот.
+
+        Args:
+            tokenized_corpus (Iterable[List[str]]): Списки токенов добавляемых документов
+            removed (Iterable[int]): Позиции удаляемых документов
+
+        Returns:
+            BM25Index: Новый индекс (текущий не изменяется и может использоваться запросами)
+        """
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon)
+        index.vocabulary = dict(self.vocabulary)
+
+        rows, cols = [], []
+        num_new = 0
+        for doc_idx, tokens in enumerate(tokenized_corpus):
+            num_new = doc_idx + 1
+            for token in tokens:
+                rows.append(doc_idx)
+                cols.append(index.vocabulary.setdefault(token, len(index.vocabulary)))
+        new_tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(num_new, len(index.vocabulary))
+        )
+        new_tf.sum_duplicates()
+
+        tf = self.term_frequencies
+        removed = np.asarray(list(removed), dtype=np.int64)
+        if len(removed):
+            keep = np.ones(tf.shape[0], dtype=np.float32)
+            keep[removed] = 0
+            tf = (sparse.diags(keep) @ tf).tocsr()
+            tf.eliminate_zeros()
+        # Новые термины добавляют столбцы справа: индексы существующих строк не меняются
+        tf = sparse.csr_matrix((tf.data, tf.indices, tf.indptr), shape=(tf.shape[0], len(index.vocabulary)))
+
+        index.term_frequencies = sparse.vstack([tf, new_tf], format="csr")
+        index._compute_weights()
+        return index
+
+    def select_documents(self, positions: Iterable[int]) -> 'BM25Index':
+        """
+        Новый индекс только с указанными документами (уплотнение после удалений)
+
+        Args:
+            positions (Iterable[int]): Позиции сохраняемых документов в новом порядке
+
+        Returns:
+            BM25Index: Новый индекс
+        """
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon)
+        index.vocabulary = dict(self.vocabulary)
+        index.term_frequencies = self.term_frequencies[np.asarray(list(positions), dtype=np.int64)].tocsr()
+        index._compute_weights()
+        return index
+
+    def _compute_weights(self):
+        """
+        Расчет IDF, длин документов и матрицы весов BM25 по частотам терминов
+        """
+        tf = self.term_frequencies
+        self.doc_len = np.asarray(tf.sum(axis=1)).ravel().astype(np.float64)
+
+        non_empty = self.doc_len > 0
+        corpus_size = int(non_empty.sum())
+        self.avgdl = float(self.doc_len[non_empty].mean()) if corpus_size else 0.0
+
+        # Документная частота: в скольких документах встречается термин
+        doc_freq = np.bincount(tf.indices, minlength=tf.shape[1]).astype(np.float64)
+        idf = np.log(corpus_size - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        present = doc_freq > 0
+        if present.any():
+            # Как в BM25Okapi: отрицательные IDF заменяются на epsilon * средний IDF.
+            # Среднее считается по терминам, встречающимся в документах: термины
+            # удаленных статей остаются в словаре, но не должны менять оценки
+            idf[idf < 0] = self.epsilon * idf[present].mean()
+        self.idf = idf
+
+        if not corpus_size:
+            self.postings = sparse.csr_matrix((tf.shape[1], tf.shape[0]), dtype=np.float64)
+            return
+
+        # Вес: idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * |d| / avgdl))
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avgdl)
+        doc_of_entry = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+        tf_values = tf.data.astype(np.float64)
+        weights = self.idf[tf.indices] * tf_values * (self.k1 + 1) / (tf_values + length_norm[doc_of_entry])
+
+        weight_matrix = sparse.csr_matrix((weights, tf.indices, tf.indptr), shape=tf.shape)
+        self.postings = weight_matrix.T.tocsr()
+
+    def _query_vector(self, tokenized_queries: List[List[str]]):
+        """
+        Построение разреженной матрицы запрос x термин.
+        Повтор токена в запросе учитывается так же, как в BM25Okapi.get_scores.
+        """
+        rows, cols = [], []
+        for row, tokens in enumerate(tokenized_queries):
+            for token in tokens:
+                term_id = self.vocabulary.get(token)
+                if term_id is not None:
+                    rows.append(row)
+                    cols.append(term_id)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(tokenized_queries), len(self.vocabulary))
+        )
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """
+        Оценки BM25 всех документов для одного запроса
+
+        Args:
+            query (List[str]): Токены запроса
+
+        Returns:
+            np.ndarray: Оценки документов
+        """
+        return self.get_batch_scores([query])[0]
+
+    def get_batch_scores(self, tokenized_queries: List[List[str]]) -> np.ndarray:
+        """
+        Оценки BM25 для нескольких запросов одним разреженным умножением
+
+        Args:
+            tokenized_queries (List[List[str]]): Списки токенов запросов
+
+        Returns:
+            np.ndarray: Матрица оценок размера (количество запросов, количество документов)
+        """
+        if not tokenized_queries:
+            return np.zeros((0, self.num_docs))
+        # Умножение затрагивает только постинги терминов, встречающихся в запросах
+        return (self._query_vector(tokenized_queries) @ self.postings).toarray()
+
+    def top_k(self, query: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Отбор k документов с наибольшей положительной оценкой.
+        Обходит только постинги терминов запроса, не создавая плотный вектор по корпусу.
+
+        Args:
+            query (List[str]): Токены запроса
+            k (int): Количество документов
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Индексы документов и их оценки по убыванию оценки
+        """
+        term_ids = [self.vocabulary[token] for token in query if token in self.vocabulary]
+        if not term_ids or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        doc_ids, weights = [], []
+        indptr = self.postings.indptr
+        for term_id in term_ids:
+            start, end = indptr[term_id], indptr[term_id + 1]
+            doc_ids.append(self.postings.indices[start:end])
+            weights.append(self.postings.data[start:end])
+        doc_ids = np.concatenate(doc_ids)
+        weights = np.concatenate(weights)
+
+        # Суммирование вкладов терминов по документам, содержащим хотя бы один термин запроса
+        matched_docs, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > k:
+            positive = positive[np.argpartition(scores[positive], -k)[-k:]]
+        order = positive[np.argsort(-scores[positive], kind='stable')]
+        return matched_docs[order].astype(np.int64), scores[order]
+
+    def save(self, path: str) -> None:
+        """
+        Сохранение индекса в каталог (массивы в формате .npy)
+
+        Args:
+            path (str): Путь к каталогу индекса
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "postings_data": self.postings.data,
+            "postings_indices": self.postings.indices,
+            "postings_indptr": self.postings.indptr,
+            "tf_data": self.term_frequencies.data,
+            "tf_indices": self.term_frequencies.indices,
+            "tf_indptr": self.term_frequencies.indptr,
+            "idf": self.idf,
+            "doc_len": self.doc_len,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        # Словарь хранится списком терминов в порядке их номеров
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(path, self.VOCABULARY_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+
+        meta = {
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "avgdl": self.avgdl,
+            "num_docs": self.num_docs,
+            "num_terms": len(self.vocabulary),
+        }
+        with open(os.path.join(path, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'BM25Index':
+        """
+        Загрузка индекса из каталога
+
+        Args:
+            path (str): Путь к каталогу индекса
+            mmap (bool): Открывать ли массивы через отображение в память (без чтения в RAM)
+
+        Returns:
+            BM25Index: Загруженный индекс
+        """
+        with open(os.path.join(path, cls.META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        index = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        index.avgdl = meta["avgdl"]
+
+        with open(os.path.join(path, cls.VOCABULARY_FILE), encoding="utf-8") as f:
+            terms = f.read().split("\n") if meta["num_terms"] else []
+        index.vocabulary = {term: i for i, term in enumerate(terms)}
+
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in cls.ARRAY_FILES}
+
+        num_docs, num_terms = meta["num_docs"], meta["num_terms"]
+        index.postings = sparse.csr_matrix(
+            (arrays["postings_data"], arrays["postings_indices"], arrays["postings_indptr"]),
+            shape=(num_terms, num_docs), copy=False
+        )
+        index.term_frequencies = sparse.csr_matrix(
+            (arrays["tf_data"], arrays["tf_indices"], arrays["tf_indptr"]),
+            shape=(num_docs, num_terms), copy=False
+        )
+        index.idf = arrays["idf"]
+        index.doc_len = arrays["doc_len"]
+        return index
+
+    @classmethod
+    def from_okapi(cls, okapi, doc_indices: List[int], num_docs: int) -> 'BM25Index':
+        """
+        Перенос статистик из объекта rank_bm25.BM25Okapi (модели, сохраненные ранее)
+
+        Args:
+            okapi: Обученный объект BM25Okapi
+            doc_indices (List[int]): Индексы датасета для документов корпуса BM25Okapi
+            num_docs (int): Общее количество документов в датасете
+
+        Returns:
+            BM25Index: Эквивалентный индекс
+        """
+        tokenized_corpus: List[List[str]] = [[] for _ in range(num_docs)]
+        for local_idx, freqs in enumerate(okapi.doc_freqs):
+            tokenized_corpus[doc_indices[local_idx]] = [
+                term for term, count in freqs.items() for _ in range(count)
+            ]
+        return cls.build(tokenized_corpus, k1=okapi.k1, b=okapi.b, epsilon=okapi.epsilon)
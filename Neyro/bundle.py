@@ -0,0 +1,195 @@
+"""
+Модуль с форматом хранения обученной модели: версионированный каталог индексов с манифестом
+"""
+
+# Импорт стандартных библиотек
+import hashlib  # Контрольные суммы файлов
+import json  # Манифест и компактные словари
+import os  # Для работы с файловой системой и переменных окружения
+import shutil  # Удаление временных и замененных каталогов
+import time  # Время создания каталога
+
+# Импорт типов для аннотаций
+from typing import Any, Dict, Iterable, List, Optional  # Для типизации кода
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+BUNDLE_FORMAT_VERSION = 1  # Увеличивается при несовместимом изменении раскладки каталога
+MANIFEST_FILE = "manifest.json"
+
+# Проверять ли контрольные суммы всех файлов при загрузке (читает файлы целиком, поэтому по умолчанию выключено)
+BUNDLE_VERIFY = os.getenv("NEYRO_BUNDLE_VERIFY", "0").lower() in ("1", "true", "yes", "on")
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Контрольная сумма SHA-256 файла (читается блоками)
+
+    Args:
+        path (str): Путь к файлу
+        chunk_size (int): Размер блока чтения
+
+    Returns:
+        str: Шестнадцатеричная сумма
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_bundle(path: str) -> bool:
+    """Является ли путь каталогом модели с манифестом"""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+class BundleWriter:
+    """
+    Запись каталога модели.
+
+    Файлы пишутся во временный каталог рядом с целевым; при выходе из блока with
+    для каждого файла вычисляется контрольная сумма, записывается манифест, и
+    временный каталог подменяет целевой. Процессы, уже отобразившие в память
+    файлы прежнего каталога, продолжают с ними работать. При исключении
+    временный каталог удаляется, а прежний каталог остается нетронутым.
+    """
+
+    def __init__(self, path: str, **metadata: Any):
+        """
+        Args:
+            path (str): Путь к каталогу модели
+            **metadata: Поля манифеста (версия модели, число документов и т.п.)
+        """
+        self.path = os.path.abspath(path)
+        self.tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        self.metadata = metadata
+
+    def __enter__(self) -> 'BundleWriter':
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return
+        self._commit()
+
+    def file(self, name: str) -> str:
+        """
+        Путь к файлу или подкаталогу внутри записываемого каталога
+
+        Args:
+            name (str): Относительное имя (через "/")
+
+        Returns:
+            str: Полный путь; родительские каталоги создаются
+        """
+        path = os.path.join(self.tmp_path, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def write_json(self, name: str, data: Any) -> None:
+        """Запись компактного JSON-файла"""
+        with open(self.file(name), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    def write_lines(self, name: str, lines: Iterable[str]) -> None:
+        """Запись списка строк (по строке на элемент)"""
+        with open(self.file(name), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+    def _commit(self) -> None:
+        files = {}
+        for root, _, names in os.walk(self.tmp_path):
+            for name in sorted(names):
+                full_path = os.path.join(root, name)
+                relative = os.path.relpath(full_path, self.tmp_path).replace(os.sep, "/")
+                files[relative] = {"sha256": file_sha256(full_path), "size": os.path.getsize(full_path)}
+
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            **self.metadata,
+            "files": dict(sorted(files.items())),
+        }
+        with open(os.path.join(self.tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        # Прежний каталог сначала переименовывается, чтобы подмена заняла два rename, а не копирование
+        old_path = None
+        if os.path.lexists(self.path):
+            old_path = f"{self.path}.old-{os.getpid()}"
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.rename(self.path, old_path)
+        os.rename(self.tmp_path, self.path)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def read_manifest(path: str, verify: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Чтение манифеста каталога модели с проверкой версии формата
+
+    Args:
+        path (str): Путь к каталогу модели
+        verify (Optional[bool]): Сверить контрольные суммы файлов (по умолчанию NEYRO_BUNDLE_VERIFY)
+
+    Returns:
+        Dict[str, Any]: Манифест
+
+    Raises:
+        ValueError: Формат каталога новее поддерживаемого или файлы повреждены
+    """
+    with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    format_version = manifest.get("format_version")
+    if not isinstance(format_version, int) or format_version > BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"Каталог модели {path} имеет формат {format_version}, поддерживается до {BUNDLE_FORMAT_VERSION}"
+        )
+
+    if BUNDLE_VERIFY if verify is None else verify:
+        damaged = verify_bundle(path, manifest)
+        if damaged:
+            raise ValueError(f"Файлы каталога модели {path} повреждены или отсутствуют: {', '.join(damaged)}")
+    return manifest
+
+
+def verify_bundle(path: str, manifest: Dict[str, Any]) -> List[str]:
+    """
+    Сверка файлов каталога с контрольными суммами манифеста
+
+    Args:
+        path (str): Путь к каталогу модели
+        manifest (Dict[str, Any]): Манифест каталога
+
+    Returns:
+        List[str]: Имена отсутствующих или измененных файлов
+    """
+    damaged = []
+    for name, info in manifest.get("files", {}).items():
+        full_path = os.path.join(path, *name.split("/"))
+        if (not os.path.isfile(full_path) or os.path.getsize(full_path) != info["size"]
+                or file_sha256(full_path) != info["sha256"]):
+            damaged.append(name)
+    if damaged:
+        logger.warning("Каталог модели %s: не совпадают файлы %s", path, damaged)
+    return damaged
+
+
+def read_json(path: str, name: str) -> Any:
+    """Чтение JSON-файла каталога модели"""
+    with open(os.path.join(path, *name.split("/")), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_lines(path: str, name: str) -> List[str]:
+    """Чтение списка строк, записанного BundleWriter.write_lines"""
+    with open(os.path.join(path, *name.split("/")), encoding="utf-8") as f:
+        content = f.read()
+    return content.split("\n") if content else []
@@ -0,0 +1,448 @@
+"""
+Модуль кэширования результатов обработки запросов: ограниченный размер, вытеснение LRU и время жизни записей
+"""
+
+# Импорт стандартных библиотек
+import os  # Для чтения переменных окружения
+import re  # Для нормализации текста запроса
+import threading  # Блокировка при обращении из нескольких потоков
+import time  # Для времени жизни записей
+import weakref  # Реестр кэшей для эндпоинта /metrics
+from collections import OrderedDict  # Порядок использования записей для LRU
+
+# Импорт библиотек для работы с данными
+import numpy as np  # Матрица эмбеддингов запросов семантического кэша
+
+# Импорт типов для аннотаций
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple  # Для типизации кода
+
+# Параметры кэша (переменные окружения)
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))  # Максимум записей в слое
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # Время жизни записи, сек
+
+# Параметры семантического кэша ответов LLM
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # Минимальное косинусное сходство запросов
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # Максимум сохраненных ответов
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # Время жизни ответа, сек
+ANSWER_CACHE_TOP_SOURCES = int(os.getenv("ANSWER_CACHE_TOP_SOURCES", "3"))  # Сколько лучших статей должно совпасть
+
+_MISSING = object()
+
+# Счетчики попаданий, промахов и вытеснений всех кэшей процесса по слоям (для /metrics).
+# Хранятся отдельно от экземпляров: кэш прежнего поколения модели удаляется сборщиком мусора,
+# а счетчики Prometheus не должны уменьшаться
+_totals: Dict[str, Dict[str, int]] = {}
+_totals_lock = threading.Lock()
+
+
+def _count(layer: Optional[str], field: str, amount: int = 1) -> None:
+    """
+    Увеличение счетчика процесса
+
+    Args:
+        layer (Optional[str]): Слой кэша (None — кэш не учитывается в /metrics)
+        field (str): hits, misses или evictions
+        amount (int): Величина увеличения
+    """
+    if layer is None:
+        return
+    with _totals_lock:
+        totals = _totals.setdefault(layer, {"hits": 0, "misses": 0, "evictions": 0})
+        totals[field] += amount
+
+
+def normalize_query(text: str) -> str:
+    """
+    Нормализация текста запроса для ключа кэша: нижний регистр и схлопнутые пробелы
+
+    Args:
+        text (str): Текст запроса
+
+    Returns:
+        str: Нормализованный текст
+    """
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш с ограничением количества записей (вытесняется давно
+    не использованная запись) и временем жизни записи.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic, layer: Optional[str] = None):
+        """
+        Args:
+            max_size (int): Максимальное количество записей
+            ttl (float): Время жизни записи, сек
+            clock (Callable[[], float]): Источник времени
+            layer (Optional[str]): Слой в счетчиках /metrics (None — не учитывается)
+        """
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.clock = clock
+        self.layer = layer
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Значение по ключу (просроченные записи удаляются)
+
+        Args:
+            key (Hashable): Ключ
+            default (Any): Значение при отсутствии записи
+
+        Returns:
+            Any: Значение из кэша или default
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    _count(self.layer, "hits")
+                    return value
+                del self._data[key]
+            self.misses += 1
+            _count(self.layer, "misses")
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохранение значения с вытеснением давно не использованных записей
+
+        Args:
+            key (Hashable): Ключ
+            value (Any): Значение
+        """
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                _count(self.layer, "evictions")
+
+    def clear(self) -> None:
+        """Удаление всех записей"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        """Статистика попаданий"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Все созданные кэши запросов и ответов процесса (для количества записей в /metrics)
+_registry: "weakref.WeakSet" = weakref.WeakSet()
+
+
+class QueryCache:
+    """
+    Многоуровневый кэш запросов, ключ — нормализованный текст запроса:
+    - embedding: эмбеддинг запроса;
+    - ranking: рекомендованные статьи;
+    - fragments: извлеченные фрагменты.
+
+    Все слои очищаются при смене версии модели (переобучение, изменение датасета).
+    """
+    LAYERS = ("embedding", "ranking", "fragments")
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 enabled: bool = QUERY_CACHE_ENABLED):
+        """
+        Args:
+            max_size (int): Максимум записей в слоях ranking и fragments (в слое embedding — в 4 раза больше,
+                так как эмбеддинг занимает несколько килобайт)
+            ttl (float): Время жизни записи, сек
+            enabled (bool): Включен ли кэш
+        """
+        self.enabled = enabled
+        self.version: Optional[str] = None
+        self.layers = {
+            "embedding": TTLCache(max_size * 4, ttl, layer="embedding"),
+            "ranking": TTLCache(max_size, ttl, layer="ranking"),
+            "fragments": TTLCache(max_size, ttl, layer="fragments"),
+        }
+        self._version_lock = threading.Lock()
+        _registry.add(self)
+
+    def ensure_version(self, version: Optional[str]) -> None:
+        """
+        Очистка всех слоев, если версия модели изменилась
+
+        Args:
+            version (Optional[str]): Текущая версия модели
+        """
+        if version == self.version:
+            return
+        with self._version_lock:
+            if version != self.version:
+                for layer in self.layers.values():
+                    layer.clear()
+                self.version = version
+
+    def get(self, layer: str, key: Hashable) -> Any:
+        """
+        Значение слоя по ключу (None — промах или кэш выключен)
+
+        Args:
+            layer (str): Название слоя
+            key (Hashable): Ключ (нормализованный текст запроса и параметры)
+
+        Returns:
+            Any: Значение или None
+        """
+        if not self.enabled:
+            return None
+        return self.layers[layer].get(key)
+
+    def set(self, layer: str, key: Hashable, value: Any) -> None:
+        """
+        Сохранение значения в слой
+
+        Args:
+            layer (str): Название слоя
+            key (Hashable): Ключ
+            value (Any): Значение
+        """
+        if self.enabled:
+            self.layers[layer].set(key, value)
+
+    def clear(self) -> None:
+        """Очистка всех слоев"""
+        for layer in self.layers.values():
+            layer.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Статистика попаданий по слоям"""
+        return {name: layer.stats() for name, layer in self.layers.items()}
+
+
+class SemanticAnswerCache:
+    """
+    Семантический кэш готовых ответов LLM.
+
+    Запись хранит нормализованный эмбеддинг запроса, набор лучших статей поиска и ответ.
+    Ответ переиспользуется, если новый запрос близок к сохраненному
+    (косинусное сходство не ниже threshold) и поиск вернул те же лучшие статьи.
+    Эмбеддинги лежат в одной матрице, поэтому поиск похожего запроса — одно
+    матрично-векторное произведение. Вытесняется давно не использованный ответ,
+    при смене версии модели (обновлении базы знаний) кэш очищается.
+    """
+    LAYER = "answer"  # Слой в статистике и /metrics
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_size: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL, top_sources: int = ANSWER_CACHE_TOP_SOURCES,
+                 enabled: bool = ANSWER_CACHE_ENABLED, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            threshold (float): Минимальное косинусное сходство запросов
+            max_size (int): Максимальное количество ответов
+            ttl (float): Время жизни ответа, сек
+            top_sources (int): Количество лучших статей, которые должны совпасть
+            enabled (bool): Включен ли кэш
+            clock (Callable[[], float]): Источник времени
+        """
+        self.threshold = threshold
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.top_sources = top_sources
+        self.enabled = enabled
+        self.clock = clock
+        self.version: Optional[str] = None
+
+        self._vectors: Optional[np.ndarray] = None  # Эмбеддинги запросов (слот x размерность)
+        self._active = np.zeros(self.max_size, dtype=bool)  # Занятые слоты
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # Слот -> (истекает, статьи, ответ) в порядке использования
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry.add(self)
+
+    def source_key(self, doc_ids: Iterable[int]) -> frozenset:
+        """
+        Ключ совпадения статей: множество top_sources лучших статей
+
+        Args:
+            doc_ids (Iterable[int]): Индексы статей по убыванию релевантности
+
+        Returns:
+            frozenset: Множество индексов
+        """
+        return frozenset(int(doc_id) for doc_id in list(doc_ids)[:self.top_sources])
+
+    def ensure_version(self, version: Optional[str]) -> None:
+        """
+        Очистка кэша, если версия модели изменилась
+
+        Args:
+            version (Optional[str]): Текущая версия модели
+        """
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self._clear_locked()
+                    self.version = version
+
+    def _clear_locked(self) -> None:
+        self._entries.clear()
+        self._active[:] = False
+
+    def clear(self) -> None:
+        """Удаление всех ответов"""
+        with self._lock:
+            self._clear_locked()
+
+    def lookup(self, query_unit: np.ndarray, doc_ids: Iterable[int], version: Optional[str]) -> Optional[Tuple[Any, float]]:
+        """
+        Поиск сохраненного ответа для близкого запроса с теми же лучшими статьями
+
+        Args:
+            query_unit (np.ndarray): Нормализованный эмбеддинг запроса
+            doc_ids (Iterable[int]): Индексы найденных статей по убыванию релевантности
+            version (Optional[str]): Версия модели, на которой найдены статьи. Индексы статей
+                меняются при уплотнении, поэтому ответы другой версии не подходят
+
+        Returns:
+            Optional[Tuple[Any, float]]: Ответ и сходство запросов, либо None
+        """
+        if not self.enabled:
+            return None
+        sources = self.source_key(doc_ids)
+        with self._lock:
+            if version != self.version:
+                self.misses += 1
+                _count(self.LAYER, "misses")
+                return None
+            slots = np.flatnonzero(self._active)
+            if len(slots) and self._vectors is not None:
+                similarities = self._vectors[slots] @ np.asarray(query_unit, dtype=np.float32)
+                now = self.clock()
+                for order in np.argsort(-similarities, kind='stable'):
+                    if similarities[order] < self.threshold:
+                        break
+                    slot = int(slots[order])
+                    expires, entry_sources, answer = self._entries[slot]
+                    if expires <= now:
+                        del self._entries[slot]
+                        self._active[slot] = False
+                        continue
+                    if entry_sources == sources:
+                        self._entries.move_to_end(slot)
+                        self.hits += 1
+                        _count(self.LAYER, "hits")
+                        return answer, float(similarities[order])
+            self.misses += 1
+            _count(self.LAYER, "misses")
+            return None
+
+    def store(self, query_unit: np.ndarray, doc_ids: Iterable[int], answer: Any, version: Optional[str]) -> None:
+        """
+        Сохранение ответа (вытесняется давно не использованный при переполнении).
+        Ответ не сохраняется, если за время генерации версия кэша сменилась:
+        он построен по прежней базе знаний и прежним индексам статей
+
+        Args:
+            query_unit (np.ndarray): Нормализованный эмбеддинг запроса
+            doc_ids (Iterable[int]): Индексы найденных статей по убыванию релевантности
+            answer (Any): Ответ
+            version (Optional[str]): Версия модели, на которой найдены статьи (та же, что в lookup)
+        """
+        if not self.enabled:
+            return
+        query_unit = np.asarray(query_unit, dtype=np.float32)
+        sources = self.source_key(doc_ids)
+        with self._lock:
+            if version != self.version:
+                return
+            if self._vectors is None or self._vectors.shape[1] != query_unit.shape[-1]:
+                self._vectors = np.zeros((self.max_size, query_unit.shape[-1]), dtype=np.float32)
+                self._clear_locked()
+            free = np.flatnonzero(~self._active)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                _count(self.LAYER, "evictions")
+            self._vectors[slot] = query_unit
+            self._active[slot] = True
+            self._entries[slot] = (self.clock() + self.ttl, sources, answer)
+            self._entries.move_to_end(slot)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Статистика попаданий (в формате слоев QueryCache)"""
+        total = self.hits + self.misses
+        return {
+            self.LAYER: {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+        }
+
+
+def render_prometheus(prefix: str = "neyro") -> str:
+    """
+    Статистика попаданий всех кэшей запросов и ответов процесса в текстовом формате Prometheus
+
+    Args:
+        prefix (str): Префикс имен метрик
+
+    Returns:
+        str: Текст для эндпоинта /metrics
+    """
+    # Счетчики — накопленные за время работы процесса, количество записей — у живых кэшей
+    with _totals_lock:
+        totals: Dict[str, Dict[str, float]] = {layer: dict(counts, size=0) for layer, counts in _totals.items()}
+    for query_cache in list(_registry):
+        for layer, stats in query_cache.stats().items():
+            totals.setdefault(layer, {"size": 0, "hits": 0, "misses": 0, "evictions": 0})["size"] += stats["size"]
+
+    metrics = (
+        ("hits_total", "counter", "Попадания в кэш запросов", "hits"),
+        ("misses_total", "counter", "Промахи кэша запросов", "misses"),
+        ("evictions_total", "counter", "Вытеснения записей кэша запросов", "evictions"),
+        ("entries", "gauge", "Количество записей в кэше запросов", "size"),
+    )
+    lines = []
+    for suffix, metric_type, help_text, field in metrics:
+        name = f"{prefix}_query_cache_{suffix}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for layer, total in sorted(totals.items()):
+            lines.append(f'{name}{{layer="{layer}"}} {int(total[field])}')
+
+    name = f"{prefix}_query_cache_hit_ratio"
+    lines.append(f"# HELP {name} Доля попаданий в кэш запросов")
+    lines.append(f"# TYPE {name} gauge")
+    for layer, total in sorted(totals.items()):
+        lookups = total["hits"] + total["misses"]
+        lines.append(f'{name}{{layer="{layer}"}} {total["hits"] / lookups if lookups else 0.0:.6f}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,109 @@
+"""
+Модуль журнала изменений базы знаний: пакеты /ingest, примененные после последнего сохранения каталога модели
+"""
+
+# Импорт стандартных библиотек
+import json  # Записи журнала в формате JSON Lines
+import os  # Для работы с файловой системой и переменных окружения
+import threading  # Запись из нескольких потоков
+
+# Импорт типов для аннотаций
+from typing import Any, List, Tuple  # Для типизации кода
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+CHANGE_LOG_MAX_MB = float(os.getenv("NEYRO_CHANGE_LOG_MAX_MB", "64"))  # Размер журнала, после которого модель сохраняется целиком
+
+
+class ChangeLog:
+    """
+    Журнал изменений рядом с каталогом модели.
+
+    Каждый примененный пакет дописывается одной строкой JSON и сбрасывается на
+    диск, поэтому пакет, подтвержденный Backend, не теряется при перезапуске,
+    а каталог модели не переписывается целиком на каждый пакет. Запись хранит
+    версию сохраненного каталога, к которому применялись изменения: при загрузке
+    повторяются только записи, относящиеся к загруженному каталогу. Журнал
+    очищается после сохранения каталога. Повтор уже сохраненных изменений
+    ничего не меняет (неизмененные статьи пропускаются, удаленные не находятся).
+    """
+
+    def __init__(self, path: str, max_bytes: int = int(CHANGE_LOG_MAX_MB * 1024 * 1024)):
+        """
+        Args:
+            path (str): Путь к файлу журнала
+            max_bytes (int): Размер журнала, после которого нужно сохранить модель (см. full)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._drop_torn_tail()
+
+    def _drop_torn_tail(self) -> None:
+        """Удаление строки, недописанной при аварийной остановке (иначе к ней приклеилась бы следующая запись)"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                logger.warning("Удалена недописанная запись журнала изменений %s", self.path)
+
+    def append(self, base_version: str, upserts: List[Any], deletes: List[Any]) -> None:
+        """
+        Запись пакета изменений
+
+        Args:
+            base_version (str): Версия сохраненного каталога модели
+            upserts (List[Any]): Новые и измененные статьи
+            deletes (List[Any]): Идентификаторы удаленных статей
+        """
+        line = json.dumps({"base_version": base_version, "upserts": upserts, "deletes": deletes}, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, base_version: str) -> List[Tuple[List[Any], List[Any]]]:
+        """
+        Пакеты изменений, примененные к каталогу модели указанной версии
+
+        Args:
+            base_version (str): Версия загруженного каталога модели
+
+        Returns:
+            List[Tuple[List[Any], List[Any]]]: Пары (upserts, deletes) в порядке применения
+        """
+        if not os.path.exists(self.path):
+            return []
+        changes, skipped = [], 0
+        with self._lock, open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Пропущена поврежденная запись журнала изменений %s", self.path)
+                    continue
+                if record["base_version"] != base_version:
+                    skipped += 1
+                    continue
+                changes.append((record["upserts"], record["deletes"]))
+        if skipped:
+            logger.warning("Пропущено записей журнала изменений другой версии модели: %d (каталог модели заменен)", skipped)
+        return changes
+
+    def clear(self) -> None:
+        """Очистка журнала после сохранения каталога модели"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    @property
+    def full(self) -> bool:
+        """Превысил ли журнал max_bytes"""
+        try:
+            return os.path.getsize(self.path) >= self.max_bytes
+        except OSError:
+            return False
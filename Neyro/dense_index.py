@@ -0,0 +1,241 @@
+"""
+Модуль с индексом приближенного поиска ближайших соседей по эмбеддингам статей базы знаний
+"""
+
+# Импорт библиотек для работы с данными и математических операций
+import json  # Для сохранения параметров индекса
+import logging  # Для вывода сообщений о недоступных зависимостях
+import os  # Для работы с файловой системой
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+
+# Импорт типов для аннотаций
+from typing import Optional, Tuple  # Для типизации кода
+
+# FAISS строит HNSW/IVF индексы в процессе приложения; без него используется точный перебор
+try:
+    import faiss
+except ImportError:
+    faiss = None
+    logging.getLogger(__name__).warning("Библиотека faiss не установлена, плотный поиск будет выполняться полным перебором")
+
+
+class DenseIndex:
+    """
+    Индекс для первого этапа плотного поиска (dense retrieval) по эмбеддингам документов.
+
+    Эмбеддинги нормализуются, поэтому скалярное произведение равно косинусному сходству.
+    Поддерживаются графовый индекс HNSW и кластерный индекс IVF из FAISS.
+    Параметр search_effort управляет балансом полноты и задержки:
+    для HNSW это efSearch, для IVF — количество просматриваемых кластеров (nprobe).
+    """
+    METHODS = ("hnsw", "ivf", "flat")
+    INDEX_FILE = "dense.faiss"
+    META_FILE = "meta.json"
+    EMBEDDINGS_FILE = "embeddings.npy"
+
+    def __init__(self, method: str = "hnsw", search_effort: int = 64, hnsw_m: int = 32,
+                 ef_construction: int = 200, ivf_lists: Optional[int] = None):
+        """
+        Инициализация параметров индекса
+
+        Args:
+            method (str): Тип индекса: "hnsw", "ivf" или "flat" (точный перебор)
+            search_effort (int): efSearch для HNSW или nprobe для IVF
+            hnsw_m (int): Количество связей вершины в графе HNSW
+            ef_construction (int): Ширина поиска при построении графа HNSW
+            ivf_lists (Optional[int]): Количество кластеров IVF (по умолчанию ~4 * sqrt(N))
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Неизвестный тип плотного индекса: {method}")
+        self.method = method
+        self.search_effort = search_effort
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ivf_lists = ivf_lists
+
+        self.index = None  # Индекс FAISS
+        self.embeddings = None  # Нормализованные эмбеддинги для точного перебора без FAISS
+        self.dimension = 0
+        self.size = 0
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """Приведение векторов к единичной длине (float32, C-порядок)"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def build(self, embeddings: np.ndarray) -> 'DenseIndex':
+        """
+        Построение индекса по эмбеддингам документов
+
+        Args:
+            embeddings (np.ndarray): Матрица эмбеддингов (документ x размерность)
+
+        Returns:
+            DenseIndex: Этот же индекс
+        """
+        vectors = self._normalize(embeddings)
+        self.size, self.dimension = vectors.shape
+
+        if faiss is None or self.method == "flat":
+            self.embeddings = vectors
+            return self
+
+        if self.method == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            n_lists = self.ivf_lists or max(1, int(4 * np.sqrt(self.size)))
+            n_lists = min(n_lists, self.size)
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFFlat(quantizer, self.dimension, n_lists, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        index.add(vectors)
+
+        self.index = index
+        self.set_search_effort(self.search_effort)
+        return self
+
+    def add(self, embeddings: np.ndarray) -> None:
+        """
+        Добавление документов в конец индекса (позиции продолжают существующие).
+        Удаление документов из HNSW не поддерживается: удаленные документы
+        отфильтровываются вызывающим кодом и исчезают при перестроении индекса.
+
+        Args:
+            embeddings (np.ndarray): Эмбеддинги добавляемых документов
+        """
+        vectors = self._normalize(embeddings)
+        if len(vectors) == 0:
+            return
+        if self.index is None:
+            self.embeddings = vectors if self.embeddings is None else np.concatenate([self.embeddings, vectors])
+        else:
+            self.index.add(vectors)
+        self.dimension = vectors.shape[1]
+        self.size += len(vectors)
+
+    def rebuilt(self, embeddings: np.ndarray) -> 'DenseIndex':
+        """
+        Новый индекс с теми же параметрами, построенный по другим эмбеддингам
+        (уплотнение после удалений документов)
+
+        Args:
+            embeddings (np.ndarray): Матрица эмбеддингов (документ x размерность)
+
+        Returns:
+            DenseIndex: Новый индекс (текущий не изменяется и может использоваться запросами)
+        """
+        return DenseIndex(
+            method=self.method,
+            search_effort=self.search_effort,
+            hnsw_m=self.hnsw_m,
+            ef_construction=self.ef_construction,
+            ivf_lists=self.ivf_lists,
+        ).build(embeddings)
+
+    def set_search_effort(self, search_effort: int) -> None:
+        """
+        Настройка баланса полноты и задержки поиска
+
+        Args:
+            search_effort (int): efSearch для HNSW или nprobe для IVF (больше — точнее и медленнее)
+        """
+        self.search_effort = search_effort
+        if self.index is None:
+            return
+        if self.method == "hnsw":
+            self.index.hnsw.efSearch = search_effort
+        elif self.method == "ivf":
+            self.index.nprobe = min(search_effort, self.index.nlist)
+
+    def search(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск k ближайших документов к запросу
+
+        Args:
+            query_embedding (np.ndarray): Эмбеддинг запроса
+            k (int): Количество документов
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Индексы документов и косинусные сходства по убыванию сходства
+        """
+        k = min(k, self.size)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        query = self._normalize(np.asarray(query_embedding).reshape(1, -1))
+
+        if self.index is None:
+            scores = self.embeddings @ query[0]
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return top.astype(np.int64), scores[top]
+
+        scores, indices = self.index.search(query, k)
+        # FAISS возвращает -1, если найдено меньше k соседей
+        found = indices[0] >= 0
+        return indices[0][found].astype(np.int64), scores[0][found]
+
+    def save(self, path: str) -> None:
+        """
+        Сохранение индекса в каталог
+
+        Args:
+            path (str): Путь к каталогу индекса
+        """
+        os.makedirs(path, exist_ok=True)
+        if self.index is not None:
+            faiss.write_index(self.index, os.path.join(path, self.INDEX_FILE))
+        else:
+            np.save(os.path.join(path, self.EMBEDDINGS_FILE), self.embeddings)
+
+        meta = {
+            "method": self.method,
+            "search_effort": self.search_effort,
+            "hnsw_m": self.hnsw_m,
+            "ef_construction": self.ef_construction,
+            "ivf_lists": self.ivf_lists,
+            "dimension": self.dimension,
+            "size": self.size,
+            "faiss": self.index is not None,
+        }
+        with open(os.path.join(path, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, search_effort: Optional[int] = None) -> 'DenseIndex':
+        """
+        Загрузка индекса из каталога
+
+        Args:
+            path (str): Путь к каталогу индекса
+            search_effort (Optional[int]): Переопределение efSearch / nprobe
+
+        Returns:
+            DenseIndex: Загруженный индекс
+        """
+        with open(os.path.join(path, cls.META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        dense_index = cls(
+            method=meta["method"],
+            search_effort=meta["search_effort"],
+            hnsw_m=meta["hnsw_m"],
+            ef_construction=meta["ef_construction"],
+            ivf_lists=meta["ivf_lists"],
+        )
+        dense_index.dimension = meta["dimension"]
+        dense_index.size = meta["size"]
+
+        if meta["faiss"]:
+            if faiss is None:
+                raise RuntimeError("Индекс сохранен в формате FAISS, но библиотека faiss не установлена")
+            dense_index.index = faiss.read_index(os.path.join(path, cls.INDEX_FILE))
+        else:
+            dense_index.embeddings = np.load(os.path.join(path, cls.EMBEDDINGS_FILE), mmap_mode="r")
+
+        dense_index.set_search_effort(search_effort or dense_index.search_effort)
+        return dense_index
@@ -0,0 +1,162 @@
+"""
+Модуль с матрицей нормализованных эмбеддингов статей базы знаний
+"""
+
+# Импорт библиотек для работы с данными и математических операций
+import os  # Для работы с файловой системой
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+
+# Импорт типов для аннотаций
+from typing import Optional, Sequence, Union  # Для типизации кода
+
+
+class EmbeddingMatrix:
+    """
+    Матрица эмбеддингов, нормализованных по L2 один раз при обучении.
+
+    Строки хранятся непрерывным блоком (float32 или float16), исходные нормы
+    строк кэшируются. Косинусное сходство с запросом для любого подмножества
+    документов сводится к одному матрично-векторному произведению (BLAS).
+    """
+    # Имена файлов матрицы на диске
+    VECTORS_FILE = "vectors.npy"
+    NORMS_FILE = "norms.npy"
+
+    def __init__(self, vectors: np.ndarray, norms: np.ndarray):
+        """
+        Args:
+            vectors (np.ndarray): Нормализованные эмбеддинги (документ x размерность)
+            norms (np.ndarray): Исходные L2-нормы строк до нормализации
+        """
+        self.vectors = vectors
+        self.norms = norms
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, dtype: Union[str, np.dtype] = "float16") -> 'EmbeddingMatrix':
+        """
+        Нормализация и упаковка эмбеддингов
+
+        Args:
+            embeddings (np.ndarray): Исходные эмбеддинги
+            dtype (Union[str, np.dtype]): Тип хранения: "float16" (вдвое меньше памяти) или "float32"
+
+        Returns:
+            EmbeddingMatrix: Матрица нормализованных эмбеддингов
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        norms = np.linalg.norm(embeddings, axis=1)
+        safe_norms = np.where(norms > 0, norms, 1.0)
+        vectors = np.ascontiguousarray(embeddings / safe_norms[:, None], dtype=dtype)
+        return cls(vectors, norms.astype(np.float32))
+
+    def save(self, path: str) -> None:
+        """
+        Сохранение матрицы в каталог (массивы в формате .npy)
+
+        Args:
+            path (str): Путь к каталогу
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.VECTORS_FILE), np.ascontiguousarray(self.vectors))
+        np.save(os.path.join(path, self.NORMS_FILE), np.ascontiguousarray(self.norms))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'EmbeddingMatrix':
+        """
+        Загрузка матрицы из каталога
+
+        Args:
+            path (str): Путь к каталогу
+            mmap (bool): Открывать ли массивы через отображение в память (страницы общие для всех процессов)
+
+        Returns:
+            EmbeddingMatrix: Загруженная матрица
+        """
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(path, cls.VECTORS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, cls.NORMS_FILE), mmap_mode=mmap_mode)
+        )
+
+    def appended(self, other: 'EmbeddingMatrix') -> 'EmbeddingMatrix':
+        """
+        Новая матрица со строками other после строк этой матрицы
+
+        Args:
+            other (EmbeddingMatrix): Добавляемые эмбеддинги
+
+        Returns:
+            EmbeddingMatrix: Новая матрица (эта не изменяется)
+        """
+        return EmbeddingMatrix(
+            np.concatenate([self.vectors, other.vectors.astype(self.vectors.dtype, copy=False)]),
+            np.concatenate([self.norms, other.norms.astype(self.norms.dtype, copy=False)])
+        )
+
+    def select(self, indices: Sequence[int]) -> 'EmbeddingMatrix':
+        """
+        Новая матрица из указанных строк
+
+        Args:
+            indices (Sequence[int]): Номера строк в новом порядке
+
+        Returns:
+            EmbeddingMatrix: Новая матрица
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return EmbeddingMatrix(np.ascontiguousarray(self.vectors[indices]), np.asarray(self.norms[indices]))
+
+    @staticmethod
+    def normalize(vector: np.ndarray) -> np.ndarray:
+        """
+        Нормализация эмбеддинга (или строк матрицы) запроса в float32
+
+        Args:
+            vector (np.ndarray): Эмбеддинг запроса
+
+        Returns:
+            np.ndarray: Вектор единичной длины
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+        return vector / np.where(norm > 0, norm, 1.0)
+
+    def scores(self, query_unit: np.ndarray, indices: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Косинусное сходство нормализованного запроса с документами
+
+        Args:
+            query_unit (np.ndarray): Эмбеддинг запроса, уже нормализованный через normalize()
+            indices (Optional[Sequence[int]]): Индексы документов (по умолчанию все)
+
+        Returns:
+            np.ndarray: Сходства в порядке indices
+        """
+        rows = self.vectors if indices is None else self.vectors[np.asarray(indices, dtype=np.int64)]
+        if rows.dtype != np.float32:
+            # BLAS не умножает float16, поэтому выбранные строки приводятся к float32
+            rows = rows.astype(np.float32)
+        return rows @ query_unit
+
+    def dense(self, indices: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Нормализованные эмбеддинги в float32 (например, для построения ANN-индекса)
+
+        Args:
+            indices (Optional[Sequence[int]]): Индексы документов (по умолчанию все)
+
+        Returns:
+            np.ndarray: Матрица float32
+        """
+        rows = self.vectors if indices is None else self.vectors[np.asarray(indices, dtype=np.int64)]
+        return np.asarray(rows, dtype=np.float32)
+
+    @property
+    def shape(self):
+        """Размер матрицы (документ x размерность)"""
+        return self.vectors.shape
+
+    def __len__(self) -> int:
+        return len(self.vectors)
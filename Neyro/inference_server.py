@@ -0,0 +1,217 @@
+"""
+Модуль процесса инференса: единственная копия моделей сервиса, к которой HTTP-воркеры
+обращаются через Unix-сокет (режим пула remote, см. serving.RemotePool)
+"""
+
+# Импорт стандартных библиотек
+import asyncio  # Сервер Unix-сокета
+import multiprocessing  # Запуск процесса инференса из app.py
+import os  # Для работы с файловой системой
+import pickle  # Проверка сериализуемости ошибок
+import stat  # Проверка прав каталога сокета
+
+# Импорт типов для аннотаций
+from typing import Any, Awaitable, Callable, Dict, Optional  # Для типизации кода
+
+import cache  # Статистика кэша запросов для /metrics
+import serving  # Пул инференса и протокол сообщений
+import tracing  # Гистограммы этапов для /metrics
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+# Методы ассистента, доступные воркерам: через очередь допуска пула, потоковые и управляющие (вне очереди)
+CALL_METHODS = frozenset({"get_answer", "get_recommendations", "analyze_query"})
+STREAM_METHODS = frozenset({"stream_answer"})
+CONTROL_METHODS = frozenset({
+    "apply_changes", "compact_index", "get_reasoning", "model_status", "reload_model", "health", "metrics"
+})
+SERVER_METHODS = frozenset({"health", "metrics"})  # Методы самого процесса инференса
+
+
+class InferenceServer:
+    """
+    Сервер процесса инференса.
+
+    Вызовы воркеров выполняются пулом потоков serving.InferencePool с общей для
+    всех воркеров очередью допуска; индексы модели отображены в память из
+    каталога модели, а SentenceTransformer, CrossEncoder и LLM загружены один раз.
+    Каждое соединение обслуживает несколько запросов одновременно: ответы
+    снабжаются номером запроса из сообщения воркера.
+    """
+
+    def __init__(self, target: Any, path: str = serving.INFERENCE_SOCKET):
+        """
+        Args:
+            target (Any): Ассистент (assistant.HybridAssistant)
+            path (str): Путь к Unix-сокету
+        """
+        self.target = target
+        self.path = path
+        self.pool = serving.InferencePool(target=target, kind="thread")
+
+    def health(self) -> Dict[str, Any]:
+        """Состояние модели и пула для эндпоинта /health воркеров"""
+        model = self.target.model
+        return {
+            "model_initialized": self.target.is_initialized,
+            "model_version": model.model_version if model is not None else None,
+            "pool": self.pool.stats(),
+            "llm": self.target.llm_stats(),
+        }
+
+    def metrics(self) -> str:
+        """Метрики этапов и кэша процесса инференса в формате Prometheus"""
+        return tracing.metrics.render_prometheus() + cache.render_prometheus()
+
+    async def serve(self) -> None:
+        """Прием соединений воркеров до остановки процесса"""
+        prepare_socket_directory(os.path.dirname(os.path.abspath(self.path)))
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Сокет, оставшийся от прежнего запуска
+        # Сокет создается сразу с правами 0600: между bind и chmod к нему могли бы подключиться другие пользователи
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        finally:
+            os.umask(umask)
+        logger.info("Процесс инференса принимает запросы на %s", self.path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Чтение запросов одного воркера; каждый запрос выполняется отдельной задачей"""
+        write_lock = asyncio.Lock()
+        tasks: Dict[int, asyncio.Task] = {}
+
+        async def send(message: Dict[str, Any]) -> None:
+            async with write_lock:
+                serving.write_message(writer, message)
+                await writer.drain()
+
+        try:
+            while True:
+                message = await serving.read_message(reader)
+                if message["op"] == "cancel":
+                    task = tasks.pop(message["id"], None)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                task = asyncio.create_task(self._dispatch(message, send))
+                tasks[message["id"]] = task
+                task.add_done_callback(lambda _, request_id=message["id"]: tasks.pop(request_id, None))
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            # Воркер отключился: потоки ответов прекращаются, начатые вызовы завершаются в пуле
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(self, message: Dict[str, Any], send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Выполнение запроса воркера и отправка результата или ошибки"""
+        request_id = message["id"]
+        operation, method = message["op"], message["method"]
+        args, kwargs = message.get("args", ()), message.get("kwargs", {})
+        try:
+            if operation == "call" and method in CALL_METHODS:
+                value = await self.pool.call(method, *args, timeout=message.get("timeout"), **kwargs)
+            elif operation == "control" and method in CONTROL_METHODS:
+                target = self if method in SERVER_METHODS else self.target
+                value = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: getattr(target, method)(*args, **kwargs)
+                )
+            elif operation == "stream" and method in STREAM_METHODS:
+                await self._stream(request_id, method, args, kwargs, message.get("timeout"), send)
+                return
+            else:
+                raise serving.RemoteCallError(f"Метод {method} недоступен для операции {operation}")
+        except Exception as e:
+            await send({"id": request_id, "kind": "error", "error": self._transferable(e)})
+            return
+        await send({"id": request_id, "kind": "result", "value": value})
+
+    async def _stream(self, request_id: int, method: str, args: tuple, kwargs: Dict[str, Any],
+                      timeout: Optional[float], send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Пересылка элементов метода-генератора по мере их появления"""
+        events = self.pool.stream(method, *args, timeout=timeout, **kwargs)
+        await send({"id": request_id, "kind": "started"})
+        try:
+            async for item in events:
+                await send({"id": request_id, "kind": "item", "value": item})
+        finally:
+            # При отмене (воркер закрыл поток) генератор останавливается после текущего элемента
+            await events.aclose()
+        await send({"id": request_id, "kind": "end"})
+
+    @staticmethod
+    def _transferable(error: Exception) -> Exception:
+        """Ошибка в виде, который можно передать воркеру"""
+        try:
+            pickle.dumps(error)
+            return error
+        except Exception:
+            return serving.RemoteCallError(f"{type(error).__name__}: {error}")
+
+
+def prepare_socket_directory(directory: str) -> None:
+    """
+    Создание каталога сокета с правами 0700 и проверка, что каталог принадлежит
+    пользователю сервиса и закрыт для остальных (иначе сокет можно подменить)
+
+    Args:
+        directory (str): Каталог Unix-сокета
+
+    Raises:
+        PermissionError: Каталог принадлежит другому пользователю, доступен другим
+            пользователям или является символической ссылкой
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"Каталог сокета {directory} не принадлежит пользователю сервиса")
+    if info.st_mode & 0o077:
+        raise PermissionError(
+            f"Каталог сокета {directory} доступен другим пользователям (права {stat.S_IMODE(info.st_mode):o}, нужны 700)"
+        )
+
+
+def run_server(path: str = serving.INFERENCE_SOCKET) -> None:
+    """
+    Загрузка модели и обслуживание воркеров до остановки процесса
+
+    Args:
+        path (str): Путь к Unix-сокету
+    """
+    from assistant import HybridAssistant  # Модели загружаются только в процессе инференса
+
+    server = InferenceServer(HybridAssistant(), path)
+    try:
+        asyncio.run(server.serve())
+    finally:
+        server.pool.shutdown()
+
+
+def start_process(path: str = serving.INFERENCE_SOCKET) -> multiprocessing.Process:
+    """
+    Запуск процесса инференса (не демон: обучение модели использует собственный пул процессов)
+
+    Args:
+        path (str): Путь к Unix-сокету
+
+    Returns:
+        multiprocessing.Process: Процесс инференса
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_server, args=(path,), name="neyro-inference"
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,408 @@
+"""
+Модуль сред выполнения LLM: единый интерфейс генерации для transformers, llama.cpp и ONNX Runtime
+"""
+
+# Импорт стандартных библиотек
+import copy  # Копия KV-кэша префикса для каждой генерации
+import os  # Для чтения переменных окружения
+import threading  # Поток генерации при потоковой выдаче и блокировка llama.cpp
+
+# Импорт типов для аннотаций
+from typing import Any, Callable, Dict, Iterator, Optional  # Для типизации кода
+
+from llm_scheduler import LLM_BATCHING, GenerationScheduler  # Непрерывное пакетирование генерации
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+# Каждая среда выполнения необязательна: устанавливается только используемая
+try:
+    import torch  # Динамическое int8-квантование для transformers
+    from transformers import AutoTokenizer, TextIteratorStreamer, pipeline  # Модели Hugging Face
+except ImportError:
+    torch = None
+    AutoTokenizer = TextIteratorStreamer = pipeline = None
+
+try:
+    from llama_cpp import Llama  # Квантованные GGUF-модели (int4/int8) на CPU
+except ImportError:
+    Llama = None
+
+try:
+    from optimum.onnxruntime import ORTModelForCausalLM  # Экспортированные и квантованные ONNX-модели
+except ImportError:
+    ORTModelForCausalLM = None
+
+# Параметры LLM (переменные окружения)
+LLM_BACKEND = os.getenv("NEYRO_LLM_BACKEND", "transformers")  # transformers, llamacpp или onnx
+LLM_MODEL = os.getenv("NEYRO_LLM_MODEL")  # Идентификатор модели или путь к локальным файлам (по умолчанию см. DEFAULT_MODELS)
+LLM_QUANTIZE = os.getenv("NEYRO_LLM_QUANTIZE", "")  # transformers: "int8" — динамическое квантование линейных слоев
+LLM_THREADS = int(os.getenv("NEYRO_LLM_THREADS", "0"))  # Потоков CPU для llama.cpp (0 — все ядра)
+LLM_CONTEXT = int(os.getenv("NEYRO_LLM_CONTEXT", "4096"))  # Размер контекста llama.cpp, токенов
+
+# Модель по умолчанию для каждой среды выполнения
+DEFAULT_MODELS = {
+    "transformers": "microsoft/Phi-3-mini-4k-instruct",
+    "llamacpp": "models/Phi-3-mini-4k-instruct-q4.gguf",
+    "onnx": "models/Phi-3-mini-4k-instruct-onnx-int8",
+}
+
+# Служебные токены Phi-3, завершающие ответ
+STOP_SEQUENCES = ["<|end|>", "<|endoftext|>", "<|user|>"]
+
+
+class LLMBackend:
+    """
+    Интерфейс среды выполнения LLM.
+
+    generate() возвращает только сгенерированный текст (без промпта), stream() —
+    тот же текст фрагментами по мере генерации. Параметры генерации одинаковы
+    для всех сред: max_new_tokens, temperature, top_p и do_sample.
+    """
+    name = "base"
+
+    def generate(self, prompt: str, max_new_tokens: int = 256, temperature: float = 0.7,
+                 top_p: float = 0.9, do_sample: bool = True) -> str:
+        """
+        Генерация продолжения промпта
+
+        Args:
+            prompt (str): Промпт
+            max_new_tokens (int): Максимум новых токенов
+            temperature (float): Температура выборки
+            top_p (float): Порог nucleus-выборки
+            do_sample (bool): Случайная выборка (False — жадная генерация)
+
+        Returns:
+            str: Сгенерированный текст
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt: str, max_new_tokens: int = 256, temperature: float = 0.7,
+               top_p: float = 0.9, do_sample: bool = True) -> Iterator[str]:
+        """
+        Потоковая генерация продолжения промпта (параметры как у generate)
+
+        Yields:
+            str: Очередной фрагмент сгенерированного текста
+        """
+        raise NotImplementedError
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Количество токенов текста (без служебных токенов начала)
+
+        Args:
+            text (str): Текст
+
+        Returns:
+            int: Количество токенов
+        """
+        raise NotImplementedError
+
+    def register_prefix(self, prefix: str) -> None:
+        """
+        Предварительный расчет KV-кэша неизменного начала промптов: промпты, которые
+        начинаются с зарегистрированного префикса, проходят prefill только для
+        оставшейся части. Среды без поддержки ничего не делают.
+
+        Args:
+            prefix (str): Неизменное начало промптов
+        """
+
+    def describe(self) -> Dict[str, Any]:
+        """Описание среды выполнения для логов и эндпоинта проверки здоровья"""
+        return {"backend": self.name}
+
+
+def _stream_from_thread(tokenizer, run: Callable[[Any], None]) -> Iterator[str]:
+    """
+    Потоковая выдача для генераторов Hugging Face: run(streamer) выполняется
+    в отдельном потоке, текст читается из TextIteratorStreamer
+
+    Args:
+        tokenizer: Токенизатор модели
+        run (Callable[[Any], None]): Вызов генерации с переданным стримером
+
+    Yields:
+        str: Очередной фрагмент текста
+    """
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+
+    def target():
+        try:
+            run(streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=target, name="neyro-llm-stream", daemon=True)
+    thread.start()
+    for chunk in streamer:
+        if chunk:
+            yield chunk
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+class TransformersBackend(LLMBackend):
+    """
+    Модель Hugging Face через pipeline("text-generation"). При quantize="int8"
+    линейные слои квантуются динамически (torch.quantization.quantize_dynamic),
+    что уменьшает память весов примерно вчетверо и ускоряет генерацию на CPU.
+    При batching=True одновременные вызовы generate и stream генерируются
+    общими проходами модели через GenerationScheduler.
+    """
+    name = "transformers"
+
+    def __init__(self, model: str = DEFAULT_MODELS["transformers"], quantize: str = LLM_QUANTIZE,
+                 batching: bool = LLM_BATCHING):
+        """
+        Args:
+            model (str): Идентификатор модели Hugging Face или путь к ней
+            quantize (str): "" — без квантования, "int8" — динамическое квантование на CPU
+            batching (bool): Непрерывное пакетирование одновременных генераций
+        """
+        if pipeline is None:
+            raise ImportError("Для NEYRO_LLM_BACKEND=transformers требуются transformers и torch")
+        self.model = model
+        self.quantize = quantize
+        self.pipeline = pipeline("text-generation", model=model, trust_remote_code=True)
+        if quantize == "int8":
+            self.pipeline.model = torch.quantization.quantize_dynamic(
+                self.pipeline.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif quantize:
+            raise ValueError(f"Неподдерживаемое квантование для transformers: {quantize}")
+        self.tokenizer = self.pipeline.tokenizer
+        self.scheduler = (
+            GenerationScheduler(self.pipeline.model, self.tokenizer, stop_tokens=STOP_SEQUENCES) if batching else None
+        )
+        self._prefixes = []  # (токены префикса, KV-кэш) для генерации без планировщика
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def register_prefix(self, prefix):
+        prefix_ids = self.tokenizer(prefix)["input_ids"]
+        if self.scheduler is not None:
+            self.scheduler.register_prefix(prefix_ids)
+            return
+        model = self.pipeline.model
+        with torch.inference_mode():
+            outputs = model(input_ids=torch.tensor([prefix_ids], device=model.device), use_cache=True)
+        self._prefixes.append((prefix_ids, outputs.past_key_values))
+        self._prefixes.sort(key=lambda item: -len(item[0]))
+        logger.info("KV-кэш префикса промпта: %d токенов", len(prefix_ids))
+
+    def _match_prefix(self, prompt):
+        """Токены промпта и KV-кэш самого длинного подходящего префикса (или None)"""
+        if not self._prefixes:
+            return None, None
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        for prefix_ids, past_key_values in self._prefixes:
+            # Нужен хотя бы один токен после префикса, иначе модели нечего обработать
+            if len(prompt_ids) > len(prefix_ids) and prompt_ids[:len(prefix_ids)] == prefix_ids:
+                return prompt_ids, past_key_values
+        return prompt_ids, None
+
+    def _generate_from_prefix(self, prompt_ids, past_key_values, kwargs, streamer=None):
+        """Генерация с KV-кэшем префикса: generate обрабатывает только токены после него"""
+        model = self.pipeline.model
+        input_ids = torch.tensor([prompt_ids], device=model.device)
+        output_ids = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            # generate дописывает кэш, поэтому каждая генерация получает свою копию
+            past_key_values=copy.deepcopy(past_key_values),
+            streamer=streamer,
+            **kwargs
+        )
+        return output_ids[0][len(prompt_ids):]
+
+    def _generation_kwargs(self, max_new_tokens, temperature, top_p, do_sample) -> Dict[str, Any]:
+        return {
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample,
+            "eos_token_id": self.tokenizer.eos_token_id,
+            # Используем eos, если pad не задан
+            "pad_token_id": self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id,
+        }
+
+    def generate(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        if self.scheduler is not None:
+            return self.scheduler.generate(prompt, max_new_tokens=max_new_tokens, temperature=temperature,
+                                           top_p=top_p, do_sample=do_sample)
+        kwargs = self._generation_kwargs(max_new_tokens, temperature, top_p, do_sample)
+        prompt_ids, past_key_values = self._match_prefix(prompt)
+        if past_key_values is not None:
+            new_tokens = self._generate_from_prefix(prompt_ids, past_key_values, kwargs)
+            return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+        outputs = self.pipeline(prompt, return_full_text=False, **kwargs)
+        return outputs[0]['generated_text']
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        if self.scheduler is not None:
+            return self.scheduler.stream(prompt, max_new_tokens=max_new_tokens, temperature=temperature,
+                                         top_p=top_p, do_sample=do_sample)
+        kwargs = self._generation_kwargs(max_new_tokens, temperature, top_p, do_sample)
+        prompt_ids, past_key_values = self._match_prefix(prompt)
+        if past_key_values is not None:
+            return _stream_from_thread(
+                self.tokenizer,
+                lambda streamer: self._generate_from_prefix(prompt_ids, past_key_values, kwargs, streamer=streamer)
+            )
+        return _stream_from_thread(
+            self.tokenizer, lambda streamer: self.pipeline(prompt, streamer=streamer, **kwargs)
+        )
+
+    def describe(self):
+        return {
+            "backend": self.name,
+            "model": self.model,
+            "quantize": self.quantize or None,
+            "batching": self.scheduler.stats() if self.scheduler is not None else None,
+        }
+
+
+class LlamaCppBackend(LLMBackend):
+    """
+    Квантованная GGUF-модель (например, Phi-3-mini q4) через llama.cpp.
+    Контекст llama.cpp не допускает одновременных вызовов, поэтому генерации
+    выполняются по очереди. KV-кэш общего начала с предыдущим промптом
+    llama.cpp переиспользует сам.
+    """
+    name = "llamacpp"
+
+    def __init__(self, model: str = DEFAULT_MODELS["llamacpp"], n_ctx: int = LLM_CONTEXT, n_threads: int = LLM_THREADS):
+        """
+        Args:
+            model (str): Путь к файлу .gguf
+            n_ctx (int): Размер контекста, токенов
+            n_threads (int): Потоков CPU (0 — все ядра)
+        """
+        if Llama is None:
+            raise ImportError("Для NEYRO_LLM_BACKEND=llamacpp требуется пакет llama-cpp-python")
+        if not os.path.exists(model):
+            raise FileNotFoundError(f"Файл модели GGUF {model} не найден")
+        self.model = model
+        self.n_threads = n_threads or os.cpu_count()
+        self.llm = Llama(model_path=model, n_ctx=n_ctx, n_threads=self.n_threads, verbose=False)
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def register_prefix(self, prefix):
+        # Префикс обрабатывается заранее, чтобы его кэшем воспользовался уже первый запрос
+        with self._lock:
+            self.llm.reset()
+            self.llm.eval(self.llm.tokenize(prefix.encode("utf-8")))
+
+    @staticmethod
+    def _generation_kwargs(max_new_tokens, temperature, top_p, do_sample) -> Dict[str, Any]:
+        return {
+            "max_tokens": max_new_tokens,
+            # Температура 0 в llama.cpp — жадная генерация
+            "temperature": temperature if do_sample else 0.0,
+            "top_p": top_p,
+            "stop": STOP_SEQUENCES,
+        }
+
+    def generate(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        with self._lock:
+            output = self.llm(prompt, **self._generation_kwargs(max_new_tokens, temperature, top_p, do_sample))
+        return output["choices"][0]["text"]
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        with self._lock:
+            for chunk in self.llm(prompt, stream=True, **self._generation_kwargs(max_new_tokens, temperature, top_p, do_sample)):
+                text = chunk["choices"][0]["text"]
+                if text:
+                    yield text
+
+    def describe(self):
+        return {"backend": self.name, "model": self.model, "threads": self.n_threads}
+
+
+class OnnxBackend(LLMBackend):
+    """
+    Модель, экспортированная в ONNX и квантованная заранее (например,
+    optimum-cli export onnx и ORTQuantizer), через ONNX Runtime на CPU.
+    """
+    name = "onnx"
+
+    def __init__(self, model: str = DEFAULT_MODELS["onnx"]):
+        """
+        Args:
+            model (str): Каталог с ONNX-моделью и токенизатором
+        """
+        if ORTModelForCausalLM is None or AutoTokenizer is None:
+            raise ImportError("Для NEYRO_LLM_BACKEND=onnx требуется пакет optimum[onnxruntime]")
+        if not os.path.isdir(model):
+            raise FileNotFoundError(f"Каталог ONNX-модели {model} не найден")
+        self.model = model
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.onnx_model = ORTModelForCausalLM.from_pretrained(model, provider="CPUExecutionProvider")
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _generate(self, prompt, max_new_tokens, temperature, top_p, do_sample, streamer=None):
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        output_ids = self.onnx_model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=do_sample,
+            pad_token_id=self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id,
+            streamer=streamer,
+        )
+        return output_ids[0][inputs["input_ids"].shape[1]:]
+
+    def generate(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        new_tokens = self._generate(prompt, max_new_tokens, temperature, top_p, do_sample)
+        return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.7, top_p=0.9, do_sample=True):
+        return _stream_from_thread(
+            self.tokenizer,
+            lambda streamer: self._generate(prompt, max_new_tokens, temperature, top_p, do_sample, streamer=streamer)
+        )
+
+    def describe(self):
+        return {"backend": self.name, "model": self.model}
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    LlamaCppBackend.name: LlamaCppBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_llm_backend(kind: Optional[str] = None, model: Optional[str] = None) -> LLMBackend:
+    """
+    Создание среды выполнения LLM по настройкам
+
+    Args:
+        kind (Optional[str]): transformers, llamacpp или onnx (по умолчанию NEYRO_LLM_BACKEND)
+        model (Optional[str]): Модель или путь к ней (по умолчанию NEYRO_LLM_MODEL или DEFAULT_MODELS)
+
+    Returns:
+        LLMBackend: Загруженная модель
+
+    Raises:
+        ValueError: Неизвестная среда выполнения
+    """
+    kind = (kind or LLM_BACKEND).strip().lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"Неизвестная среда выполнения LLM: {kind} (допустимо: {', '.join(BACKENDS)})")
+    backend = BACKENDS[kind](model or LLM_MODEL or DEFAULT_MODELS[kind])
+    logger.info("LLM загружена: %s", backend.describe())
+    return backend
@@ -0,0 +1,404 @@
+"""
+Модуль непрерывного пакетирования генерации LLM: последовательности разных запросов
+генерируются общими проходами модели и выдаются каждому вызывающему по мере готовности
+"""
+
+# Импорт стандартных библиотек
+import collections  # Очередь ожидающих запросов
+import os  # Для чтения переменных окружения
+import queue  # Передача текста из потока планировщика вызывающему
+import threading  # Поток планировщика
+
+# Импорт типов для аннотаций
+from typing import Any, Dict, Iterator, List, Optional  # Для типизации кода
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+try:
+    import torch  # Прямые проходы модели и выборка токенов
+    from transformers import DynamicCache  # Формат KV-кэша новых версий transformers
+except ImportError:
+    torch = None
+    DynamicCache = None
+
+logger = get_logger(__name__)
+
+# Параметры планировщика (переменные окружения)
+LLM_BATCHING = os.getenv("NEYRO_LLM_BATCHING", "1").lower() in ("1", "true", "yes", "on")
+LLM_MAX_BATCH_TOKENS = int(os.getenv("NEYRO_LLM_MAX_BATCH_TOKENS", "8192"))  # Промпты и новые токены всех последовательностей пакета
+LLM_MAX_BATCH_SIZE = int(os.getenv("NEYRO_LLM_MAX_BATCH_SIZE", "8"))  # Максимум одновременно генерируемых последовательностей
+
+_END = object()
+
+
+def _to_legacy(past_key_values):
+    """KV-кэш в виде кортежа слоев (key, value) формы [пакет, головы, длина, размерность]"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _from_legacy(past_key_values):
+    """KV-кэш в формате, который принимает модель"""
+    if DynamicCache is not None and hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past_key_values)
+    return past_key_values
+
+
+class _Sequence:
+    """Генерируемая последовательность одного запроса"""
+
+    def __init__(self, prompt_ids: List[int], params: Dict[str, Any]):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = int(params.get("max_new_tokens", 256))
+        self.temperature = float(params.get("temperature", 0.7))
+        self.top_p = float(params.get("top_p", 0.9))
+        self.do_sample = bool(params.get("do_sample", True))
+        self.generated: List[int] = []
+        self.emitted_text = ""
+        self.output: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.cancelled = False
+        self.finished = False
+        self.prefix = None  # (токены, KV-кэш) зарегистрированного префикса промпта
+
+    @property
+    def reserved_tokens(self) -> int:
+        """Токены, которые последовательность может занять в пакете"""
+        return len(self.prompt_ids) + self.max_new_tokens
+
+
+class GenerationScheduler:
+    """
+    Планировщик генерации с непрерывным пакетированием для модели transformers.
+
+    Фоновый поток держит пакет активных последовательностей с общим KV-кэшем
+    (промпты выровнены по правому краю, паддинг закрыт маской внимания). На каждом
+    шаге модель делает один проход сразу для всех последовательностей пакета.
+    Новые запросы присоединяются между шагами: их промпты обрабатываются отдельным
+    проходом, и кэши объединяются. Завершившиеся последовательности (служебный
+    токен конца, лимит токенов или отключение клиента) удаляются из пакета сразу,
+    не дожидаясь остальных. Сумма длин промптов и лимитов новых токенов пакета
+    не превышает max_batch_tokens. Для промптов с зарегистрированным префиксом
+    (register_prefix) prefill выполняется только для части после префикса.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_tokens: int = LLM_MAX_BATCH_TOKENS,
+                 max_batch_size: int = LLM_MAX_BATCH_SIZE, stop_tokens: Optional[List[str]] = None):
+        """
+        Args:
+            model: Модель transformers (AutoModelForCausalLM)
+            tokenizer: Токенизатор модели
+            max_batch_tokens (int): Максимум токенов (промпты и новые токены) в пакете
+            max_batch_size (int): Максимум последовательностей в пакете
+            stop_tokens (Optional[List[str]]): Служебные токены, завершающие последовательность
+        """
+        if torch is None:
+            raise ImportError("Для пакетной генерации требуются torch и transformers")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max(1, max_batch_size)
+        self.device = getattr(model, "device", torch.device("cpu"))
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+        self.stop_token_ids = {tokenizer.eos_token_id}
+        for token in stop_tokens or []:
+            token_id = tokenizer.convert_tokens_to_ids(token)
+            if isinstance(token_id, int) and token_id != tokenizer.unk_token_id:
+                self.stop_token_ids.add(token_id)
+        self.stop_token_ids.discard(None)
+
+        self._prefixes = []  # (токены префикса, KV-кэш), самые длинные первыми
+        self._waiting: "collections.deque[_Sequence]" = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Состояние пакета (только для потока планировщика)
+        self._active: List[_Sequence] = []
+        self._past = None  # Кортеж слоев (key, value)
+        self._attention_mask = None  # [пакет, длина кэша]
+        self._next_tokens = None  # [пакет] — токены, еще не прошедшие через модель
+
+        self.steps = 0
+        self.sequences_done = 0
+        self.prefix_hits = 0
+        self._batch_size_total = 0
+
+    def _ensure_started(self) -> None:
+        """Запуск потока планировщика при первом запросе"""
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="neyro-llm-scheduler", daemon=True)
+                self._thread.start()
+
+    def register_prefix(self, prefix_ids: List[int]) -> None:
+        """
+        Расчет KV-кэша неизменного начала промптов
+
+        Args:
+            prefix_ids (List[int]): Токены префикса (как в начале токенизированного промпта)
+        """
+        input_ids = torch.tensor([prefix_ids], dtype=torch.long, device=self.device)
+        with torch.inference_mode():
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        with self._condition:
+            self._prefixes.append((list(prefix_ids), _to_legacy(outputs.past_key_values)))
+            self._prefixes.sort(key=lambda item: -len(item[0]))
+        logger.info("KV-кэш префикса промпта: %d токенов", len(prefix_ids))
+
+    def _match_prefix(self, prompt_ids: List[int]):
+        """Самый длинный зарегистрированный префикс промпта (нужен хотя бы один токен после него)"""
+        for prefix in self._prefixes:
+            prefix_ids = prefix[0]
+            if len(prompt_ids) > len(prefix_ids) and prompt_ids[:len(prefix_ids)] == prefix_ids:
+                return prefix
+        return None
+
+    def stream(self, prompt: str, **params) -> Iterator[str]:
+        """
+        Постановка промпта в очередь и потоковое получение сгенерированного текста
+
+        Args:
+            prompt (str): Промпт
+            **params: max_new_tokens, temperature, top_p, do_sample
+
+        Yields:
+            str: Очередной фрагмент сгенерированного текста
+        """
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        sequence = _Sequence(prompt_ids, params)
+        sequence.prefix = self._match_prefix(prompt_ids)
+        if sequence.reserved_tokens > self.max_batch_tokens:
+            logger.warning("Запрос на %d токенов больше NEYRO_LLM_MAX_BATCH_TOKENS=%d и будет сгенерирован отдельно",
+                           sequence.reserved_tokens, self.max_batch_tokens)
+        self._ensure_started()
+        with self._condition:
+            self._waiting.append(sequence)
+            self._condition.notify()
+
+        try:
+            while True:
+                item = sequence.output.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Клиент перестал читать: последовательность удаляется из пакета на следующем шаге
+            sequence.cancelled = True
+
+    def generate(self, prompt: str, **params) -> str:
+        """
+        Генерация текста целиком (параметры как у stream)
+
+        Returns:
+            str: Сгенерированный текст
+        """
+        return "".join(self.stream(prompt, **params))
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние планировщика для эндпоинта проверки здоровья"""
+        return {
+            "active": len(self._active),
+            "waiting": len(self._waiting),
+            "steps": self.steps,
+            "sequences_done": self.sequences_done,
+            "prefix_hits": self.prefix_hits,
+            "mean_batch_size": round(self._batch_size_total / self.steps, 2) if self.steps else 0.0,
+            "max_batch_tokens": self.max_batch_tokens,
+            "max_batch_size": self.max_batch_size,
+        }
+
+    def _admit(self) -> List[_Sequence]:
+        """Выбор ожидающих запросов, помещающихся в пакет (в порядке поступления)"""
+        with self._condition:
+            while not self._active and not self._waiting:
+                self._condition.wait()
+            reserved = sum(sequence.reserved_tokens for sequence in self._active)
+            admitted = []
+            while self._waiting and len(self._active) + len(admitted) < self.max_batch_size:
+                sequence = self._waiting[0]
+                if sequence.cancelled:
+                    self._waiting.popleft()
+                    continue
+                # Пустой пакет принимает запрос любого размера, иначе он ждал бы бесконечно
+                if (self._active or admitted) and reserved + sequence.reserved_tokens > self.max_batch_tokens:
+                    break
+                self._waiting.popleft()
+                reserved += sequence.reserved_tokens
+                admitted.append(sequence)
+            return admitted
+
+    def _run(self) -> None:
+        """Цикл планировщика: прием запросов, шаг генерации, выдача текста"""
+        while True:
+            admitted = self._admit()
+            try:
+                with torch.inference_mode():
+                    if admitted:
+                        self._prefill(admitted)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                logger.exception("Ошибка пакетной генерации (%d последовательностей): %s", len(self._active) + len(admitted), e)
+                for sequence in set(self._active) | set(admitted):
+                    if not sequence.finished:
+                        sequence.output.put(e)
+                self._reset_batch()
+
+    def _reset_batch(self) -> None:
+        self._active = []
+        self._past = None
+        self._attention_mask = None
+        self._next_tokens = None
+
+    def _prefill(self, sequences: List[_Sequence]) -> None:
+        """Проход по промптам новых запросов (группами по префиксу) и присоединение их кэша к пакету"""
+        groups: Dict[int, List[_Sequence]] = {}
+        for sequence in sequences:
+            groups.setdefault(id(sequence.prefix), []).append(sequence)
+        for group in groups.values():
+            self._prefill_group(group, group[0].prefix)
+        self._drop_finished()
+
+    def _prefill_group(self, sequences: List[_Sequence], prefix) -> None:
+        """Prefill последовательностей с общим префиксом (или без префикса)"""
+        prefix_length = len(prefix[0]) if prefix is not None else 0
+        tails = [sequence.prompt_ids[prefix_length:] for sequence in sequences]
+        length = max(len(tail) for tail in tails)
+        input_ids = torch.full((len(sequences), length), self.pad_token_id, dtype=torch.long)
+        tail_mask = torch.zeros((len(sequences), length), dtype=torch.long)
+        for row, tail in enumerate(tails):
+            input_ids[row, length - len(tail):] = torch.tensor(tail, dtype=torch.long)
+            tail_mask[row, length - len(tail):] = 1
+        input_ids = input_ids.to(self.device)
+        tail_mask = tail_mask.to(self.device)
+
+        past_key_values = None
+        attention_mask = tail_mask
+        if prefix is not None:
+            # Кэш префикса общий для группы; модель дописывает к нему новые тензоры, не изменяя его
+            past_key_values = _from_legacy(tuple(
+                (key.expand(len(sequences), -1, -1, -1), value.expand(len(sequences), -1, -1, -1))
+                for key, value in prefix[1]
+            ))
+            # Паддинг хвостов оказывается между префиксом и хвостом и закрыт маской
+            attention_mask = torch.cat([tail_mask.new_ones((len(sequences), prefix_length)), tail_mask], dim=1)
+            self.prefix_hits += len(sequences)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, prefix_length:]
+
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                             past_key_values=past_key_values, use_cache=True)
+        next_tokens = self._sample(outputs.logits[:, -1, :], sequences)
+        self._merge(sequences, _to_legacy(outputs.past_key_values), attention_mask, next_tokens)
+        self._emit(sequences, next_tokens)
+
+    def _merge(self, sequences: List[_Sequence], past, attention_mask, next_tokens) -> None:
+        """Объединение KV-кэша новых последовательностей с кэшем пакета (выравнивание по правому краю)"""
+        if not self._active:
+            self._active = list(sequences)
+            self._past, self._attention_mask, self._next_tokens = past, attention_mask, next_tokens
+            return
+
+        length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+
+        def left_pad(tensor, dim):
+            missing = length - tensor.shape[dim]
+            if missing == 0:
+                return tensor
+            shape = list(tensor.shape)
+            shape[dim] = missing
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+        self._past = tuple(
+            (torch.cat([left_pad(key, 2), left_pad(new_key, 2)], dim=0),
+             torch.cat([left_pad(value, 2), left_pad(new_value, 2)], dim=0))
+            for (key, value), (new_key, new_value) in zip(self._past, past)
+        )
+        self._attention_mask = torch.cat([left_pad(self._attention_mask, 1), left_pad(attention_mask, 1)], dim=0)
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+        self._active.extend(sequences)
+
+    def _decode_step(self) -> None:
+        """Один проход модели для всех последовательностей пакета"""
+        batch_size = len(self._active)
+        position_ids = self._attention_mask.sum(-1, keepdim=True)
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((batch_size, 1))], dim=1
+        )
+        outputs = self.model(
+            input_ids=self._next_tokens.unsqueeze(-1),
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(self._past),
+            use_cache=True,
+        )
+        self._past = _to_legacy(outputs.past_key_values)
+        self._attention_mask = attention_mask
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        self.steps += 1
+        self._batch_size_total += batch_size
+        self._emit(self._active, self._next_tokens)
+        self._drop_finished()
+
+    def _sample(self, logits, sequences: List[_Sequence]):
+        """Выбор следующего токена с параметрами выборки каждой последовательности"""
+        tokens = torch.empty(len(sequences), dtype=torch.long, device=logits.device)
+        for row, sequence in enumerate(sequences):
+            row_logits = logits[row].float()
+            if not sequence.do_sample or sequence.temperature <= 0:
+                tokens[row] = row_logits.argmax()
+                continue
+            probabilities = torch.softmax(row_logits / sequence.temperature, dim=-1)
+            if sequence.top_p < 1.0:
+                sorted_probabilities, sorted_indices = probabilities.sort(descending=True)
+                # Отбрасываются токены за пределами накопленной вероятности top_p (первый остается всегда)
+                outside = sorted_probabilities.cumsum(-1) - sorted_probabilities > sequence.top_p
+                sorted_probabilities[outside] = 0.0
+                probabilities = torch.zeros_like(probabilities).scatter_(0, sorted_indices, sorted_probabilities)
+            tokens[row] = torch.multinomial(probabilities, 1)[0]
+        return tokens
+
+    def _emit(self, sequences: List[_Sequence], tokens) -> None:
+        """Выдача нового текста вызывающим и отметка завершенных последовательностей"""
+        for sequence, token in zip(sequences, tokens.tolist()):
+            if sequence.finished:
+                continue
+            if sequence.cancelled:
+                sequence.finished = True
+                continue
+            stop = token in self.stop_token_ids
+            if not stop:
+                sequence.generated.append(token)
+                text = self.tokenizer.decode(sequence.generated, skip_special_tokens=True)
+                # Незавершенный многобайтовый символ выдается вместе со следующим токеном
+                if not text.endswith("\ufffd") and len(text) > len(sequence.emitted_text):
+                    sequence.output.put(text[len(sequence.emitted_text):])
+                    sequence.emitted_text = text
+            if stop or len(sequence.generated) >= sequence.max_new_tokens:
+                sequence.finished = True
+                sequence.output.put(_END)
+                self.sequences_done += 1
+
+    def _drop_finished(self) -> None:
+        """Удаление завершенных последовательностей из пакета и лишнего паддинга из кэша"""
+        keep = [row for row, sequence in enumerate(self._active) if not sequence.finished]
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset_batch()
+            return
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        self._active = [self._active[row] for row in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        # Столбцы, где паддинг у всех оставшихся последовательностей, больше не нужны
+        start = int((self._attention_mask.sum(0) > 0).nonzero()[0])
+        self._attention_mask = self._attention_mask[:, start:]
+        self._past = tuple(
+            (key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+            for key, value in self._past
+        )
@@ -0,0 +1,86 @@
+"""
+Модуль блокировок для обновления индексов модели во время обработки запросов
+"""
+
+# Импорт стандартных библиотек
+import functools  # Сохранение имени и документации декорированных методов
+import threading  # Условная переменная и хранение глубины вложенности по потокам
+from contextlib import contextmanager  # Контекстные менеджеры захвата блокировки
+
+# Импорт типов для аннотаций
+from typing import Callable, Iterator  # Для типизации кода
+
+
+class ReadWriteLock:
+    """
+    Блокировка «много читателей — один писатель» с приоритетом писателя.
+
+    Запросы к модели захватывают блокировку на чтение и выполняются параллельно;
+    обновление индексов захватывает ее на запись только на время подмены
+    подготовленных объектов. Повторный захват на чтение тем же потоком
+    (вложенные вызовы методов модели) не ждет ожидающего писателя.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Захват на чтение"""
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            with self._condition:
+                while self._writer or self._waiting_writers:
+                    self._condition.wait()
+                self._readers += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._condition:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """Захват на запись (ждет завершения текущих читателей)"""
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+def reads(lock_attribute: str) -> Callable:
+    """
+    Декоратор метода, выполняющий его под блокировкой объекта на чтение
+
+    Args:
+        lock_attribute (str): Имя атрибута с ReadWriteLock
+
+    Returns:
+        Callable: Декоратор
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, lock_attribute).read():
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
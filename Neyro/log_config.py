@@ -0,0 +1,60 @@
+"""
+Модуль настройки логирования Neyro: режим отладки и неблокирующий вывод через очередь
+"""
+
+# Импорт стандартных библиотек
+import atexit  # Для остановки потока вывода при завершении процесса
+import logging  # Стандартное логирование
+import logging.handlers  # QueueHandler и QueueListener
+import os  # Для чтения переменных окружения
+import queue  # Очередь записей логов
+
+# Режим отладки: подробная диагностика поиска и генерации ответа (по умолчанию выключен)
+DEBUG_MODE = os.getenv("NEYRO_DEBUG", "0").lower() in ("1", "true", "yes", "on")
+
+ROOT_LOGGER_NAME = "neyro"
+
+_listener = None
+
+
+def setup_logging() -> logging.Logger:
+    """
+    Настройка корневого логгера Neyro (повторные вызовы ничего не меняют).
+
+    Записи кладутся в очередь, а форматирование и вывод в stderr выполняются
+    отдельным потоком QueueListener, поэтому обработчик запроса не ждет ввода-вывода.
+
+    Returns:
+        logging.Logger: Корневой логгер Neyro
+    """
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    if _listener is not None:
+        return root
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.DEBUG if DEBUG_MODE else logging.INFO)
+    # Не дублируем записи через обработчики корневого логгера Python (basicConfig)
+    root.propagate = False
+    return root
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Логгер модуля Neyro
+
+    Args:
+        name (str): Имя модуля
+
+    Returns:
+        logging.Logger: Дочерний логгер "neyro.<name>"
+    """
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
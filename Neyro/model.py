@@ -8,7 +8,6 @@ import pandas as pd  # Библиотека для обработки и ана
 
 # Импорт компонентов для векторизации текста и вычисления схожести
 from sklearn.feature_extraction.text import TfidfVectorizer  # Для преобразования текста в TF-IDF векторы
-from sklearn.metrics.pairwise import cosine_similarity  # Для расчета косинусного сходства между векторами
 from sklearn.decomposition import TruncatedSVD  # Для снижения размерности векторов (LSA)
 
 # Импорт библиотек для сохранения/загрузки моделей и работы с файлами
@@ -21,18 +20,34 @@ import time  # Для измерения времени выполнения
 # Импорт библиотек для работы с нейронными сетями
 import torch  # Фреймворк для глубокого обучения
 from sentence_transformers import SentenceTransformer, CrossEncoder  # Для создания эмбеддингов предложений
-from transformers import pipeline  # Для работы с предобученными моделями трансформеров
 
 # Импорт инструментов для обработки текста
 import re  # Для работы с регулярными выражениями
 from nltk.tokenize import sent_tokenize, word_tokenize  # Для разбиения текста на предложения и слова
-from rank_bm25 import BM25Okapi # Для ранжирования с использованием BM25
 
 # Импорт типов для аннотаций
-from typing import List, Dict, Tuple, Optional, Any, Union  # Для типизации кода
+from typing import List, Dict, Tuple, Optional, Any, Union, Iterator  # Для типизации кода
 
 # Импортируем TextProcessor из utils
 import utils
+from bm25 import BM25Index  # Инвертированный индекс BM25
+from dense_index import DenseIndex  # Индекс приближенного поиска по эмбеддингам
+from embeddings import EmbeddingMatrix  # Нормализованные эмбеддинги со скалярным произведением
+from scipy import sparse  # Разреженные матрицы признаков документов
+from segments import SegmentIndex, split_text_into_segments  # Таблица сегментов статей для извлечения фрагментов
+import tracing  # Замеры времени этапов обработки запроса
+from log_config import get_logger  # Неблокирующее логирование с режимом отладки
+from batch_encoder import BatchingEncoder  # Пакетирование одновременных запросов к SentenceTransformer
+import threading  # Для однократного создания сервиса кодирования запросов
+import copy  # Копии результатов, отдаваемых из кэша
+import hashlib  # Версия модели по содержимому датасета
+from cache import QueryCache, SemanticAnswerCache, normalize_query  # Кэш результатов обработки запросов и ответов LLM
+from llm_backends import create_llm_backend  # Среды выполнения LLM (transformers, llama.cpp, ONNX Runtime)
+from prompt_packing import approximate_token_count, pack_fragments  # Упаковка фрагментов в бюджет токенов
+from reasoning_jobs import ReasoningJobs, resolve_reasoning_mode  # Отложенная и параллельная генерация объяснений
+from bundle import BundleWriter, is_bundle, read_json, read_lines, read_manifest  # Версионированный каталог модели
+from training import TRAIN_ENCODE_BATCH_SIZE, TrainingPipeline, process_documents  # Поэтапное параллельное обучение с кэшем результатов по документам
+from locks import ReadWriteLock, reads  # Обновление индексов во время обработки запросов
 
 import os
 import logging
@@ -52,7 +67,7 @@ except ImportError:
 
 # Инициализация логгера
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -190,6 +205,9 @@ def check_needs_operator(query: str) -> bool:
     
     return False
 
+class DocumentIdsError(RuntimeError):
+    """Модель обучена на датасете без столбца id: статьи нельзя сопоставить с записями Data Backend"""
+
 class Model:
     """
     Модель для семантического поиска релевантных статей в базе знаний
@@ -198,8 +216,29 @@ class Model:
     Использует комбинацию TF-IDF и BERT для достижения наилучших результатов.
     """
     CANDIDATES_K = 100 # Количество кандидатов для этапа переранжирования
+    DENSE_K = 50 # Количество кандидатов плотного поиска, добавляемых к кандидатам BM25
+    DENSE_SEARCH_EFFORT = 64 # efSearch (HNSW) / nprobe (IVF): баланс полноты и задержки плотного поиска
+    EMBEDDINGS_DTYPE = os.getenv("EMBEDDINGS_DTYPE", "float16") # Тип хранения эмбеддингов: float16 или float32
+    SEGMENT_ENCODE_BATCH_SIZE = 32 # Размер пакета при кодировании сегментов статей
+    QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32")) # Максимум одновременных запросов в пакете кодирования (1 — без пакетирования)
+    QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5")) # Ожидание пополнения пакета кодирования, мс
+    _lazy_init_lock = threading.Lock() # Однократное создание сервиса кодирования и кэшей
+    PROMPT_TOKEN_BUDGET = int(os.getenv("NEYRO_PROMPT_TOKEN_BUDGET", "2048")) # Максимум токенов промпта ответа
+    LEGACY_MODEL_SUFFIX = ".pkl" # Модели с таким расширением сохраняются и загружаются через pickle, как раньше
+    COMPACTION_RATIO = float(os.getenv("NEYRO_COMPACTION_RATIO", "0.2")) # Доля удаленных документов, после которой индексы уплотняются
+    # Неизменные вступления промптов ответа и объяснения: их KV-кэш вычисляется
+    # средой выполнения LLM один раз (см. LLMBackend.register_prefix)
+    ANSWER_PROMPT_PREFIX = """Пользователь задал вопрос, я тебе даю его вопрос(он может быть с орфографическими ошибками, неточностями и т.д.) и даю фрагменты из нашей базы знаний. тебе нужно соеденить все фрагменты в один ответ на вопрос пользователя, ответ должен ссылаться на источник ифнормации и можно немного выдумывать информацию, чтобы пользователь получил информацию, которая ему нужна
+"""
+    REASONING_PROMPT_PREFIX = """Объясни от первого лица, как ты пришел к ответу на следующий запрос пользователя. Опиши свой ход мыслей по шагам: 
+1. Анализ запроса: кратко опиши, как ты понял запрос (тип, ключевые темы/сущности).
+2. Поиск статей: какие статьи из базы знаний показались наиболее релевантными и почему (например, упомяни совпадение ключевых слов, тематики, контекста). Упомяни 1-3 самые важные статьи.
+3. Выбор фрагментов: почему ты выбрал именно эти фрагменты из найденных статей для формирования ответа? Что в них было важного?
+
+"""
 
-    def __init__(self, dataset_path: str, use_bert: bool = True, use_llm: bool = True, use_cross_encoder: bool = True):
+    def __init__(self, dataset_path: str, use_bert: bool = True, use_llm: bool = True, use_cross_encoder: bool = True,
+                 shared: Optional['Model'] = None, dataset: Optional[pd.DataFrame] = None):
         """
         Инициализация модели поиска
         
@@ -208,12 +247,17 @@ class Model:
         use_bert (bool): Использовать ли BERT для семантического поиска
         use_llm (bool): Использовать ли LLM для генерации ответов
         use_cross_encoder (bool): Использовать ли Cross-Encoder для переранжирования
+        shared (Optional[Model]): Работающая модель, чьи SentenceTransformer, CrossEncoder и LLM
+            используются вместо повторной загрузки (см. _share_runtime)
+        dataset (Optional[pd.DataFrame]): Статьи для обучения вместо файла dataset_path
+            (например, текущие статьи работающей модели, см. live_documents)
         """
         # Сохраняем путь к датасету
         self.dataset_path = dataset_path
+        self._init_locks()
         
         # Загрузка датасета
-        self.dataset = pd.read_parquet(dataset_path)
+        self.dataset = dataset if dataset is not None else pd.read_parquet(dataset_path)
         
         # Обработчик текста
         self.text_processor = utils.TextProcessor()
@@ -225,13 +269,21 @@ class Model:
         self.use_bert = use_bert
         self.bert_model = None
         self.bert_embeddings = None
+        self.dense_index = None  # ANN-индекс по bert_embeddings для первого этапа поиска
+        self.segment_index = None  # Сегменты статей с сущностями и эмбеддингами (строится в train)
+        self.query_encoder = None  # Пакетирование одновременных запросов к bert_model (создается при первом запросе)
+        self.query_cache = None  # Кэш эмбеддингов, рекомендаций и фрагментов запросов (создается при первом запросе)
+        self.answer_cache = None  # Семантический кэш ответов LLM (создается при первом запросе)
+        self.reasoning_jobs = None  # Пул параллельной и фоновой генерации объяснений (создается при первом запросе)
+        self.version = None  # Версия модели: меняется при каждом обучении, сбрасывает кэш запросов
+        self.tombstones = None  # Маска удаленных статей до уплотнения индексов (см. delete_documents)
         self.use_cross_encoder = use_cross_encoder
         self.cross_encoder = None
         self.tfidf_matrix = None
         self.lsa_matrix = None
         
         # Инициализация BERT модели для семантического поиска
-        if self.use_bert:
+        if self.use_bert and shared is None:
             try:
                 self.bert_model = SentenceTransformer('ai-forever/sbert_large_nlu_ru')
                 print("SentenceTransformer (bert_model) загружен.")
@@ -240,7 +292,7 @@ class Model:
                 self.use_bert = False
         
         # Инициализация Cross-Encoder для переранжирования
-        if self.use_cross_encoder:
+        if self.use_cross_encoder and shared is None:
             try:
                 self.cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
                 print("CrossEncoder модель загружена.")
@@ -253,102 +305,431 @@ class Model:
         self.document_roles = {}       # Роли пользователей для документов
         self.document_topics = {}      # Темы документов
         
+        # Предрасчитанные признаки документов для контекстных весов (см. _build_document_features)
+        self.label_vocabularies = {}   # Метка -> {значение: код}
+        self.doc_label_codes = None    # Метка -> массив кодов по документам
+        self.title_lemma_vocabulary = {}  # Лемма заголовка -> номер столбца
+        self.title_lemma_matrix = None    # Документ x лемма заголовка
+        self.body_lemma_presence = None   # Документ x ключевой термин: термин встречается в тексте
+        
         # Инициализация LLM для генерации ответов
         self.use_llm = use_llm
         self.llm = None
-        if self.use_llm:
+        if self.use_llm and shared is None:
             try:
-                self.llm = pipeline("text-generation", model="microsoft/Phi-3-mini-4k-instruct", trust_remote_code=True)
+                self.llm = create_llm_backend()
+                self._register_prompt_prefixes()
                 print("LLM модель успешно загружена")                                                                                                                                                                                                                                                                                                                                          
             except Exception as e:
                 print(f"Не удалось загрузить LLM модель: {e}")
                 self.use_llm = False
+        
+        if shared is not None:
+            self._share_runtime(shared)
 
-    def train(self):
+    def _init_locks(self) -> None:
         """
-        Обучение модели поиска на датасете
+        Блокировки индексов модели. У каждой модели свои: обновление одного
+        поколения модели (см. registry.ModelRegistry) не блокирует запросы к другому
+        """
+        self._index_lock = ReadWriteLock() # Запросы читают индексы параллельно; upsert/delete/compact подменяют их под записью
+        self._update_lock = threading.Lock() # Обновления индексов выполняются по одному
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Состояние для pickle без блокировок (они создаются заново при распаковке)"""
+        state = self.__dict__.copy()
+        state.pop('_index_lock', None)
+        state.pop('_update_lock', None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_locks()
+
+    def _share_runtime(self, shared: 'Model') -> None:
+        """
+        Использование загруженных моделей другой модели: новое поколение модели
+        (см. registry.ModelRegistry) не загружает SentenceTransformer, CrossEncoder и LLM
+        повторно, кодирует запросы тем же сервисом пакетирования, а объяснения,
+        запущенные в фоне на прежнем поколении, остаются доступными после подмены
+        
+        
+        shared (Model): Работающая модель
+        """
+        self.bert_model = shared.bert_model if self.use_bert else None
+        self.use_bert = self.bert_model is not None
+        self.cross_encoder = shared.cross_encoder if self.use_cross_encoder else None
+        self.use_cross_encoder = self.cross_encoder is not None
+        self.llm = shared.llm if self.use_llm else None
+        self.use_llm = self.llm is not None
+        self.query_encoder = getattr(shared, 'query_encoder', None)
+        self.reasoning_jobs = shared._get_reasoning_jobs()
+
+    def train(self) -> Dict[str, Any]:
+        """
+        Обучение модели поиска на датасете. Этапы, их параллельное выполнение
+        и повторное использование результатов прошлого обучения — см. training.TrainingPipeline
+        
+        Returns:
+            Dict[str, Any]: Замеры времени этапов обучения
         """
         print("Начало обучения модели...")
+        tombstones = self._tombstone_mask()
+        if tombstones is not None:
+            # Удаленные и замененные статьи не участвуют в обучении
+            self.dataset = self.dataset.iloc[np.flatnonzero(~tombstones)].reset_index(drop=True)
+            self.tombstones = None
+        timings = TrainingPipeline(self).run()
+        
+        self.version = self._compute_version()
+        print(f"Обучение модели завершено (версия {self.version}) за {timings['total_ms'] / 1000:.2f} с")
+        return timings
+
+    def _classify_documents(self, classifications: List[Tuple[Optional[str], Optional[str], Optional[str]]]):
+        """
+        Сохранение классификации документов из базы знаний по типам,
+        ролям пользователей и темам
         
-        # Объединяем заголовок и описание для лучшего поиска
-        self.dataset['combined_text'] = self.dataset['Заголовок статьи'] + ' ' + self.dataset['Описание'].fillna('')
+        classifications (List[Tuple[Optional[str], Optional[str], Optional[str]]]): Тип запроса,
+            роль пользователя и компонент для каждого документа (в порядке датасета)
+        """
+        query_types = [classification[0] for classification in classifications]
+        user_roles = [classification[1] for classification in classifications]
+        components = [classification[2] for classification in classifications]
+        
+        # Сохранение классификации
+        self.document_categories = dict(zip(self.dataset.index, query_types))
+        self.document_roles = dict(zip(self.dataset.index, user_roles))
+        self.document_topics = dict(zip(self.dataset.index, components))
+        
+        # Добавление меток в датасет; is_error — является ли документ об ошибке
+        self.dataset['query_type'] = query_types
+        self.dataset['user_role'] = user_roles
+        self.dataset['component'] = components
+        self.dataset['is_error'] = (self.dataset['query_type'] == 'error').astype(int)
+
+    def upsert_documents(self, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Добавление новых и замена измененных статей без полного переобучения.
         
-        # Классификация документов по типам
-        print("Классификация документов...")
-        self._classify_documents()
+        Обрабатываются только переданные статьи: классификация, токены BM25,
+        сегменты с сущностями и эмбеддинги. Новые версии статей добавляются в конец
+        индексов, прежние версии помечаются удаленными и убираются при уплотнении
+        (см. compact). Индексы собираются заново рядом с текущими и подменяются
+        под блокировкой на запись, поэтому запросы продолжают работать с прежними.
         
-        # Построение словаря для исправления опечаток и извлечения аббревиатур
-        print("Создание словаря терминов...")
-        self.text_processor.build_vocabulary(self.dataset['combined_text'])
         
-        # Предобработка текстов
-        print("Предобработка текстов...")
-        # Сначала полная предобработка для BERT и возможных будущих нужд
-        self.dataset['processed_text_full'] = self.dataset['combined_text'].apply(
-            self.text_processor.preprocess_text
-        )
-        # Затем упрощенная предобработка ТОЛЬКО для BM25
-        print("Упрощенная предобработка текстов для BM25...")
-        # Мы будем использовать результат _preprocess_for_bm25 напрямую (список токенов)
-        tokenized_corpus_for_bm25 = self.dataset['combined_text'].apply(
-            self.text_processor._preprocess_for_bm25
-        ).tolist()
-
-        # --- Используем уже готовый список списков токенов --- 
-        # Отфильтруем пустые списки, которые могли появиться после упрощенной обработки
-        self.bm25_indices = [idx for idx, tokens in enumerate(tokenized_corpus_for_bm25) if tokens] 
-        filtered_tokenized_corpus = [tokens for tokens in tokenized_corpus_for_bm25 if tokens]
-
-        # Обучение BM25
-        print("Обучение BM25...")
-        # Проверка, что корпус не пуст
-        if filtered_tokenized_corpus:
-            print(f"Пример токенизированного документа для BM25 (первые 20 токенов): {filtered_tokenized_corpus[0][:20]}")
-            self.bm25 = BM25Okapi(filtered_tokenized_corpus)
-            print("Модель BM25 обучена.")
-        else:
-            print("Ошибка: Корпус для обучения BM25 пуст после фильтрации.")
-
-        # Если используем BERT, создаем семантические эмбеддинги
-        if self.use_bert:
-            try:
-                print("Создание эмбеддингов с помощью SentenceTransformer (bert_model)...")
-                self.bert_embeddings = self.bert_model.encode(
-                    self.dataset['combined_text'].tolist(),
-                    show_progress_bar=True,
-                    batch_size=16
+        documents (List[Dict[str, Any]]): Статьи с полями id, title, description и, необязательно, url
+            
+        Returns:
+            Dict[str, Any]: Состояние индекса после обновления (см. index_stats)
+        """
+        # Для повторяющихся id остается последняя версия статьи
+        documents = list({document['id']: document for document in documents}.values())
+        if not documents:
+            return self.index_stats()
+        
+        with self._update_lock:
+            if 'combined_text' not in self.dataset.columns:
+                raise RuntimeError("Модель не обучена: инкрементальное обновление индексов невозможно")
+            dataset = self._dataset_with_ids()
+            tombstones = self._tombstone_mask()
+            # Статьи, совпадающие с текущей версией, пропускаются: повторная отправка изменений ничего не меняет
+            documents = self._changed_documents(dataset, documents, tombstones)
+            if not documents:
+                return self.index_stats()
+            replaced = self._live_positions(dataset, [document['id'] for document in documents], tombstones)
+            start = len(dataset)
+            
+            # Строки новых версий статей в формате датасета
+            new_rows = pd.DataFrame({
+                'id': [document['id'] for document in documents],
+                'Заголовок статьи': [document['title'] for document in documents],
+                'Описание': [document.get('description') for document in documents],
+            })
+            if 'Ссылка на статью' in dataset.columns or any(document.get('url') for document in documents):
+                new_rows['Ссылка на статью'] = [document.get('url') for document in documents]
+            new_rows['combined_text'] = new_rows['Заголовок статьи'] + ' ' + new_rows['Описание'].fillna('')
+            processed = process_documents(self.text_processor, list(zip(
+                new_rows['combined_text'], new_rows['Заголовок статьи'], new_rows['Описание']
+            )))
+            new_labels = [
+                [document[column] for document in processed] for column in ('query_type', 'user_role', 'component')
+            ]
+            new_rows['query_type'], new_rows['user_role'], new_rows['component'] = new_labels
+            new_rows['is_error'] = (new_rows['query_type'] == 'error').astype(int)
+            new_rows.index = pd.RangeIndex(start, start + len(new_rows))
+            
+            updated_tombstones = np.zeros(start + len(new_rows), dtype=bool)
+            if tombstones is not None:
+                updated_tombstones[:start] = tombstones
+            updated_tombstones[replaced] = True
+            
+            # BM25: строки новых документов добавляются, частоты замененных обнуляются
+            tokens = [document["tokens"] for document in processed]
+            if self.bm25 is not None:
+                bm25 = self.bm25.with_documents(tokens, removed=replaced)
+            else:
+                bm25 = BM25Index.build([[]] * start + tokens)
+            
+            # Эмбеддинги статей и сегментов кодируются только для новых версий
+            doc_segments = [document["segments"] for document in processed]
+            doc_embeddings = segment_embeddings = None
+            if self.bert_embeddings is not None:
+                if self.bert_model is None:
+                    raise RuntimeError("Для обновления эмбеддингов требуется загруженная модель BERT")
+                doc_embeddings = self._encode_documents(new_rows['combined_text'].tolist())
+                segment_embeddings = self._encode_documents(
+                    [segment[0] for segments in doc_segments for segment in segments]
                 )
-                print(f"Эмбеддинги (bert_embeddings) созданы, размер: {self.bert_embeddings.shape}")
-            except Exception as e:
-                print(f"Ошибка при создании BERT эмбеддингов: {e}")
-                self.use_bert = False
-        
-        print("Обучение модели завершено")
+            bert_embeddings = self.bert_embeddings.appended(doc_embeddings) if doc_embeddings is not None else None
+            segment_index = None
+            if self.segment_index is not None:
+                segment_index = self.segment_index.appended(doc_segments, segment_embeddings)
+            
+            labels = [dict(labels_by_doc) for _, labels_by_doc in self._document_labels()]
+            for labels_by_doc, values in zip(labels, new_labels):
+                labels_by_doc.update(zip(new_rows.index, values))
+            features = self._appended_document_features(new_rows, new_labels) if self.doc_label_codes is not None else {}
+            removed_texts = dataset['combined_text'].iloc[replaced].tolist()
+            updated_dataset = pd.concat([dataset, new_rows], ignore_index=True)
+            
+            with self._index_lock.write():
+                self.dataset = updated_dataset
+                self.tombstones = updated_tombstones if updated_tombstones.any() else None
+                self.bm25 = bm25
+                if bert_embeddings is not None:
+                    self.bert_embeddings = bert_embeddings
+                    if self.dense_index is not None:
+                        self.dense_index.add(doc_embeddings.dense())
+                self.segment_index = segment_index
+                self.document_categories, self.document_roles, self.document_topics = labels
+                for name, value in features.items():
+                    setattr(self, name, value)
+                self.text_processor.update_vocabulary(new_rows['combined_text'], removed_texts)
+                self.version = self._compute_version()
+            logger.info("Обновлено статей: %d (новых: %d), версия модели %s",
+                        len(documents), len(documents) - len(replaced), self.version)
+            
+            self._compact_if_needed()
+        return self.index_stats()
 
-    def _classify_documents(self):
+    def delete_documents(self, ids: List[Any]) -> Dict[str, Any]:
         """
-        Классификация документов из базы знаний по типам,
-        ролям пользователей и темам
+        Удаление статей без полного переобучения: статьи помечаются удаленными,
+        их частоты в BM25 обнуляются, а остальные индексы уплотняются, когда
+        доля удаленных статей достигает COMPACTION_RATIO (см. compact)
+        
+        
+        ids (List[Any]): Идентификаторы статей (столбец id датасета)
+            
+        Returns:
+            Dict[str, Any]: Состояние индекса после обновления (см. index_stats)
         """
-        for idx, row in self.dataset.iterrows():
-            text = row['combined_text'].lower()
+        with self._update_lock:
+            dataset = self._dataset_with_ids()
+            tombstones = self._tombstone_mask()
+            positions = self._live_positions(dataset, ids, tombstones)
+            if not positions:
+                return self.index_stats()
+            
+            updated_tombstones = np.zeros(len(dataset), dtype=bool) if tombstones is None else tombstones.copy()
+            updated_tombstones[positions] = True
+            bm25 = self.bm25.with_documents([], removed=positions) if self.bm25 is not None else None
+            removed_texts = dataset['combined_text'].iloc[positions].tolist() if 'combined_text' in dataset.columns else []
             
-            # Классификация документа
-            classification = self.text_processor.classify_query(text)
+            with self._index_lock.write():
+                self.dataset = dataset
+                self.tombstones = updated_tombstones
+                self.bm25 = bm25
+                self.text_processor.update_vocabulary(removed_texts=removed_texts)
+                self.version = self._compute_version()
+            logger.info("Удалено статей: %d, версия модели %s", len(positions), self.version)
+            
+            self._compact_if_needed()
+        return self.index_stats()
+
+    def compact(self) -> Dict[str, Any]:
+        """
+        Уплотнение индексов: удаленные и замененные статьи убираются из датасета,
+        BM25, эмбеддингов, таблицы сегментов и признаков документов, а индекс
+        плотного поиска перестраивается. Позиции документов при этом меняются.
+        
+        Returns:
+            Dict[str, Any]: Состояние индекса после уплотнения (см. index_stats)
+        """
+        with self._update_lock:
+            self._compact()
+        return self.index_stats()
+
+    def _compact_if_needed(self) -> None:
+        """Уплотнение, если доля удаленных статей достигла COMPACTION_RATIO (вызывается под _update_lock)"""
+        tombstones = self._tombstone_mask()
+        if tombstones is not None and tombstones.sum() >= max(1, self.COMPACTION_RATIO * len(tombstones)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Уплотнение индексов (вызывается под _update_lock)"""
+        tombstones = self._tombstone_mask()
+        if tombstones is None:
+            return
+        keep = np.flatnonzero(~tombstones)
+        
+        dataset = self.dataset.iloc[keep].reset_index(drop=True)
+        bm25 = self.bm25.select_documents(keep) if self.bm25 is not None else None
+        bert_embeddings = self.bert_embeddings.select(keep) if self.bert_embeddings is not None else None
+        dense_index = self.dense_index
+        if dense_index is not None and bert_embeddings is not None:
+            dense_index = dense_index.rebuilt(bert_embeddings.dense())
+        segment_index = self.segment_index.select_documents(keep) if self.segment_index is not None else None
+        labels = [
+            {new_position: labels_by_doc.get(old_position) for new_position, old_position in enumerate(keep)}
+            for _, labels_by_doc in self._document_labels()
+        ]
+        features = self._selected_document_features(keep) if self.doc_label_codes is not None else {}
+        
+        with self._index_lock.write():
+            self.dataset = dataset
+            self.tombstones = None
+            self.bm25 = bm25
+            self.bert_embeddings = bert_embeddings
+            self.dense_index = dense_index
+            self.segment_index = segment_index
+            self.document_categories, self.document_roles, self.document_topics = labels
+            for name, value in features.items():
+                setattr(self, name, value)
+            self.version = self._compute_version()
+        logger.info("Индексы уплотнены: удалено позиций %d, документов %d", len(tombstones) - len(keep), len(keep))
+
+    @reads("_index_lock")
+    def index_stats(self) -> Dict[str, Any]:
+        """
+        Состояние индексов модели
+        
+        Returns:
+            Dict[str, Any]: Версия модели, количество статей и удаленных статей, ожидающих уплотнения
+        """
+        tombstones = self._tombstone_mask()
+        deleted = int(tombstones.sum()) if tombstones is not None else 0
+        return {
+            "model_version": self.model_version,
+            "documents": len(self.dataset) - deleted,
+            "deleted": deleted,
+        }
+
+    @reads("_index_lock")
+    def live_documents(self) -> pd.DataFrame:
+        """
+        Текущие статьи модели: датасет обучения с изменениями из upsert_documents
+        и delete_documents, без удаленных и замененных версий
+        
+        Returns:
+            pd.DataFrame: Копия датасета для переобучения (столбцы меток пересчитываются в train)
+        """
+        tombstones = self._tombstone_mask()
+        dataset = self.dataset if tombstones is None else self.dataset.iloc[np.flatnonzero(~tombstones)]
+        return dataset.reset_index(drop=True)
+
+    def _tombstone_mask(self) -> Optional[np.ndarray]:
+        """Маска удаленных статей, еще не убранных уплотнением (None, если таких нет)"""
+        return getattr(self, 'tombstones', None)
+
+    def _dataset_with_ids(self) -> pd.DataFrame:
+        """
+        Датасет со столбцом id — идентификаторами статей в базе знаний Backend
+        
+        Returns:
+            pd.DataFrame: Текущий датасет
             
-            # Сохранение классификации
-            self.document_categories[idx] = classification['query_type']
-            self.document_roles[idx] = classification['user_role']
-            self.document_topics[idx] = classification['component']
+        Raises:
+            DocumentIdsError: В датасете нет столбца id. Номера строк не совпадают с ID
+                записей Data, поэтому изменение затронуло бы другие статьи; модель нужно
+                обучить на выгрузке neyro_sync.py --export
+        """
+        if 'id' not in self.dataset.columns:
+            raise DocumentIdsError(
+                "Модель обучена без идентификаторов статей: обновление базы знаний невозможно. "
+                "Обучите модель на выгрузке Backend/neyro_sync.py --export"
+            )
+        return self.dataset
+
+    @staticmethod
+    def _live_positions(dataset: pd.DataFrame, ids: List[Any], tombstones: Optional[np.ndarray]) -> List[int]:
+        """
+        Позиции неудаленных статей с указанными идентификаторами
+        
+        
+        dataset (pd.DataFrame): Датасет со столбцом id
+        ids (List[Any]): Идентификаторы статей
+        tombstones (Optional[np.ndarray]): Маска удаленных статей
             
-            # Добавление меток в датасет
-            self.dataset.at[idx, 'query_type'] = classification['query_type']
-            self.dataset.at[idx, 'user_role'] = classification['user_role']
-            self.dataset.at[idx, 'component'] = classification['component']
+        Returns:
+            List[int]: Позиции в датасете
+        """
+        live = dataset['id'].isin(list(ids)).to_numpy()
+        if tombstones is not None:
+            live = live & ~tombstones
+        return np.flatnonzero(live).tolist()
+
+    @staticmethod
+    def _changed_documents(dataset: pd.DataFrame, documents: List[Dict[str, Any]],
+                           tombstones: Optional[np.ndarray]) -> List[Dict[str, Any]]:
+        """
+        Статьи, отличающиеся от текущих версий в датасете (или отсутствующие в нем).
+        Для статей без ссылки сохраняется ссылка текущей версии
+        
+        
+        dataset (pd.DataFrame): Датасет со столбцом id
+        documents (List[Dict[str, Any]]): Статьи с полями id, title, description и, необязательно, url
+        tombstones (Optional[np.ndarray]): Маска удаленных статей
             
-            # Определение, является ли документ об ошибке
-            self.dataset.at[idx, 'is_error'] = 1 if classification['query_type'] == 'error' else 0
+        Returns:
+            List[Dict[str, Any]]: Новые и измененные статьи
+        """
+        def value(item):
+            return None if item is None or (np.isscalar(item) and pd.isna(item)) else item
+        
+        positions = Model._live_positions(dataset, [document['id'] for document in documents], tombstones)
+        current = dataset.iloc[positions]
+        urls = current['Ссылка на статью'] if 'Ссылка на статью' in current.columns else [None] * len(current)
+        versions = {
+            document_id: (title, value(description), value(url))
+            for document_id, title, description, url in zip(current['id'], current['Заголовок статьи'], current['Описание'], urls)
+        }
+        
+        changed = []
+        for document in documents:
+            version = versions.get(document['id'])
+            if version is not None and 'url' not in document:
+                document = dict(document, url=version[2])
+            if version != (document['title'], value(document.get('description')), value(document.get('url'))):
+                changed.append(document)
+        return changed
+
+    def _encode_documents(self, texts: List[str]) -> Optional[EmbeddingMatrix]:
+        """Кодирование текстов статей или сегментов SentenceTransformer (None для пустого списка)"""
+        if not texts:
+            return None
+        return EmbeddingMatrix.from_embeddings(
+            self.bert_model.encode(texts, batch_size=TRAIN_ENCODE_BATCH_SIZE),
+            dtype=self.EMBEDDINGS_DTYPE
+        )
+
+    @reads("_index_lock")
+    def classify_query(self, text: str) -> Dict[str, Any]:
+        """
+        Классификация запроса под блокировкой на чтение: словарь и SymSpell
+        обработчика текста дополняются при обновлении базы знаний (см. upsert_documents)
+
 
+        text (str): Текст запроса
+
+        Returns:
+            Dict[str, Any]: Результат TextProcessor.classify_query
+        """
+        return self.text_processor.classify_query(text)
+
+    @reads("_index_lock")
     def predict(self, text: str) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
         """
         Вычисление релевантности между запросом и документами
@@ -358,15 +739,19 @@ class Model:
             
         Returns:
             Tuple[np.ndarray, Dict[str, np.ndarray]]: Массив значений релевантности для каждого документа и словарь промежуточных оценок
+                (bm25, bert, cross_encoder, combined_initial, context_weighted и variant — индекс лучшего варианта запроса)
         """
         # Классификация запроса
-        classification = self.text_processor.classify_query(text)
+        with tracing.span("classify_query", items=1):
+            classification = self.classify_query(text)
         query_type = classification['query_type']
         user_role = classification['user_role']
         component = classification['component']
         
         # Расширение запроса вариантами (для улучшения поиска)
-        query_variants = self._generate_query_variants(text, classification)
+        with tracing.span("query_variants") as variants_span:
+            query_variants = self._generate_query_variants(text, classification)
+            variants_span.items = len(query_variants)
         
         # Вычисление релевантности для всех вариантов запроса
         all_scores = []
@@ -374,83 +759,73 @@ class Model:
         # Структура для хранения промежуточных оценок кандидатов для каждого варианта
         all_candidate_data_variants = [] 
         
-        # Вычисляем эмбеддинг запроса один раз, если используем BERT
+        # Вычисляем эмбеддинг запроса один раз, если используем BERT.
+        # Этап dense_search — кодирование запроса и поиск кандидатов; оценки кандидатов — этап dense_scoring
+        dense_span = tracing.span("dense_search")
         query_embedding = None
         if self.use_bert and self.bert_model:
             try:
-                # Используем исходный текст для BERT / CrossEncoder
-                query_embedding = self.bert_model.encode(text) 
+                # Используем исходный текст для BERT / CrossEncoder; нормализуем один раз на запрос
+                query_embedding = EmbeddingMatrix.normalize(self._encode_query(text))
+            except Exception as e:
+                # Сбой кодирования может быть временным: плотные оценки пропускаются только для этого запроса
+                logger.error("Ошибка при кодировании запроса BERT: %s", e)
+        use_dense = query_embedding is not None
+
+        # ===== Этап 1a: Плотный поиск (ANN по эмбеддингам) =====
+        # Находит статьи, не имеющие общих токенов с запросом (например, при опечатках).
+        # Эмбеддинг запроса общий для всех вариантов, поэтому поиск выполняется один раз
+        dense_candidates = np.zeros(0, dtype=np.int64)
+        if self.use_bert and self.dense_index is not None and query_embedding is not None:
+            try:
+                # Удаленные документы остаются в индексе до уплотнения: кандидатов запрашивается больше
+                tombstones = self._tombstone_mask()
+                num_deleted = int(tombstones.sum()) if tombstones is not None else 0
+                dense_candidates, _ = self.dense_index.search(query_embedding, self.DENSE_K + min(num_deleted, self.DENSE_K))
+                if num_deleted:
+                    dense_candidates = dense_candidates[~tombstones[dense_candidates]][:self.DENSE_K]
             except Exception as e:
-                print(f"Ошибка при кодировании запроса BERT: {e}")
-                self.use_bert = False # Отключаем BERT для этого запроса, если кодирование не удалось
-
-        # Предобрабатываем исходный запрос ОДИН РАЗ
-        processed_base_query = self.text_processor.preprocess_text(text)
-        # print(f"\n--- [DEBUG] Предобработанный базовый запрос: ---\n{processed_base_query}\n---") # Убираем отладку
-
-        for query, weight in query_variants:
-            # Токенизация предобработанного запроса
-            # Сначала получаем УПРОЩЕННУЮ предобработку для варианта запроса `query`
-            # (query все еще содержит полную предобработку из _generate_query_variants)
-            # Лучше передавать исходный текст варианта в _preprocess_for_bm25, 
-            # но _generate_query_variants сейчас возвращает уже обработанный.
-            # Пока используем `text` - базовый исходный текст, но это НЕ ИДЕАЛЬНО.
-            # TODO: Переделать _generate_query_variants, чтобы возвращал исходные тексты вариантов.
-            tokenized_query_for_bm25 = self.text_processor._preprocess_for_bm25(text) # Используем базовый текст
-            if not tokenized_query_for_bm25:
-                print(f"Предупреждение: Пустой токенизированный запрос для BM25 после упрощенной обработки. Пропускаем вариант.")
+                logger.error("Ошибка плотного поиска кандидатов: %s", e)
+        dense_span.stop(items=len(dense_candidates))
+
+        # ===== Этап 1: Retrieval (BM25) — все варианты запроса за один проход =====
+        # Каждый вариант токенизируется ровно один раз, после чего оценки BM25
+        # для всех вариантов считаются одним разреженным матричным умножением
+        with tracing.span("bm25", items=len(query_variants)):
+            tokenized_variants = [self.text_processor._preprocess_for_bm25(query) for query, _ in query_variants]
+            bm25_scores_batch = self._bm25_scores_batch(tokenized_variants)
+
+        for variant_idx, (query, weight) in enumerate(query_variants):
+            if not tokenized_variants[variant_idx] and len(dense_candidates) == 0:
+                logger.warning("Пустой токенизированный запрос для BM25 после упрощенной обработки. Пропускаем вариант.")
                 all_scores.append(np.zeros(num_docs))
                 all_candidate_data_variants.append(None)
                 continue
             
-            # ===== Этап 1: Retrieval (BM25) =====
-            bm25_scores = np.zeros(num_docs)
-            if self.bm25:
-                try:
-                    # Используем УПРОЩЕННУЮ токенизацию запроса
-                    bm25_raw_scores = self.bm25.get_scores(tokenized_query_for_bm25)
-                    # Проверка совпадения размеров: bm25_indices теперь содержит индексы оригинального датасета
-                    # для которых был создан корпус filtered_tokenized_corpus
-                    if hasattr(self, 'bm25_indices') and len(bm25_raw_scores) == len(self.bm25_indices): # <<<--- ИСПРАВЛЕНО: Сравниваем с количеством индексов
-                        # Создаем временный массив оценок, индексированный так же, как bm25_indices
-                        scores_for_indices = np.zeros(len(self.bm25_indices))
-                        # Заполняем оценки, полученные от BM25
-                        scores_for_indices = bm25_raw_scores
-                        # Распределяем оценки по оригинальным индексам датасета
-                        for i, original_idx in enumerate(self.bm25_indices):
-                            if i < len(scores_for_indices): # Защита от ошибок несоответствия длины
-                                bm25_scores[original_idx] = scores_for_indices[i]
-                            else:
-                                print(f"Предупреждение: Индекс {i} вне диапазона scores_for_indices ({len(scores_for_indices)}) при сопоставлении bm25_indices.")
-                                
-                    elif hasattr(self, 'bm25_indices'):
-                        print(f"Предупреждение: Несоответствие размеров BM25 scores ({len(bm25_raw_scores)}) и bm25_indices ({len(self.bm25_indices)}). Оценки BM25 не будут применены.")
-                    else:
-                        print("Предупреждение: Отсутствуют индексы bm25_indices. Оценки BM25 не будут применены.")
-                except Exception as e:
-                    print(f"Ошибка при расчете BM25 для запроса '{query[:50]}...': {e}")
-            else:
-                print("Предупреждение: Модель BM25 недоступна.")
-
-            # --- [DEBUG] Вывод кандидатов BM25 --- 
-            print(f"--- [DEBUG] Топ-10 кандидатов BM25 для варианта запроса '{query[:50]}...' ---")
-            top_bm25_indices_debug = np.argsort(bm25_scores)[::-1][:10] 
-            for bm25_idx in top_bm25_indices_debug:
-                score = bm25_scores[bm25_idx]
-                if score > 0: # Показываем только с ненулевой оценкой
-                    title = self.dataset.loc[bm25_idx, 'Заголовок статьи']
-                    print(f"  - Индекс: {bm25_idx}, Оценка BM25: {score:.4f}, Заголовок: {title}")
-            print("---")
-            # --- [DEBUG] Конец вывода BM25 ---
+            bm25_scores = bm25_scores_batch[variant_idx]
 
             # --- Отбор кандидатов ---
-            candidate_indices_unsorted = np.argsort(bm25_scores)
-            candidate_indices = candidate_indices_unsorted[-self.CANDIDATES_K:][::-1]
-            # Отбрасываем кандидатов с нулевой BM25 оценкой (если такие есть)
-            non_zero_bm25_mask = bm25_scores[candidate_indices] > 0
-            candidate_indices = candidate_indices[non_zero_bm25_mask]
+            # argpartition вместо полной сортировки корпуса; кандидаты с нулевой оценкой BM25 отбрасываются
+            candidate_indices = self._select_top_candidates(bm25_scores, self.CANDIDATES_K)
+            bm25_candidates_count = len(candidate_indices)
+            # Объединение с кандидатами плотного поиска перед слиянием оценок
+            if len(dense_candidates):
+                dense_only = dense_candidates[~np.isin(dense_candidates, candidate_indices)]
+                candidate_indices = np.concatenate([candidate_indices, dense_only])
+
+            # --- [DEBUG] Вывод кандидатов BM25 (строится только в режиме отладки) ---
+            if logger.isEnabledFor(logging.DEBUG):
+                top_bm25 = candidate_indices[:min(10, bm25_candidates_count)]
+                logger.debug(
+                    "Топ-10 кандидатов BM25 для варианта запроса '%.50s...':\n%s", query,
+                    "\n".join(
+                        f"  - Индекс: {idx}, Оценка BM25: {bm25_scores[idx]:.4f}, Заголовок: {title}"
+                        for idx, title in zip(top_bm25, self.dataset['Заголовок статьи'].to_numpy()[top_bm25])
+                    )
+                )
+
             if len(candidate_indices) == 0:
-                print(f"Предупреждение: Не найдено кандидатов с BM25 > 0 для варианта запроса: '{query[:50]}...'")
+                logger.warning("Не найдено кандидатов BM25 и плотного поиска для варианта запроса: '%.50s...'", query)
                 all_scores.append(np.zeros(num_docs))
                 all_candidate_data_variants.append(None) # Добавляем placeholder
                 continue # Переходим к следующему варианту
@@ -491,17 +866,15 @@ class Model:
                  bert_similarity_candidates = np.zeros(len(candidate_indices)) 
                  if self.use_bert and self.bert_embeddings is not None and query_embedding is not None: 
                      try: 
-                         candidate_bert_embeddings = self.bert_embeddings[candidate_indices] 
-                         bert_similarity = cosine_similarity( 
-                             [query_embedding], 
-                             candidate_bert_embeddings 
-                         )[0] 
+                         # Одно матрично-векторное произведение по нормализованным строкам кандидатов
+                         with tracing.span("dense_scoring", items=len(candidate_indices)):
+                             bert_similarity = self.bert_embeddings.scores(query_embedding, candidate_indices)
                          if bert_similarity.shape == (len(candidate_indices),): 
                              bert_similarity_candidates = bert_similarity 
                          else: 
-                             print(f"Предупреждение: Неожиданная форма BERT similarity: {bert_similarity.shape}") 
+                             logger.warning("Неожиданная форма BERT similarity: %s", bert_similarity.shape)
                      except Exception as e: 
-                         print(f"Ошибка при вычислении BERT сходства для кандидатов: {e}")
+                         logger.error("Ошибка при вычислении BERT сходства для кандидатов: %s", e)
  
                  # --- Нормализация BM25 (только для кандидатов) ---
                  # Инициализируем переменную перед if/else на всякий случай
@@ -515,65 +888,30 @@ class Model:
 
                  # --- Комбинированное сходство (только для кандидатов) ---
                  bert_weight = 0.5 # <<<--- Возвращаем к 0.5, чтобы дать больше веса бонусу за ключевое слово
-                 if self.use_bert:
+                 if use_dense:
                      combined_scores_candidates = (1 - bert_weight) * norm_bm25_scores_candidates + bert_weight * bert_similarity_candidates
                  else:
                      combined_scores_candidates = norm_bm25_scores_candidates
 
-            # --- [DEBUG] Вывод сырых оценок кандидатов ПЕРЕД контекстом ---
-            print(f"--- [DEBUG] Топ-{min(10, len(candidate_indices))} кандидатов ПЕРЕД контекстом (Вариант: '{query[:30]}...') ---")
-            # Сортируем индексы кандидатов по их 'сырой' комбинированной оценке
-            sorted_candidate_indices_before_context = candidate_indices[np.argsort(combined_scores_candidates)[::-1]]
-            sorted_combined_scores_before_context = np.sort(combined_scores_candidates)[::-1]
-            # Берем BM25 и BERT/CE оценки для отсортированных кандидатов
-            sorted_bm25_scores_before_context = bm25_scores[sorted_candidate_indices_before_context]
-            if self.use_cross_encoder and cross_encoder_scores is not None:
-                # Если есть CE, берем его оценки (они и есть combined_scores_candidates)
-                sorted_ce_scores_before_context = sorted_combined_scores_before_context
-                sorted_bert_scores_before_context = np.zeros_like(sorted_ce_scores_before_context) # BERT не используется напрямую
-            elif self.use_bert and 'bert_similarity_candidates' in locals() and bert_similarity_candidates is not None:
-                # Если есть BERT, берем его оценки
-                # Нужен пересчет индексов, так как bert_similarity_candidates имеет порядок candidate_indices
-                original_indices_map = {idx: i for i, idx in enumerate(candidate_indices)}
-                # Проверка на случай, если sorted_candidate_indices_before_context пуст
-                if len(sorted_candidate_indices_before_context) > 0:
-                    bert_indices_to_fetch = [original_indices_map[idx] for idx in sorted_candidate_indices_before_context]
-                    # Проверка валидности индексов
-                    if all(i < len(bert_similarity_candidates) for i in bert_indices_to_fetch):
-                       sorted_bert_scores_before_context = bert_similarity_candidates[bert_indices_to_fetch]
-                    else:
-                       print("Предупреждение: Невалидные индексы для bert_similarity_candidates.")
-                       sorted_bert_scores_before_context = np.zeros_like(sorted_combined_scores_before_context)
-                else:
-                    sorted_bert_scores_before_context = np.zeros_like(sorted_combined_scores_before_context)
-
-                sorted_ce_scores_before_context = np.zeros_like(sorted_bert_scores_before_context) # CE не используется
-            else: # Если ни BERT ни CE не используются (только BM25)
-                sorted_bert_scores_before_context = np.zeros_like(sorted_combined_scores_before_context)
-                sorted_ce_scores_before_context = np.zeros_like(sorted_combined_scores_before_context)
-
-            for i in range(min(10, len(sorted_candidate_indices_before_context))):
-                idx = sorted_candidate_indices_before_context[i]
-                raw_score = sorted_combined_scores_before_context[i]
-                # Обеспечиваем наличие переменных перед использованием
-                bm25_s = sorted_bm25_scores_before_context[i] if i < len(sorted_bm25_scores_before_context) else 0
-                bert_s = sorted_bert_scores_before_context[i] if i < len(sorted_bert_scores_before_context) else 0
-                ce_s = sorted_ce_scores_before_context[i] if i < len(sorted_ce_scores_before_context) else 0
-                title = self.dataset.loc[idx, 'Заголовок статьи']
-                print(f"  - Индекс: {idx}, Сырой Score: {raw_score:.4f} (BM25: {bm25_s:.4f}, BERT: {bert_s:.4f}, CE: {ce_s:.4f}), Заголовок: {title}")
-            print("---")
-            # --- [DEBUG] Конец вывода сырых оценок ---
+            # --- [DEBUG] Вывод сырых оценок кандидатов ПЕРЕД контекстом (только в режиме отладки) ---
+            if logger.isEnabledFor(logging.DEBUG):
+                self._log_candidates_before_context(
+                    query, candidate_indices, combined_scores_candidates, bm25_scores,
+                    bert_similarity_candidates if use_dense and cross_encoder_scores is None else None,
+                    cross_encoder_scores
+                )
 
             # --- Применение контекстных весов (только для кандидатов) ---
             # Применяется к combined_scores_candidates, полученным либо от CrossEncoder, либо от BiEncoder/BM25
-            scores_with_context_candidates = self._apply_context_weights(
-                combined_scores_candidates, # Оценки только кандидатов
-                query_type,
-                user_role,
-                component,
-                text,
-                indices=candidate_indices # Передаем индексы кандидатов
-            ) # Теперь применяем контекст ВСЕГДА, даже для CrossEncoder
+            with tracing.span("context_weighting", items=len(candidate_indices)):
+                scores_with_context_candidates = self._apply_context_weights(
+                    combined_scores_candidates, # Оценки только кандидатов
+                    query_type,
+                    user_role,
+                    component,
+                    text,
+                    indices=candidate_indices # Передаем индексы кандидатов
+                ) # Теперь применяем контекст ВСЕГДА, даже для CrossEncoder
 
             # Применение веса варианта запроса и отбор кандидатов
             final_scores_variant = np.zeros(num_docs) # Начинаем с нулей
@@ -606,7 +944,8 @@ class Model:
                 'bert': np.zeros(num_docs),
                 'cross_encoder': np.zeros(num_docs),
                 'combined_initial': np.zeros(num_docs),
-                'context_weighted': np.zeros(num_docs)
+                'context_weighted': np.zeros(num_docs),
+                'variant': np.full(num_docs, -1, dtype=np.int64) # Индекс варианта запроса с максимальной оценкой
             }
             active_doc_indices = np.where(max_scores > 0)[0]
             for doc_idx in active_doc_indices:
@@ -623,8 +962,9 @@ class Model:
                         final_debug_scores['combined_initial'][doc_idx] = candidate_data['combined'][local_idx] # Это будет оценка CE если он использовался
                         # Если контекст не применялся для CE, то context_weighted будет равен combined_initial
                         final_debug_scores['context_weighted'][doc_idx] = candidate_data['context'][local_idx] 
+                        final_debug_scores['variant'][doc_idx] = variant_idx
                     except IndexError: # Если документ не найден среди кандидатов (не должно происходить, но для безопасности)
-                        print(f"Предупреждение: Документ {doc_idx} не найден среди кандидатов варианта {variant_idx}, хотя имеет max_score > 0.")
+                        logger.warning("Документ %s не найден среди кандидатов варианта %s, хотя имеет max_score > 0.", doc_idx, variant_idx)
         else:
             # Возвращаем нули если не было вариантов запроса или произошла ошибка
             max_scores = np.zeros(num_docs)
@@ -633,12 +973,172 @@ class Model:
                 'bert': np.zeros(num_docs),
                 'cross_encoder': np.zeros(num_docs),
                 'combined_initial': np.zeros(num_docs),
-                'context_weighted': np.zeros(num_docs)
+                'context_weighted': np.zeros(num_docs),
+                'variant': np.full(num_docs, -1, dtype=np.int64) # Индекс варианта запроса с максимальной оценкой
             }
         
         # Возвращаем итоговые очки и промежуточные для отладки
         return max_scores, final_debug_scores
 
+    def _encode_query(self, text: str) -> np.ndarray:
+        """
+        Эмбеддинг запроса через общий сервис пакетирования: одновременные запросы
+        из разных потоков кодируются одним вызовом bert_model.encode
+        
+        Args:
+            text (str): Текст запроса
+            
+        Returns:
+            np.ndarray: Эмбеддинг запроса
+        """
+        query_cache = self._get_query_cache()
+        cache_key = normalize_query(text)
+        embedding = query_cache.get("embedding", cache_key)
+        if embedding is not None:
+            return embedding
+        
+        encoder = getattr(self, 'query_encoder', None)
+        if encoder is None or encoder.model is not self.bert_model:
+            with self._lazy_init_lock:
+                encoder = getattr(self, 'query_encoder', None)
+                if encoder is None or encoder.model is not self.bert_model:
+                    if encoder is not None:
+                        encoder.close()
+                    encoder = BatchingEncoder(
+                        self.bert_model,
+                        max_batch_size=self.QUERY_BATCH_MAX_SIZE,
+                        max_wait_ms=self.QUERY_BATCH_MAX_WAIT_MS
+                    )
+                    self.query_encoder = encoder
+        embedding = encoder.encode(text)
+        query_cache.set("embedding", cache_key, embedding)
+        return embedding
+
+    def _compute_version(self) -> str:
+        """
+        Версия модели: хэш содержимого датасета и время обучения
+        
+        Returns:
+            str: Идентификатор версии
+        """
+        documents = self.dataset[['Заголовок статьи', 'Описание']]
+        tombstones = self._tombstone_mask()
+        if tombstones is not None:
+            # Удаленные статьи, еще не убранные уплотнением, в версию не входят
+            documents = documents[~tombstones]
+        content_hash = hashlib.sha1(
+            pd.util.hash_pandas_object(documents, index=True).to_numpy().tobytes()
+        ).hexdigest()[:12]
+        return f"{content_hash}-{int(time.time())}"
+
+    @property
+    def model_version(self) -> str:
+        """Версия модели (для моделей, сохраненных до появления версий, вычисляется при первом обращении)"""
+        if getattr(self, 'version', None) is None:
+            self.version = self._compute_version()
+        return self.version
+
+    def _get_query_cache(self) -> QueryCache:
+        """
+        Кэш запросов модели, очищенный при смене версии модели
+        
+        Returns:
+            QueryCache: Кэш запросов
+        """
+        query_cache = getattr(self, 'query_cache', None)
+        if query_cache is None:
+            with self._lazy_init_lock:
+                query_cache = getattr(self, 'query_cache', None)
+                if query_cache is None:
+                    query_cache = self.query_cache = QueryCache()
+        query_cache.ensure_version(self.model_version)
+        return query_cache
+
+    def _get_answer_cache(self) -> SemanticAnswerCache:
+        """
+        Семантический кэш ответов LLM, очищенный при смене версии модели
+        
+        Returns:
+            SemanticAnswerCache: Кэш ответов
+        """
+        answer_cache = getattr(self, 'answer_cache', None)
+        if answer_cache is None:
+            with self._lazy_init_lock:
+                answer_cache = getattr(self, 'answer_cache', None)
+                if answer_cache is None:
+                    answer_cache = self.answer_cache = SemanticAnswerCache()
+        answer_cache.ensure_version(self.model_version)
+        return answer_cache
+
+    def _bm25_scores_batch(self, tokenized_queries: List[List[str]]) -> np.ndarray:
+        """
+        Расчет оценок BM25 сразу для нескольких токенизированных запросов
+        
+        
+        tokenized_queries (List[List[str]]): Списки токенов запросов
+            
+        Returns:
+            np.ndarray: Матрица оценок размера (количество запросов, количество документов)
+        """
+        if not self.bm25:
+            logger.warning("Модель BM25 недоступна.")
+            return np.zeros((len(tokenized_queries), len(self.dataset)))
+        return self.bm25.get_batch_scores(tokenized_queries)
+
+    @staticmethod
+    def _select_top_candidates(scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        Отбор k документов с наибольшей положительной оценкой без полной сортировки корпуса
+        
+        
+        scores (np.ndarray): Оценки документов
+        k (int): Количество кандидатов
+            
+        Returns:
+            np.ndarray: Индексы кандидатов, отсортированные по убыванию оценки
+        """
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > k:
+            positive = positive[np.argpartition(scores[positive], -k)[-k:]]
+        return positive[np.argsort(-scores[positive], kind='stable')]
+
+    def _log_candidates_before_context(
+        self,
+        query: str,
+        candidate_indices: np.ndarray,
+        combined_scores: np.ndarray,
+        bm25_scores: np.ndarray,
+        bert_scores: Optional[np.ndarray],
+        cross_encoder_scores: Optional[np.ndarray],
+        top: int = 10
+    ) -> None:
+        """
+        Отладочный вывод лучших кандидатов варианта запроса до применения контекстных весов
+        
+        Args:
+            query (str): Вариант запроса
+            candidate_indices (np.ndarray): Индексы кандидатов
+            combined_scores (np.ndarray): Комбинированные оценки кандидатов
+            bm25_scores (np.ndarray): Оценки BM25 всех документов
+            bert_scores (Optional[np.ndarray]): BERT-сходство кандидатов (None, если не использовалось)
+            cross_encoder_scores (Optional[np.ndarray]): Оценки CrossEncoder кандидатов (None, если не использовался)
+            top (int): Количество выводимых кандидатов
+        """
+        order = np.argsort(combined_scores)[::-1][:top]
+        zeros = np.zeros(len(candidate_indices))
+        bert_scores = bert_scores if bert_scores is not None else zeros
+        cross_encoder_scores = cross_encoder_scores if cross_encoder_scores is not None else zeros
+        titles = self.dataset['Заголовок статьи'].to_numpy()
+        logger.debug(
+            "Топ-%d кандидатов ПЕРЕД контекстом (Вариант: '%.30s...'):\n%s", len(order), query,
+            "\n".join(
+                f"  - Индекс: {candidate_indices[i]}, Сырой Score: {combined_scores[i]:.4f} "
+                f"(BM25: {bm25_scores[candidate_indices[i]]:.4f}, BERT: {bert_scores[i]:.4f}, "
+                f"CE: {cross_encoder_scores[i]:.4f}), Заголовок: {titles[candidate_indices[i]]}"
+                for i in order
+            )
+        )
+
     def _generate_query_variants(self, text: str, classification: Dict[str, Any]) -> List[Tuple[str, float]]:
         """
         Генерация вариантов запроса для улучшения поиска
@@ -648,15 +1148,15 @@ class Model:
         classification (Dict[str, Any]): Результат классификации запроса
             
         Returns:
-            List[Tuple[str, float]]: Список пар (вариант запроса, вес)
+            List[Tuple[str, float]]: Список пар (исходный текст варианта запроса, вес)
         """
         query_type = classification['query_type']
         user_role = classification['user_role']
         component = classification['component']
         
-        # Базовый предобработанный запрос
-        base_query = self.text_processor.preprocess_text(text)
-        variants = [(base_query, 1.0)]
+        # Варианты возвращаются в виде исходных текстов: токенизация для BM25
+        # выполняется один раз для всех вариантов в predict
+        variants = [(text, 1.0)]
         
         # Разделение запроса на части (по знакам препинания)
         parts = re.split(r'[,.;:!?]', text)
@@ -664,31 +1164,25 @@ class Model:
         
         # Если запрос можно разделить, добавляем основную часть
         if len(parts) > 1:
-            main_part = parts[0]
-            main_query = self.text_processor.preprocess_text(main_part)
-            variants.append((main_query, 0.8))
+            variants.append((parts[0], 0.8))
         
         # Если определена роль пользователя, добавляем запрос с явным указанием роли
         if user_role:
-            role_query = self.text_processor.preprocess_text(f"{text} {user_role}")
-            variants.append((role_query, 1.2))
+            variants.append((f"{text} {user_role}", 1.2))
         
         # Если определен компонент, добавляем запрос с явным указанием компонента
         if component:
-            component_query = self.text_processor.preprocess_text(f"{text} {component}")
-            variants.append((component_query, 1.1))
+            variants.append((f"{text} {component}", 1.1))
         
         # Для запросов об ошибках добавляем усиленный вариант
         if query_type == 'error':
             error_terms = ['ошибка', 'проблема', 'не работает']
             if not any(term in text.lower() for term in error_terms):
-                error_query = self.text_processor.preprocess_text(f"ошибка {text}")
-                variants.append((error_query, 0.9))
+                variants.append((f"ошибка {text}", 0.9))
         
         # Если в запросе есть указание на действие, добавляем вариант с усилением действия
         for action in classification['actions']:
-            action_query = self.text_processor.preprocess_text(f"{action} {component or ''}")
-            variants.append((action_query, 0.9))
+            variants.append((f"{action} {component or ''}", 0.9))
         
         return variants
 
@@ -704,6 +1198,8 @@ class Model:
         """
         Применение весовых коэффициентов на основе контекста запроса (МУЛЬТИПЛИКАТИВНО)
         
+        Все признаки документов (метки, леммы заголовков, наличие терминов в тексте)
+        подготовлены в _build_document_features, поэтому бонусы применяются масками NumPy.
         
         similarity (np.ndarray): Исходная релевантность
         query_type (str): Тип запроса (error/instruction/info)
@@ -716,15 +1212,17 @@ class Model:
         Returns:
             np.ndarray: Модифицированная релевантность с учетом контекста
         """
+        # Модели, сохраненные до появления предрасчитанных признаков, дополняются ими при первом запросе
+        if getattr(self, 'doc_label_codes', None) is None:
+            self._build_document_features()
+        
         # Если индексы не переданы, работаем со всеми документами
         if indices is None:
             indices_to_process = np.arange(len(self.dataset))
-            weighted_similarity = similarity.copy()
         else:
-            # Работаем только с переданными индексами
-            indices_to_process = indices
             # similarity здесь уже содержит оценки только для кандидатов
-            weighted_similarity = similarity.copy() 
+            indices_to_process = np.asarray(indices, dtype=np.int64)
+        weighted_similarity = np.array(similarity, dtype=np.float64)
 
         # --- Мультипликативные факторы для контекста ---
         type_boost_factor = 0.03 # Уменьшаем общие бонусы
@@ -732,24 +1230,19 @@ class Model:
         component_boost_factor = 0.03
         # -------------------------------------------
 
-        # Применение весов (итерируемся по индексам из similarity/indices_to_process)
-        for k, doc_idx in enumerate(indices_to_process):
-            # Применение весов по типу запроса
-            doc_type = self.document_categories.get(doc_idx)
-            if doc_type == query_type:
-                weighted_similarity[k] *= (1 + type_boost_factor)
-            
-            # Применение весов по роли пользователя
-            if user_role:
-                doc_role = self.document_roles.get(doc_idx)
-                if doc_role == user_role:
-                    weighted_similarity[k] *= (1 + role_boost_factor)
-            
-            # Применение весов по компоненту системы
-            if component:
-                doc_topic = self.document_topics.get(doc_idx)
-                if doc_topic == component:
-                    weighted_similarity[k] *= (1 + component_boost_factor)
+        # Применение весов по типу запроса, роли пользователя и компоненту системы
+        for label, value, boost_factor in (
+            ('query_type', query_type, type_boost_factor),
+            ('user_role', user_role, role_boost_factor),
+            ('component', component, component_boost_factor),
+        ):
+            if not value:
+                continue
+            code = self.label_vocabularies[label].get(value)
+            if code is None:
+                continue # Ни один документ не имеет такой метки
+            matches = self.doc_label_codes[label][indices_to_process] == code
+            weighted_similarity[matches] *= (1 + boost_factor)
 
         # Дополнительная обработка ключевых слов запроса (Бонус за заголовок)
         if text:
@@ -763,7 +1256,7 @@ class Model:
                     if token not in self.text_processor.stop_words and len(token) > 1
                 }
             except Exception as e:
-                print(f"Ошибка токенизации/лемматизации запроса для бонуса: {e}")
+                logger.warning("Ошибка токенизации/лемматизации запроса для бонуса: %s", e)
                 query_keywords = set()
             
             # Если найдены ключевые слова, повышаем релевантность документов,
@@ -771,19 +1264,10 @@ class Model:
             if query_keywords:
                 # --- Скорректированные и новые бонусы ---
                 # Бонусы за "прайслист" (остаются уменьшенными)
-                pricelist_lemma = self.text_processor.lemmatize("прайслист")
                 title_boost_pricelist = 0.2
                 body_boost_pricelist = 0.05
 
                 # Бонусы за "обновление" (ЕЩЕ УВЕЛИЧЕНЫ)
-                update_lemma = self.text_processor.lemmatize("обновление")
-                update_synonyms_lemmas = {
-                    update_lemma,
-                    self.text_processor.lemmatize("изменение"),
-                    self.text_processor.lemmatize("загрузка"), # Часто используется в контексте прайсов
-                    self.text_processor.lemmatize("замена"),
-                    self.text_processor.lemmatize("редактирование")
-                }
                 title_boost_update = 0.6  # Увеличено с 0.4
                 body_boost_update = 0.25 # Увеличено с 0.15
 
@@ -794,80 +1278,230 @@ class Model:
                 # Бонус за общие ключевые слова (остается маленьким)
                 general_keyword_boost = 0.05
 
+                # --- Проверка наличия ключевых лемм (по всем кандидатам сразу) ---
+                title_lemmas = self.title_lemma_matrix[indices_to_process]
+                has_pricelist_in_title = self._title_contains_any(title_lemmas, [self.pricelist_lemma])
+                has_update_in_title = self._title_contains_any(title_lemmas, self.update_synonyms_lemmas)
+                has_general_keywords_in_title = self._title_contains_any(title_lemmas, query_keywords)
+
+                # Проверка в теле (простая, без полной лемматизации тела для скорости)
+                body_presence = self.body_lemma_presence[indices_to_process]
+                has_pricelist_in_body = body_presence[:, 0]
+                has_update_in_body = body_presence[:, 1:].any(axis=1)
+                both_in_body = has_pricelist_in_body & has_update_in_body
+
+                # --- Применение мультипликативных бонусов ---
+                # Условия проверяются в порядке приоритета: срабатывает первое истинное
+                current_boost = np.select(
+                    [
+                        # 1. Самый сильный бонус: ОБА слова в ЗАГОЛОВКЕ
+                        has_pricelist_in_title & has_update_in_title,
+                        # 2. Сильные бонусы: одно из ТОЧНЫХ слов в ЗАГОЛОВКЕ (если не было комбинации выше)
+                        has_pricelist_in_title,
+                        has_update_in_title,
+                        # 3. Средний бонус: ОБА слова в ТЕЛЕ (и не было точных слов в заголовке)
+                        both_in_body,
+                        # 4. Слабые бонусы: одно из ТОЧНЫХ слов в ТЕЛЕ (и не было комбинации в теле)
+                        has_pricelist_in_body,
+                        has_update_in_body,
+                        # 5. Самый слабый бонус: ОБЩИЕ слова в ЗАГОЛОВКЕ (если не было никаких точных совпадений)
+                        has_general_keywords_in_title,
+                    ],
+                    [
+                        1 + combined_boost_title,
+                        1 + title_boost_pricelist,
+                        1 + title_boost_update,
+                        1 + combined_boost_body,
+                        1 + body_boost_pricelist,
+                        1 + body_boost_update,
+                        1 + general_keyword_boost,
+                    ],
+                    default=1.0
+                )
 
-                # Снова итерируемся по индексам
-                for k, doc_idx in enumerate(indices_to_process):
-                    # Используем исходную similarity[k] для проверки > 0, чтобы избежать умножения нуля
-                    # и проверяем валидность индекса k
-                    if k >= len(similarity) or similarity[k] <= 0:
-                        continue # Пропускаем, если нет оценки или она нулевая
+                # Бонус применяется только к документам с положительной исходной оценкой,
+                # чтобы избежать умножения нуля
+                positive = np.asarray(similarity) > 0
+                weighted_similarity[positive] *= current_boost[positive]
 
-                    title = self.dataset.iloc[doc_idx]['Заголовок статьи'].lower()
-                    body_text = self.dataset.loc[doc_idx, 'combined_text'].lower()
+        # Убедимся, что оценки не превышают 1.0 (из-за возможных неточностей float)
+        # np.clip(weighted_similarity, 0, 1.0, out=weighted_similarity) # <-- Закомментировано для отладки
 
-                    # Лемматизируем заголовок один раз
-                    try:
-                        title_tokens = word_tokenize(re.sub(r'[^a-zA-Zа-яА-Я0-9\\s]', ' ', title, flags=re.UNICODE))
-                        title_lemmas = {self.text_processor.lemmatize(token) for token in title_tokens}
-                    except Exception as e:
-                        print(f"Ошибка лемматизации заголовка {doc_idx} для бонуса: {e}")
-                        title_lemmas = set()
+        return weighted_similarity
 
-                    # --- Проверка наличия ключевых лемм ---
-                    has_pricelist_in_title = pricelist_lemma in title_lemmas
-                    has_update_in_title = any(lemma in title_lemmas for lemma in update_synonyms_lemmas)
+    def _title_contains_any(self, title_lemmas, lemmas) -> np.ndarray:
+        """
+        Проверка, содержит ли заголовок документа хотя бы одну из лемм
+        
+        
+        title_lemmas: Строки разреженной матрицы документ x лемма заголовка
+        lemmas: Искомые леммы
+            
+        Returns:
+            np.ndarray: Булева маска по строкам title_lemmas
+        """
+        columns = [self.title_lemma_vocabulary[lemma] for lemma in lemmas if lemma in self.title_lemma_vocabulary]
+        if not columns:
+            return np.zeros(title_lemmas.shape[0], dtype=bool)
+        return title_lemmas[:, columns].getnnz(axis=1) > 0
 
-                    # Проверка в теле (простая, без полной лемматизации тела для скорости)
-                    try:
-                        has_pricelist_in_body = pricelist_lemma in body_text
-                    except TypeError:
-                        has_pricelist_in_body = False
-                    try:
-                        has_update_in_body = any(lemma in body_text for lemma in update_synonyms_lemmas)
-                    except TypeError:
-                        has_update_in_body = False
-
-                    has_general_keywords_in_title = any(keyword in title_lemmas for keyword in query_keywords)
-
-                    # --- Применение мультипликативных бонусов ---
-                    current_boost = 1.0 # Начинаем с нейтрального множителя
-
-                    # 1. Самый сильный бонус: ОБА слова в ЗАГОЛОВКЕ
-                    if has_pricelist_in_title and has_update_in_title:
-                        current_boost *= (1 + combined_boost_title)
-                    # 2. Сильные бонусы: одно из ТОЧНЫХ слов в ЗАГОЛОВКЕ (если не было комбинации выше)
-                    elif has_pricelist_in_title:
-                         current_boost *= (1 + title_boost_pricelist)
-                    elif has_update_in_title:
-                         current_boost *= (1 + title_boost_update)
-
-                    # 3. Средний бонус: ОБА слова в ТЕЛЕ (и не было комбинации или точных слов в заголовке)
-                    elif not has_pricelist_in_title and not has_update_in_title and \
-                         has_pricelist_in_body and has_update_in_body:
-                         current_boost *= (1 + combined_boost_body)
-
-                    # 4. Слабые бонусы: одно из ТОЧНЫХ слов в ТЕЛЕ (и не было его в заголовке, и не было комбинации в теле)
-                    elif not has_pricelist_in_title and not (has_pricelist_in_body and has_update_in_body) and \
-                         has_pricelist_in_body:
-                         current_boost *= (1 + body_boost_pricelist)
-                    elif not has_update_in_title and not (has_pricelist_in_body and has_update_in_body) and \
-                         has_update_in_body:
-                        current_boost *= (1 + body_boost_update)
-
-                    # 5. Самый слабый бонус: ОБЩИЕ слова в ЗАГОЛОВКЕ (если не было никаких точных совпадений в заголовке/теле)
-                    elif not has_pricelist_in_title and not has_update_in_title and \
-                         not has_pricelist_in_body and not has_update_in_body and \
-                         has_general_keywords_in_title:
-                        current_boost *= (1 + general_keyword_boost)
-
-                    # Применяем итоговый буст к оценке
-                    weighted_similarity[k] *= current_boost
+    def _build_document_features(self):
+        """
+        Предрасчет признаков документов для контекстных весов:
+        коды меток (тип/роль/компонент), леммы заголовков в виде разреженной
+        матрицы документ x лемма и наличие ключевых терминов в тексте документа
+        """
+        # --- Коды меток документов (-1: метка не определена) ---
+        num_docs = len(self.dataset)
+        self.label_vocabularies = {}
+        self.doc_label_codes = {}
+        for label, labels_by_doc in self._document_labels():
+            vocabulary = {}
+            self.doc_label_codes[label] = self._label_codes(
+                [labels_by_doc.get(doc_idx) for doc_idx in range(num_docs)], vocabulary
+            )
+            self.label_vocabularies[label] = vocabulary
+
+        # --- Леммы заголовков ---
+        self.title_lemma_vocabulary = {}
+        self.title_lemma_matrix = self._title_lemma_rows(self.dataset['Заголовок статьи'], self.title_lemma_vocabulary)
+
+        # --- Ключевые термины бонусов и их наличие в тексте документа ---
+        self.pricelist_lemma = self.text_processor.lemmatize("прайслист")
+        self.update_synonyms_lemmas = list(dict.fromkeys(
+            self.text_processor.lemmatize(term)
+            for term in ("обновление", "изменение", "загрузка", "замена", "редактирование")
+        ))
+        self.body_lemma_presence = self._body_term_presence(self.dataset['combined_text'])
+
+    def _document_labels(self) -> List[Tuple[str, Dict[Any, Any]]]:
+        """Метки документов: название метки и словарь позиция документа -> значение"""
+        return [
+            ('query_type', self.document_categories),
+            ('user_role', self.document_roles),
+            ('component', self.document_topics),
+        ]
 
-        # Убедимся, что оценки не превышают 1.0 (из-за возможных неточностей float)
-        # np.clip(weighted_similarity, 0, 1.0, out=weighted_similarity) # <-- Закомментировано для отладки
+    @staticmethod
+    def _label_codes(values, vocabulary: Dict[str, int]) -> np.ndarray:
+        """
+        Коды значений метки (-1: метка не определена)
+        
+        
+        values: Значения метки по документам
+        vocabulary (Dict[str, int]): Значение -> код (дополняется новыми значениями)
+            
+        Returns:
+            np.ndarray: Коды по документам
+        """
+        codes = np.full(len(values), -1, dtype=np.int32)
+        for doc_idx, value in enumerate(values):
+            if value:
+                codes[doc_idx] = vocabulary.setdefault(value, len(vocabulary))
+        return codes
 
-        return weighted_similarity
+    def _title_lemma_rows(self, titles, vocabulary: Dict[str, int], start: int = 0) -> sparse.csr_matrix:
+        """
+        Разреженная матрица документ x лемма заголовка
+        
+        Args:
+            titles: Заголовки документов
+            vocabulary (Dict[str, int]): Лемма -> номер столбца (дополняется новыми леммами)
+            start (int): Позиция первого документа (для сообщений об ошибках)
+            
+        Returns:
+            sparse.csr_matrix: Матрица размера (количество заголовков, размер словаря)
+        """
+        rows, cols = [], []
+        for doc_idx, title in enumerate(titles):
+            title = str(title).lower()
+            try:
+                title_tokens = word_tokenize(re.sub(r'[^a-zA-Zа-яА-Я0-9\\s]', ' ', title, flags=re.UNICODE))
+                lemmas = {self.text_processor.lemmatize(token) for token in title_tokens}
+            except Exception as e:
+                print(f"Ошибка лемматизации заголовка {start + doc_idx} для бонуса: {e}")
+                lemmas = set()
+            for lemma in lemmas:
+                rows.append(doc_idx)
+                cols.append(vocabulary.setdefault(lemma, len(vocabulary)))
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+            shape=(len(titles), len(vocabulary))
+        )
+
+    def _body_term_presence(self, texts: pd.Series) -> np.ndarray:
+        """
+        Наличие ключевых терминов бонусов в тексте документов
+        
+        
+        texts (pd.Series): Объединенные тексты документов
+            
+        Returns:
+            np.ndarray: Булева матрица документ x термин
+        """
+        # Столбец 0 — "прайслист", остальные — синонимы "обновления" (подстрочный поиск, как и раньше)
+        body_terms = [self.pricelist_lemma] + self.update_synonyms_lemmas
+        body_texts = texts.fillna('').str.lower()
+        return np.column_stack([
+            body_texts.str.contains(term, regex=False).to_numpy(dtype=bool)
+            for term in body_terms
+        ])
+
+    def _appended_document_features(self, new_rows: pd.DataFrame, new_labels: List[List[Optional[str]]]) -> Dict[str, Any]:
+        """
+        Признаки документов (см. _build_document_features), дополненные строками
+        новых документов; текущие признаки не изменяются
+        
+        
+        new_rows (pd.DataFrame): Строки новых документов с объединенным текстом
+        new_labels (List[List[Optional[str]]]): Тип запроса, роль и компонент новых документов (по столбцам)
+            
+        Returns:
+            Dict[str, Any]: Имя атрибута модели -> новое значение
+        """
+        label_vocabularies = {label: dict(vocabulary) for label, vocabulary in self.label_vocabularies.items()}
+        doc_label_codes = {}
+        for (label, _), values in zip(self._document_labels(), new_labels):
+            vocabulary = label_vocabularies.setdefault(label, {})
+            doc_label_codes[label] = np.concatenate([self.doc_label_codes[label], self._label_codes(values, vocabulary)])
+        
+        # Новые леммы заголовков добавляют столбцы справа: строки существующих документов не меняются
+        title_lemma_vocabulary = dict(self.title_lemma_vocabulary)
+        new_title_lemmas = self._title_lemma_rows(
+            new_rows['Заголовок статьи'], title_lemma_vocabulary, start=len(self.dataset)
+        )
+        title_lemmas = self.title_lemma_matrix
+        title_lemmas = sparse.csr_matrix(
+            (title_lemmas.data, title_lemmas.indices, title_lemmas.indptr),
+            shape=(title_lemmas.shape[0], len(title_lemma_vocabulary))
+        )
+        return {
+            'label_vocabularies': label_vocabularies,
+            'doc_label_codes': doc_label_codes,
+            'title_lemma_vocabulary': title_lemma_vocabulary,
+            'title_lemma_matrix': sparse.vstack([title_lemmas, new_title_lemmas], format='csr'),
+            'body_lemma_presence': np.concatenate([
+                self.body_lemma_presence, self._body_term_presence(new_rows['combined_text'])
+            ]),
+        }
+
+    def _selected_document_features(self, positions: np.ndarray) -> Dict[str, Any]:
+        """
+        Признаки только указанных документов (уплотнение после удалений)
+        
+        
+        positions (np.ndarray): Позиции сохраняемых документов в новом порядке
+            
+        Returns:
+            Dict[str, Any]: Имя атрибута модели -> новое значение
+        """
+        return {
+            'doc_label_codes': {label: np.asarray(codes[positions]) for label, codes in self.doc_label_codes.items()},
+            'title_lemma_matrix': self.title_lemma_matrix[positions],
+            'body_lemma_presence': np.asarray(self.body_lemma_presence[positions]),
+        }
 
+    @reads("_index_lock")
     def get_recommendations(self, text: str, top_n: int = 5) -> pd.DataFrame:
         """
         Получение top_n наиболее релевантных документов
@@ -880,11 +1514,22 @@ class Model:
             pd.DataFrame: Датафрейм с найденными документами, их итоговой релевантностью 
                           и промежуточными оценками для отладки.
         """
+        # Повторный запрос отдается из кэша без обращения к моделям поиска
+        query_cache = self._get_query_cache()
+        cache_key = (normalize_query(text), top_n)
+        cached = query_cache.get("ranking", cache_key)
+        if cached is not None:
+            return cached.copy()
+        
         # Вычисление релевантности и получение промежуточных оценок
         similarity, debug_scores = self.predict(text)
         
-        # Получение индексов наиболее релевантных документов
-        indices = np.argsort(similarity)[::-1][:top_n]
+        # Получение индексов наиболее релевантных документов (удаленные документы пропускаются)
+        indices = np.argsort(similarity)[::-1]
+        tombstones = self._tombstone_mask()
+        if tombstones is not None:
+            indices = indices[~tombstones[indices]]
+        indices = indices[:top_n]
         
         # Формирование результата
         result = self.dataset.iloc[indices][['Заголовок статьи', 'Описание']].copy()
@@ -901,6 +1546,7 @@ class Model:
         result['роль'] = [self.document_roles.get(i, '') for i in indices]
         result['компонент'] = [self.document_topics.get(i, '') for i in indices]
         
+        query_cache.set("ranking", cache_key, result.copy())
         return result
     
     def _split_text_into_segments(self, text: str, segment_size: int = 150, overlap: int = 50) -> List[str]:
@@ -914,57 +1560,16 @@ class Model:
         Returns:
             List[str]: Список сегментов текста
         """
-        if not text or pd.isna(text):
-            return []
-            
-        # Разбиваем текст на предложения
-        sentences = sent_tokenize(text)
-        segments = []
-        
-        # Если текст короткий, возвращаем его целиком
-        if len(sentences) <= 3:
-            return [text]
-            
-        # Разбиваем текст на сегменты с перекрытием
-        current_segment = []
-        current_word_count = 0
-        
-        for sentence in sentences:
-            words = word_tokenize(sentence)
-            current_segment.append(sentence)
-            current_word_count += len(words)
-            
-            # Если достигнут размер сегмента, сохраняем его
-            if current_word_count >= segment_size:
-                segments.append(' '.join(current_segment))
-                
-                # Оставляем последние слова для перекрытия
-                overlap_sentences = []
-                overlap_word_count = 0
-                
-                # Идем с конца и собираем предложения до достижения нужного перекрытия
-                for sent in reversed(current_segment):
-                    sent_words = word_tokenize(sent)
-                    if overlap_word_count + len(sent_words) <= overlap:
-                        overlap_sentences.insert(0, sent)
-                        overlap_word_count += len(sent_words)
-                    else:
-                        break
-                
-                # Начинаем новый сегмент с предложений перекрытия
-                current_segment = overlap_sentences
-                current_word_count = overlap_word_count
-        
-        # Добавляем последний сегмент, если он не пустой
-        if current_segment:
-            segments.append(' '.join(current_segment))
-            
-        return segments
+        return split_text_into_segments(text, segment_size=segment_size, overlap=overlap)
     
+    @reads("_index_lock")
     def extract_relevant_fragments(self, text: str, top_n: int = 5, top_k_fragments: int = 10) -> Tuple[List[Dict[str, Any]], pd.DataFrame]: # <<< ИЗМЕНЕНО: возвращаемый тип
         """
         Извлечение наиболее релевантных фрагментов из статей для заданного запроса
         
+        Сегменты, их сущности и эмбеддинги берутся из таблицы сегментов (segment_index),
+        рассчитанной при обучении; для статей вне таблицы они вычисляются на лету.
+        
         text (str): Текст запроса
         top_n (int): Количество статей для анализа
         top_k_fragments (int): Количество фрагментов для извлечения
@@ -974,114 +1579,151 @@ class Model:
                 Список словарей с информацией о релевантных фрагментах и 
                 DataFrame с рекомендациями, использованными для их поиска.
         """
-        print(f"--- [DEBUG extract_relevant_fragments] Начало для запроса: '{text[:50]}...', top_n={top_n}, top_k_fragments={top_k_fragments}") # Отладка
+        logger.debug("[extract_relevant_fragments] Начало для запроса: '%.50s...', top_n=%s, top_k_fragments=%s", text, top_n, top_k_fragments)
+        # Повторный запрос отдается из кэша (копия: вызывающий код может менять фрагменты)
+        query_cache = self._get_query_cache()
+        cache_key = (normalize_query(text), top_n, top_k_fragments)
+        cached = query_cache.get("fragments", cache_key)
+        if cached is not None:
+            fragments, recommendations = cached
+            return copy.deepcopy(fragments), recommendations.copy()
+        
         # Получаем наиболее релевантные статьи
         recommendations = self.get_recommendations(text, top_n=top_n)
-        print(f"--- [DEBUG extract_relevant_fragments] Получено {len(recommendations)} рекомендаций.") # Отладка
+        logger.debug("[extract_relevant_fragments] Получено %d рекомендаций.", len(recommendations))
         # print(recommendations.head()) # Можно раскомментировать для просмотра рекомендаций
         
-        # Классифицируем запрос
-        query_classification = self.text_processor.classify_query(text)
+        # Замер извлечения фрагментов без учета поиска статей (он замеряется в predict)
+        fragment_span = tracing.span("fragment_extraction")
         
         # Извлекаем именованные сущности из запроса
-        query_spacy_entities = self.text_processor.extract_entities_spacy(text)
+        with tracing.span("ner", items=1):
+            query_spacy_entities = self.text_processor.extract_entities_spacy(text)
         
-        # Создаем вектор запроса
+        # Создаем нормализованный вектор запроса
+        query_embedding = None
         if self.use_bert:
-            query_embedding = self.bert_model.encode(text)
+            query_embedding = EmbeddingMatrix.normalize(self._encode_query(text))
+        
+        # Собираем сегменты всех статей: (строка рекомендаций, текст, число слов, сущности, BERT-сходство)
+        segment_index = getattr(self, 'segment_index', None)
+        article_rows = []
+        cached_segment_ids = []
+        uncached_rows = []  # Позиции в article_rows сегментов, которых нет в таблице
+        for doc_idx, row in recommendations.iterrows():
+            if segment_index is not None and segment_index.has_document(doc_idx):
+                # Сегменты статьи уже есть в таблице: только выборка строк
+                segment_ids = segment_index.segment_ids(doc_idx)
+                cached_segment_ids.append(segment_ids)
+                for segment_id in segment_ids:
+                    article_rows.append([
+                        doc_idx, row,
+                        segment_index.texts[segment_id],
+                        int(segment_index.word_counts[segment_id]),
+                        segment_index.entities[segment_id],
+                        None,
+                    ])
+                continue
+            
+            # Статьи вне таблицы (новые или измененные) обрабатываются на лету:
+            # здесь сегменты только собираются, сущности и эмбеддинги считаются ниже пакетно
+            full_text = SegmentIndex.article_text(row['Заголовок статьи'], row['Описание'])
+            for segment in self._split_text_into_segments(full_text):
+                # Пропускаем слишком короткие фрагменты (менее 20 слов)
+                word_count = len(segment.split())
+                if word_count < SegmentIndex.MIN_SEGMENT_WORDS:
+                    continue
+                uncached_rows.append(len(article_rows))
+                article_rows.append([doc_idx, row, segment, word_count, [], None])
+        
+        # Сегменты вне таблицы: один проход spaCy и один вызов encode для всех статей сразу
+        if uncached_rows:
+            uncached_texts = [article_rows[i][2] for i in uncached_rows]
+            with tracing.span("ner", items=len(uncached_texts)):
+                uncached_entities = self.text_processor.extract_entities_spacy_batch(uncached_texts)
+            for i, entities in zip(uncached_rows, uncached_entities):
+                article_rows[i][4] = entities
+            if query_embedding is not None:
+                try:
+                    segment_embeddings = EmbeddingMatrix.from_embeddings(
+                        self.bert_model.encode(uncached_texts, batch_size=self.SEGMENT_ENCODE_BATCH_SIZE),
+                        dtype=np.float32
+                    )
+                    # Сходства возвращаются в исходном порядке сегментов
+                    for i, similarity in zip(uncached_rows, segment_embeddings.scores(query_embedding)):
+                        article_rows[i][5] = float(similarity)
+                except Exception as e:
+                    logger.error("Ошибка при обработке сегментов BERT: %s", e)
         
-        all_fragments = []
+        # BERT-сходство всех сегментов из таблицы — одно матрично-векторное произведение
+        if cached_segment_ids and query_embedding is not None and segment_index.embeddings is not None:
+            similarities = iter(segment_index.embeddings.scores(query_embedding, np.concatenate(cached_segment_ids)))
+            for article_row in article_rows:
+                if segment_index.has_document(article_row[0]):
+                    article_row[5] = float(next(similarities))
         
-        # Проверяем, есть ли ключевые слова в запросе
-        text_lower = text.lower()
+        all_fragments = []
         
-        # Для каждой статьи извлекаем релевантные фрагменты
-        for i, row in recommendations.iterrows():
-            title = row['Заголовок статьи']
-            description = row['Описание'] if not pd.isna(row['Описание']) else ""
-            full_text = f"{title}. {description}"
+        # Вычисляем релевантность каждого сегмента
+        for doc_idx, row, segment, word_count, segment_spacy_entities, bert_similarity in article_rows:
             article_relevance = row['релевантность']
             
+            # Вычисляем штраф за короткие тексты
+            length_penalty = min(1.0, word_count / 50)  # Полный вес только для текстов от 50 слов
             
-            # Разбиваем статью на сегменты
-            segments = self._split_text_into_segments(full_text)
+            # Считаем совпадения сущностей
+            entity_matches = 0
+            for q_ent_text, q_ent_type in query_spacy_entities:
+                for s_ent_text, s_ent_type in segment_spacy_entities:
+                    if q_ent_type == s_ent_type and (
+                        q_ent_text.lower() in s_ent_text.lower() or 
+                        s_ent_text.lower() in q_ent_text.lower()
+                    ):
+                        entity_matches += 1
             
-            # Вычисляем релевантность каждого сегмента
-            for segment in segments:
-                # Пропускаем слишком короткие фрагменты (менее 20 слов)
-                word_count = len(segment.split())
-                if word_count < 20:
-                    continue
-                
-                # Вычисляем штраф за короткие тексты
-                length_penalty = min(1.0, word_count / 50)  # Полный вес только для текстов от 50 слов
-                
-                # Извлекаем именованные сущности из сегмента для сравнения с запросом
-                segment_spacy_entities = self.text_processor.extract_entities_spacy(segment)
-                
-                # Считаем совпадения сущностей
-                entity_matches = 0
-                for q_ent_text, q_ent_type in query_spacy_entities:
-                    for s_ent_text, s_ent_type in segment_spacy_entities:
-                        if q_ent_type == s_ent_type and (
-                            q_ent_text.lower() in s_ent_text.lower() or 
-                            s_ent_text.lower() in q_ent_text.lower()
-                        ):
-                            entity_matches += 1
-                
-                # Бонус за совпадение сущностей
-                entity_bonus = min(0.3, 0.1 * entity_matches)
+            # Бонус за совпадение сущностей
+            entity_bonus = min(0.3, 0.1 * entity_matches)
 
-                segment_relevance = 0.0 # Инициализируем релевантность сегмента
-                if self.use_bert and query_embedding is not None:
-                    # BERT-эмбединг для сегмента
-                    try:
-                        segment_embedding = self.bert_model.encode(segment)
-                        bert_similarity = cosine_similarity([query_embedding], [segment_embedding])[0][0]
-
-                        # Релевантность сегмента на основе BERT и бонуса за сущности
-                        segment_relevance = 0.8 * bert_similarity + 0.2 * entity_bonus
-                    except Exception as e:
-                        print(f"Ошибка при обработке сегмента BERT: {e}")
-                        # Если BERT не сработал, используем только бонус за сущности
-                        segment_relevance = entity_bonus
-                else:
-                    # Если BERT не используется, релевантность = бонус за сущности
-                    segment_relevance = entity_bonus
-
-                # Применяем штраф за длину текста
-                segment_relevance = segment_relevance * length_penalty
-
-                # Учитываем релевантность статьи при оценке сегмента
-                # article_relevance теперь основана на BM25 (+BERT), полученном из get_recommendations
-                combined_relevance = 0.6 * segment_relevance + 0.4 * article_relevance
-                
-                # Проверяем присутствие ключевых слов запроса в сегменте
-                segment_lower = segment.lower()
-                
-                # Дополнительная информация о сущностях
-                entity_info = {
-                    'organizations': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'ORG'],
-                    'persons': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'PER'],
-                    'locations': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'LOC']
-                }
-                
-                all_fragments.append({
-                    'fragment': segment,
-                    'relevance': combined_relevance,
-                    'title': title,
-                    'article_type': row['тип'],
-                    'user_role': row['роль'],
-                    'component': row['компонент'],
-                    'entity_matches': entity_matches,
-                    'entities': entity_info
-                })
+            if bert_similarity is not None:
+                # Релевантность сегмента на основе BERT и бонуса за сущности
+                segment_relevance = 0.8 * bert_similarity + 0.2 * entity_bonus
+            else:
+                # Если BERT не используется или не сработал, релевантность = бонус за сущности
+                segment_relevance = entity_bonus
+
+            # Применяем штраф за длину текста
+            segment_relevance = segment_relevance * length_penalty
+
+            # Учитываем релевантность статьи при оценке сегмента
+            # article_relevance теперь основана на BM25 (+BERT), полученном из get_recommendations
+            combined_relevance = 0.6 * segment_relevance + 0.4 * article_relevance
+            
+            # Дополнительная информация о сущностях
+            entity_info = {
+                'organizations': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'ORG'],
+                'persons': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'PER'],
+                'locations': [ent_text for ent_text, ent_type in segment_spacy_entities if ent_type == 'LOC']
+            }
+            
+            all_fragments.append({
+                'fragment': segment,
+                'relevance': combined_relevance,
+                'doc_id': doc_idx,
+                'title': row['Заголовок статьи'],
+                'article_type': row['тип'],
+                'user_role': row['роль'],
+                'component': row['компонент'],
+                'entity_matches': entity_matches,
+                'entities': entity_info
+            })
         
         # Сортируем фрагменты по релевантности
         all_fragments.sort(key=lambda x: x['relevance'], reverse=True)
         
         result_fragments = all_fragments[:top_k_fragments]
-        print(f"--- [DEBUG extract_relevant_fragments] Возвращается {len(result_fragments)} фрагментов.") # Отладка
+        fragment_span.stop(items=len(article_rows))
+        logger.debug("[extract_relevant_fragments] Возвращается %d фрагментов.", len(result_fragments))
+        query_cache.set("fragments", cache_key, (copy.deepcopy(result_fragments), recommendations.copy()))
         # Возвращаем top_k наиболее релевантных фрагментов и DataFrame с рекомендациями
         return result_fragments, recommendations # <<< ИЗМЕНЕНО: возвращаем кортеж
     
@@ -1096,7 +1738,7 @@ class Model:
             str: Промпт для LLM
         """
         # Классифицируем запрос
-        query_classification = self.text_processor.classify_query(text)
+        query_classification = self.classify_query(text)
         
         # Извлекаем именованные сущности из запроса
         spacy_entities = self.text_processor.extract_entities_spacy(text)
@@ -1107,8 +1749,7 @@ class Model:
         locations = query_classification.get('locations', [])
         
         # Формируем промпт
-        prompt = f"""Пользователь задал вопрос, я тебе даю его вопрос(он может быть с орфографическими ошибками, неточностями и т.д.) и даю фрагменты из нашей базы знаний. тебе нужно соеденить все фрагменты в один ответ на вопрос пользователя, ответ должен ссылаться на источник ифнормации и можно немного выдумывать информацию, чтобы пользователь получил информацию, которая ему нужна
-Вопрос пользователя: {text}
+        prompt = self.ANSWER_PROMPT_PREFIX + f"""Вопрос пользователя: {text}
 Тип запроса: {query_classification['query_type']}
 Роль пользователя: {query_classification['user_role'] or 'Не определена'}
 Компонент: {query_classification['component'] or 'Не определен'}
@@ -1127,26 +1768,46 @@ class Model:
 
         prompt += "\nРелевантные фрагменты из базы знаний:\n"
         
-        # Добавляем фрагменты
-        for i, fragment in enumerate(fragments, 1):
-            prompt += f"\n--- Фрагмент {i} (из статьи '{fragment['title']}') ---\n{fragment['fragment']}\n"
-            
-            # Добавляем информацию о сущностях, найденных во фрагменте
-            if 'entities' in fragment and any(fragment['entities'].values()):
-                prompt += "Сущности в этом фрагменте: "
-                
-                entity_parts = []
-                if fragment['entities'].get('organizations'):
-                    entity_parts.append(f"Организации: {', '.join(fragment['entities']['organizations'])}")
-                if fragment['entities'].get('persons'):
-                    entity_parts.append(f"Персоны: {', '.join(fragment['entities']['persons'])}")
-                if fragment['entities'].get('locations'):
-                    entity_parts.append(f"Местоположения: {', '.join(fragment['entities']['locations'])}")
-                
-                prompt += "; ".join(entity_parts) + "\n"
+        # Добавляем фрагменты: без повторов из перекрытия сегментов и в пределах бюджета токенов
+        count_tokens = self.llm.count_tokens if self.use_llm and self.llm else approximate_token_count
+        fragments_budget = max(0, self.PROMPT_TOKEN_BUDGET - count_tokens(prompt))
+        with tracing.span("prompt_packing", items=len(fragments)):
+            blocks = pack_fragments(fragments, self._render_fragment_block, count_tokens, fragments_budget)
+        logger.debug("В промпт помещено %d из %d фрагментов (бюджет %d токенов)", len(blocks), len(fragments), fragments_budget)
+        prompt += "".join(blocks)
         
         return prompt
     
+    @staticmethod
+    def _render_fragment_block(number: int, fragment: Dict[str, Any], text: str) -> str:
+        """
+        Блок фрагмента в промпте LLM
+        
+        Args:
+            number (int): Номер фрагмента в промпте
+            fragment (Dict[str, Any]): Фрагмент (заголовок статьи и сущности)
+            text (str): Текст фрагмента без повторов
+            
+        Returns:
+            str: Текст блока
+        """
+        block = f"\n--- Фрагмент {number} (из статьи '{fragment['title']}') ---\n{text}\n"
+        
+        # Добавляем информацию о сущностях, найденных во фрагменте
+        if 'entities' in fragment and any(fragment['entities'].values()):
+            block += "Сущности в этом фрагменте: "
+            
+            entity_parts = []
+            if fragment['entities'].get('organizations'):
+                entity_parts.append(f"Организации: {', '.join(fragment['entities']['organizations'])}")
+            if fragment['entities'].get('persons'):
+                entity_parts.append(f"Персоны: {', '.join(fragment['entities']['persons'])}")
+            if fragment['entities'].get('locations'):
+                entity_parts.append(f"Местоположения: {', '.join(fragment['entities']['locations'])}")
+            
+            block += "; ".join(entity_parts) + "\n"
+        return block
+    
     def _create_reasoning_prompt(self, query: str, query_classification: Dict[str, Any], recommendations: pd.DataFrame, fragments: List[Dict[str, Any]]) -> str:
         """
         Создание промпта для LLM для генерации объяснения выбора статей и фрагментов.
@@ -1160,13 +1821,8 @@ class Model:
         Returns:
             str: Промпт для LLM.
         """
-        print(f"--- [DEBUG _create_reasoning_prompt] Начало создания промпта.") # Отладка
-        prompt = f"""Объясни от первого лица, как ты пришел к ответу на следующий запрос пользователя. Опиши свой ход мыслей по шагам: 
-1. Анализ запроса: кратко опиши, как ты понял запрос (тип, ключевые темы/сущности).
-2. Поиск статей: какие статьи из базы знаний показались наиболее релевантными и почему (например, упомяни совпадение ключевых слов, тематики, контекста). Упомяни 1-3 самые важные статьи.
-3. Выбор фрагментов: почему ты выбрал именно эти фрагменты из найденных статей для формирования ответа? Что в них было важного?
-
-Запрос пользователя: "{query}"
+        logger.debug("[_create_reasoning_prompt] Начало создания промпта.")
+        prompt = self.REASONING_PROMPT_PREFIX + f"""Запрос пользователя: "{query}"
 
 Твой анализ запроса:
 - Тип: {query_classification.get('query_type', 'не определен')}
@@ -1193,10 +1849,141 @@ class Model:
             prompt += f"  (Релевантность фрагмента: {fragment_info['relevance']:.3f}, Совпадений сущностей: {fragment_info.get('entity_matches', 0)})\n"
             
         prompt += "\nТеперь, опиши свой ход мыслей:"
-        print(f"--- [DEBUG _create_reasoning_prompt] Промпт успешно создан (длина: {len(prompt)}).") # Отладка
+        logger.debug("[_create_reasoning_prompt] Промпт успешно создан (длина: %d).", len(prompt))
         return prompt
     
-    def generate_answer(self, text: str, top_n: int = 5, top_k_fragments: int = 7) -> Dict[str, Any]:
+    def _generate_reasoning(self, query: str, query_classification: Dict[str, Any], recommendations: pd.DataFrame, fragments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Генерация объяснения выбора статей и фрагментов отдельным вызовом LLM
+        
+        Args:
+            query (str): Текст запроса пользователя
+            query_classification (Dict[str, Any]): Результат классификации запроса
+            recommendations (pd.DataFrame): DataFrame с рекомендованными статьями
+            fragments (List[Dict[str, Any]]): Извлеченные релевантные фрагменты
+            
+        Returns:
+            Dict[str, Any]: {"reasoning": текст объяснения, "failed": признак ошибки генерации}
+        """
+        if not (self.use_llm and self.llm):
+            if not fragments: # Если фрагментов нет, даем другую причину
+                reasoning_text = "Не найдено релевантных фрагментов текста в статьях базы знаний, соответствующих запросу."
+            else: # Если фрагменты есть, но LLM нет
+                reasoning_text = "Объяснение не сгенерировано, так как LLM отключена. Ответ сформирован на основе наиболее релевантного фрагмента."
+            return {"reasoning": reasoning_text, "failed": False}
+        
+        logger.debug("Генерация объяснения выбора (reasoning)...")
+        reasoning_prompt = self._create_reasoning_prompt(query, query_classification, recommendations, fragments)
+        try:
+            # Используем немного другие параметры для краткости
+            reasoning_args = {
+                "max_new_tokens": 150, # Короче ответ для объяснения
+                "temperature": 0.5, # Менее креативный
+                "top_p": 0.9,
+                "do_sample": True
+            }
+            
+            with tracing.span("llm_reasoning", items=len(fragments)):
+                reasoning_text_raw = self.llm.generate(reasoning_prompt, **reasoning_args)
+
+            # Пост-обработка
+            reasoning_text = self._clean_llm_output(reasoning_text_raw)
+            logger.debug("Объяснение LLM получено: %.200s...", reasoning_text)
+            return {"reasoning": reasoning_text, "failed": False}
+
+        except Exception as e:
+            logger.error("Ошибка при генерации объяснения LLM: %s", e)
+            return {"reasoning": f"Произошла ошибка при генерации объяснения: {e}", "failed": True}
+
+    def _get_reasoning_jobs(self) -> ReasoningJobs:
+        """
+        Пул генерации объяснений (создается при первом запросе с режимом parallel или background)
+        
+        Returns:
+            ReasoningJobs: Пул задач объяснения
+        """
+        reasoning_jobs = getattr(self, 'reasoning_jobs', None)
+        if reasoning_jobs is None:
+            with self._lazy_init_lock:
+                reasoning_jobs = getattr(self, 'reasoning_jobs', None)
+                if reasoning_jobs is None:
+                    reasoning_jobs = self.reasoning_jobs = ReasoningJobs()
+        return reasoning_jobs
+
+    def _start_reasoning(self, reasoning_mode: str, query: str, query_classification: Dict[str, Any], recommendations: pd.DataFrame, fragments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Запуск генерации объяснения в выбранном режиме (до генерации ответа, чтобы
+        режимы parallel и background не ждали ее окончания)
+        
+        Args:
+            reasoning_mode (str): "sync", "skip", "background" или "parallel"
+            query (str): Текст запроса пользователя
+            query_classification (Dict[str, Any]): Результат классификации запроса
+            recommendations (pd.DataFrame): DataFrame с рекомендованными статьями
+            fragments (List[Dict[str, Any]]): Извлеченные релевантные фрагменты
+            
+        Returns:
+            Dict[str, Any]: Состояние задачи для _finish_reasoning
+        """
+        args = (query, query_classification, recommendations, fragments)
+        job = {"mode": reasoning_mode, "args": args}
+        # Без LLM объяснение — готовая строка, отложенный режим не нужен
+        if not (self.use_llm and self.llm) and reasoning_mode != "skip":
+            job["mode"] = "sync"
+        elif reasoning_mode == "parallel":
+            job["future"] = self._get_reasoning_jobs().submit(self._generate_reasoning, *args)
+        elif reasoning_mode == "background":
+            job["id"] = self._get_reasoning_jobs().submit_background(self._generate_reasoning, *args)
+        return job
+
+    def _finish_reasoning(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Результат генерации объяснения для ответа
+        
+        Args:
+            job (Dict[str, Any]): Состояние из _start_reasoning
+            
+        Returns:
+            Dict[str, Any]: Поля ответа "reasoning", "reasoning_status" ("done", "skipped",
+                "pending" или "error") и "reasoning_id" (для фонового режима), а также "failed"
+        """
+        mode = job["mode"]
+        if mode == "skip":
+            return {"reasoning": None, "reasoning_status": "skipped", "reasoning_id": None, "failed": False}
+        if mode == "background":
+            return {"reasoning": None, "reasoning_status": "pending", "reasoning_id": job["id"], "failed": False}
+        if mode == "parallel":
+            generated = job["future"].result()
+        else:
+            generated = self._generate_reasoning(*job["args"])
+        return {
+            "reasoning": generated["reasoning"],
+            "reasoning_status": "error" if generated["failed"] else "done",
+            "reasoning_id": None,
+            "failed": generated["failed"]
+        }
+
+    def get_reasoning(self, reasoning_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Объяснение, сгенерированное в фоновом режиме
+        
+        Args:
+            reasoning_id (str): Идентификатор из поля "reasoning_id" ответа
+            
+        Returns:
+            Optional[Dict[str, Any]]: Статус ("pending", "done" или "error") и объяснение,
+                либо None, если идентификатор неизвестен или результат устарел
+        """
+        result = self._get_reasoning_jobs().get(reasoning_id)
+        if result is None:
+            return None
+        return {
+            "reasoning_id": reasoning_id,
+            "status": "error" if result.get("failed") else result["status"],
+            "reasoning": result.get("reasoning")
+        }
+    
+    def generate_answer(self, text: str, top_n: int = 5, top_k_fragments: int = 7, reasoning_mode: Optional[str] = None) -> Dict[str, Any]:
         """
         Генерация ответа на запрос пользователя с использованием гибридного подхода
 
@@ -1204,11 +1991,15 @@ class Model:
             text (str): Текст запроса пользователя
             top_n (int): Количество релевантных документов для поиска
             top_k_fragments (int): Количество фрагментов для анализа
+            reasoning_mode (Optional[str]): Генерация объяснения: "sync" — до возврата ответа,
+                "skip" — без объяснения, "background" — в фоне (результат через get_reasoning
+                по "reasoning_id"), "parallel" — одновременно с ответом; None — NEYRO_REASONING_MODE
 
         Returns:
             Dict[str, Any]: Словарь с ответом, фрагментами, источниками и объяснением
         """
         start_time = time.time()
+        reasoning_mode = resolve_reasoning_mode(reasoning_mode)
         
         if not text.strip():
             return {
@@ -1216,176 +2007,140 @@ class Model:
                 "fragments": [], 
                 "sources": [],
                 "reasoning": "Запрос не содержит текста.", # Добавляем причину для пустого запроса
+                "reasoning_status": "done",
+                "reasoning_id": None,
                 "llm_answer_raw": "",
                 "recommendations_df_json": pd.DataFrame().to_json(orient="records", force_ascii=False),
                 "execution_time": time.time() - start_time
             }
 
-        print(f"\\nПолучен запрос: '{text}'")
-        print(f"Параметры: top_n={top_n}, top_k_fragments={top_k_fragments}")
+        logger.debug("Получен запрос: '%s' (top_n=%s, top_k_fragments=%s)", text, top_n, top_k_fragments)
 
         try:
             # 1. Классификация запроса (чтобы передать в _create_reasoning_prompt)
-            print("Анализ запроса...")
-            query_classification = self.text_processor.classify_query(text)
-            print(f"Результаты классификации: {query_classification}")
+            logger.debug("Анализ запроса...")
+            with tracing.span("classify_query", items=1):
+                query_classification = self.classify_query(text)
+            logger.debug("Результаты классификации: %s", query_classification)
             
             # 2. Извлечение релевантных фрагментов и получение DataFrame с рекомендациями
-            print(f"Извлечение релевантных фрагментов (top_n={top_n}, top_k_fragments={top_k_fragments})...")
-            # Вызываем extract_relevant_fragments, он вернет и фрагменты, и DataFrame
-            fragments, recommendations_df = self.extract_relevant_fragments(
-                text, 
-                top_n=top_n, 
-                top_k_fragments=top_k_fragments
-            )
-            print(f"Найдено {len(fragments)} релевантных фрагментов.")
+            logger.debug("Извлечение релевантных фрагментов...")
+            # Вызываем extract_relevant_fragments, он вернет и фрагменты, и DataFrame.
+            # Источники формируются под той же блокировкой: позиции документов
+            # меняются при уплотнении индексов (см. compact), пока генерируется ответ
+            with self._index_lock.read():
+                fragments, recommendations_df = self.extract_relevant_fragments(
+                    text, 
+                    top_n=top_n, 
+                    top_k_fragments=top_k_fragments
+                )
+                # Порядок источников — по первому появлению во фрагментах (по убыванию релевантности)
+                source_ids = list(dict.fromkeys(frag['doc_id'] for frag in fragments))
+                sources = self._build_sources(source_ids)
+                # Версия, к которой относятся позиции статей: по ней проверяется семантический кэш
+                index_version = self.model_version
+            logger.debug("Найдено %d релевантных фрагментов.", len(fragments))
             # print(f"DataFrame рекомендаций (первые 5):\\n{recommendations_df.head().to_string()}") # Отладка
 
             # Добавляем обработку случая, когда фрагменты не найдены
             if not fragments:
-                print("Релевантные фрагменты не найдены.")
+                logger.info("Релевантные фрагменты не найдены.")
                 # Можно вернуть стандартный ответ или попробовать сгенерировать ответ без фрагментов
                 return {
                     "answer": "К сожалению, не удалось найти точную информацию по вашему запросу в базе знаний.",
                     "fragments": [],
                     "sources": [],
                     "reasoning": "Не найдено релевантных фрагментов текста в статьях базы знаний, соответствующих запросу.",
+                    "reasoning_status": "done",
+                    "reasoning_id": None,
                     "llm_answer_raw": "",
                     "recommendations_df_json": recommendations_df.to_json(orient="records", force_ascii=False),
                     "execution_time": time.time() - start_time
                 }
 
+            # 2a. Семантический кэш: близкий запрос с теми же лучшими статьями уже получал ответ LLM
+            answer_cache = None
+            query_unit = None
+            top_doc_ids = list(recommendations_df.index)
+            if self.use_llm and self.llm and self.use_bert and self.bert_model is not None:
+                try:
+                    answer_cache = self._get_answer_cache()
+                    query_unit = EmbeddingMatrix.normalize(self._encode_query(text))
+                    cached_answer = answer_cache.lookup(query_unit, top_doc_ids, index_version)
+                except Exception as e:
+                    logger.warning("Семантический кэш ответов недоступен: %s", e)
+                    answer_cache = None
+                    cached_answer = None
+                if cached_answer is not None:
+                    cached_result, similarity = cached_answer
+                    logger.debug("Ответ взят из семантического кэша (сходство %.4f)", similarity)
+                    result = dict(cached_result)
+                    if result.get("reasoning") is None:
+                        # Ответ сохранен запросом без объяснения: объяснение строится в режиме текущего запроса
+                        reasoning = self._finish_reasoning(self._start_reasoning(
+                            reasoning_mode, text, query_classification, recommendations_df, fragments
+                        ))
+                    elif reasoning_mode == "skip":
+                        reasoning = {"reasoning": None, "reasoning_status": "skipped", "reasoning_id": None}
+                    else:
+                        reasoning = {"reasoning": result["reasoning"], "reasoning_status": "done", "reasoning_id": None}
+                    result.update({
+                        "reasoning": reasoning["reasoning"],
+                        "reasoning_status": reasoning["reasoning_status"],
+                        "reasoning_id": reasoning["reasoning_id"],
+                        "fragments": fragments,
+                        "recommendations_df_json": recommendations_df.to_json(orient="records", force_ascii=False),
+                        "answer_cache": {"hit": True, "similarity": similarity},
+                        "execution_time": time.time() - start_time
+                    })
+                    return result
+
+            # Объяснение в режимах parallel и background запускается до генерации ответа
+            reasoning_job = self._start_reasoning(reasoning_mode, text, query_classification, recommendations_df, fragments)
+
             # 3. Генерация ответа с помощью LLM (если включено)
+            llm_failed = False # Ответы с ошибками генерации не попадают в семантический кэш
             llm_answer = "Генерация ответа LLM отключена."
             llm_answer_raw = "" # Сохраняем 'сырой' ответ LLM для отладки
             if self.use_llm and self.llm:
-                print("Генерация ответа с помощью LLM...")
+                logger.debug("Генерация ответа с помощью LLM...")
                 prompt = self.create_prompt_for_llm(text, fragments)
                 # print(f"--- LLM Prompt для ответа: ---\\n{prompt}\\n---") # Отладка
                 
-                # Убедимся, что llm - это pipeline
-                if isinstance(self.llm, pipeline):
-                    try:
-                        # Устанавливаем параметры генерации
-                        generation_args = {
-                            "max_new_tokens": 350, # Увеличим немного лимит
-                            "temperature": 0.7, # Можно немного повысить для разнообразия
-                            "top_p": 0.9,
-                            "do_sample": True,
-                            "eos_token_id": self.llm.tokenizer.eos_token_id,
-                            "pad_token_id": self.llm.tokenizer.pad_token_id if self.llm.tokenizer.pad_token_id else self.llm.tokenizer.eos_token_id # Используем eos если pad не задан
-                        }
-                        
-                        outputs = self.llm(prompt, **generation_args)
-                        generated_text = outputs[0]['generated_text']
-                        
-                        # Извлекаем только сгенерированный ответ (после промпта)
-                        # Ищем конец промпта, чтобы отсечь его. Phi-3 обычно добавляет <|end|> или <|assistant|>
-                        prompt_end_markers = ["<|end|>", "<|assistant|>"]
-                        answer_start_index = -1
-                        # Ищем последнее вхождение маркера конца промпта
-                        for marker in prompt_end_markers:
-                           idx = generated_text.rfind(marker)
-                           if idx != -1:
-                               answer_start_index = max(answer_start_index, idx + len(marker))
-
-                        if answer_start_index != -1:
-                             llm_answer_raw = generated_text[answer_start_index:].strip()
-                        else:
-                            # Если маркеры не найдены, пытаемся отрезать исходный промпт
-                            if generated_text.startswith(prompt):
-                                llm_answer_raw = generated_text[len(prompt):].strip()
-                            else:
-                                # Если и это не сработало, берем все как есть (менее надежно)
-                                llm_answer_raw = generated_text.strip()
-                                print("Предупреждение: Не удалось точно отделить ответ LLM от промпта.")
-
-                        # Пост-обработка ответа (убираем возможные артефакты)
-                        llm_answer = llm_answer_raw.replace("<|endoftext|>", "").replace("<|im_end|>", "").strip()
-                        
-                        print(f"Ответ LLM получен (сырой): {llm_answer_raw[:200]}...") # Показываем начало сырого ответа
-                        print(f"Ответ LLM получен (обработанный): {llm_answer[:200]}...") # Показываем начало обработанного ответа
-
-                    except Exception as e:
-                        print(f"Ошибка при генерации ответа LLM: {e}")
-                        # traceback.print_exc() # Для детальной отладки
-                        llm_answer = "Произошла ошибка при генерации ответа."
-                        llm_answer_raw = f"Error: {e}"
-                else:
-                    print("Ошибка: self.llm не является объектом pipeline.")
-                    llm_answer = "Ошибка конфигурации LLM."
-                    llm_answer_raw = "LLM is not a Hugging Face pipeline object."
+                try:
+                    # Среда выполнения LLM возвращает только сгенерированный текст (без промпта)
+                    with tracing.span("llm_answer", items=len(fragments)):
+                        llm_answer_raw = self.llm.generate(prompt, **self._answer_generation_args()).strip()
+
+                    # Пост-обработка ответа (убираем возможные артефакты)
+                    llm_answer = self._clean_llm_output(llm_answer_raw)
+                    
+                    logger.debug("Ответ LLM получен (сырой): %.200s...", llm_answer_raw)
+                    logger.debug("Ответ LLM получен (обработанный): %.200s...", llm_answer)
+
+                except Exception as e:
+                    logger.error("Ошибка при генерации ответа LLM: %s", e)
+                    llm_failed = True
+                    # traceback.print_exc() # Для детальной отладки
+                    llm_answer = "Произошла ошибка при генерации ответа."
+                    llm_answer_raw = f"Error: {e}"
             else:
                  # Если LLM отключен, формируем ответ из лучших фрагментов
-                 print("LLM отключен. Формируем ответ из лучших фрагментов.")
+                 logger.debug("LLM отключен. Формируем ответ из лучших фрагментов.")
                  # Сортируем фрагменты по убыванию score_final, если он есть, иначе по score_cross_encoder
                  sort_key = 'score_final' if 'score_final' in fragments[0] else 'score_cross_encoder'
                  fragments.sort(key=lambda x: x.get(sort_key, 0), reverse=True)
                  # Берем текст первого (лучшего) фрагмента
-                 llm_answer = fragments[0]['text']
+                 llm_answer = fragments[0]['fragment']
                  llm_answer_raw = "LLM disabled. Used best fragment."
 
 
-            # 4. Генерация объяснения ("размышления") с помощью LLM (если включено)
-            reasoning_text = "Генерация объяснения отключена или произошла ошибка."
-            if self.use_llm and self.llm and isinstance(self.llm, pipeline):
-                print("Генерация объяснения выбора (reasoning)...")
-                reasoning_prompt = self._create_reasoning_prompt(text, query_classification, recommendations_df, fragments)
-                # print(f"--- LLM Prompt для объяснения: ---\\n{reasoning_prompt}\\n---") # Отладка
-                try:
-                    # Используем немного другие параметры для краткости
-                    reasoning_args = {
-                        "max_new_tokens": 150, # Короче ответ для объяснения
-                        "temperature": 0.5, # Менее креативный
-                        "top_p": 0.9,
-                        "do_sample": True,
-                        "eos_token_id": self.llm.tokenizer.eos_token_id,
-                        "pad_token_id": self.llm.tokenizer.pad_token_id if self.llm.tokenizer.pad_token_id else self.llm.tokenizer.eos_token_id
-                    }
-                    
-                    reasoning_outputs = self.llm(reasoning_prompt, **reasoning_args)
-                    generated_reasoning = reasoning_outputs[0]['generated_text']
-
-                    # Извлекаем только сгенерированное объяснение
-                    prompt_end_markers = ["<|end|>", "<|assistant|>"]
-                    reasoning_start_index = -1
-                    for marker in prompt_end_markers:
-                       idx = generated_reasoning.rfind(marker)
-                       if idx != -1:
-                           reasoning_start_index = max(reasoning_start_index, idx + len(marker))
-                    
-                    if reasoning_start_index != -1:
-                         reasoning_text_raw = generated_reasoning[reasoning_start_index:].strip()
-                    else:
-                        if generated_reasoning.startswith(reasoning_prompt):
-                            reasoning_text_raw = generated_reasoning[len(reasoning_prompt):].strip()
-                        else:
-                            reasoning_text_raw = generated_reasoning.strip()
-                            print("Предупреждение: Не удалось точно отделить объяснение LLM от промпта.")
-
-                    # Пост-обработка
-                    reasoning_text = reasoning_text_raw.replace("<|endoftext|>", "").replace("<|im_end|>", "").strip()
-                    print(f"Объяснение LLM получено: {reasoning_text[:200]}...")
+            # 4. Объяснение ("размышления"): генерируется сразу, пропускается, ожидается
+            # из параллельной задачи или остается фоновой задаче (см. reasoning_mode)
+            reasoning = self._finish_reasoning(reasoning_job)
 
-                except Exception as e:
-                    print(f"Ошибка при генерации объяснения LLM: {e}")
-                    # traceback.print_exc() # Для детальной отладки
-                    reasoning_text = f"Произошла ошибка при генерации объяснения: {e}"
-            elif not (self.use_llm and self.llm and isinstance(self.llm, pipeline)):
-                 reasoning_text = "Генерация объяснения невозможна: LLM отключена или не является pipeline."
-                 if not fragments: # Если фрагментов нет, даем другую причину
-                      reasoning_text = "Не найдено релевантных фрагментов текста в статьях базы знаний, соответствующих запросу."
-                 elif fragments: # Если фрагменты есть, но LLM нет
-                      reasoning_text = "Объяснение не сгенерировано, так как LLM отключена. Ответ сформирован на основе наиболее релевантного фрагмента."
-
-
-            # 5. Формирование источников
-            print("Формирование источников...")
-            source_ids = set(frag['doc_id'] for frag in fragments)
-            sources = self.dataset.loc[list(source_ids), ['id', 'Заголовок статьи', 'Ссылка на статью']].rename(
-                 columns={'Заголовок статьи': 'title', 'Ссылка на статью': 'url', 'id': 'doc_id'}
-            ).to_dict('records')
-            print(f"Сформировано {len(sources)} источников.")
+            # 5. Источники сформированы вместе с фрагментами (шаг 2)
+            logger.debug("Сформировано %d источников.", len(sources))
 
             # 6. Формирование итогового ответа
             end_time = time.time()
@@ -1393,17 +2148,30 @@ class Model:
                 "answer": llm_answer,
                 "fragments": fragments, # Оставляем фрагменты для возможного использования на фронтенде
                 "sources": sources,
-                "reasoning": reasoning_text, # Добавляем сгенерированное объяснение
+                "reasoning": reasoning["reasoning"], # Объяснение (None, если пропущено или генерируется в фоне)
+                "reasoning_status": reasoning["reasoning_status"],
+                "reasoning_id": reasoning["reasoning_id"], # Идентификатор для получения фонового объяснения
                 "llm_answer_raw": llm_answer_raw, # Добавляем сырой ответ для отладки
                 "recommendations_df_json": recommendations_df.to_json(orient="records", force_ascii=False), # Добавляем DF для анализа
+                "answer_cache": {"hit": False, "similarity": None},
                 "execution_time": end_time - start_time
             }
-            print(f"Генерация ответа завершена за {result['execution_time']:.2f} сек.")
+            logger.debug("Генерация ответа завершена за %.2f сек.", result['execution_time'])
+            
+            # Сохраняем ответ LLM в семантический кэш (фрагменты и время выполнения берутся из нового запроса).
+            # Объяснение сохраняется, только если оно сгенерировано без ошибок
+            if answer_cache is not None and not llm_failed:
+                answer_cache.store(query_unit, top_doc_ids, {
+                    "answer": llm_answer,
+                    "sources": sources,
+                    "reasoning": reasoning["reasoning"] if reasoning["reasoning_status"] == "done" else None,
+                    "llm_answer_raw": llm_answer_raw
+                }, index_version)
             return result
 
         except Exception as e:
             # Логируем ошибку
-            print(f"Критическая ошибка в generate_answer: {e}")
+            logger.exception("Критическая ошибка в generate_answer: %s", e)
             # import traceback # Раскомментируйте для полного стека вызовов
             # traceback.print_exc()
             
@@ -1413,18 +2181,298 @@ class Model:
                 "fragments": [],
                 "sources": [],
                 "reasoning": f"Ошибка обработки: {e}", # Указываем ошибку в причине
+                "reasoning_status": "error",
+                "reasoning_id": None,
                 "llm_answer_raw": "",
                 "recommendations_df_json": pd.DataFrame().to_json(orient="records", force_ascii=False),
                 "execution_time": time.time() - start_time
             }
 
+    def _register_prompt_prefixes(self) -> None:
+        """
+        Предварительный расчет KV-кэша неизменных вступлений промптов: при генерации
+        модель обрабатывает только часть промпта после вступления
+        """
+        # Вступление ответа последним: llama.cpp хранит кэш только последнего промпта
+        for prefix in (self.REASONING_PROMPT_PREFIX, self.ANSWER_PROMPT_PREFIX):
+            try:
+                self.llm.register_prefix(prefix)
+            except Exception as e:
+                logger.warning("Не удалось подготовить KV-кэш вступления промпта: %s", e)
+
+    def _answer_generation_args(self) -> Dict[str, Any]:
+        """
+        Параметры генерации ответа LLM
+        
+        Returns:
+            Dict[str, Any]: Аргументы для LLMBackend.generate и LLMBackend.stream
+        """
+        return {
+            "max_new_tokens": 350, # Увеличим немного лимит
+            "temperature": 0.7, # Можно немного повысить для разнообразия
+            "top_p": 0.9,
+            "do_sample": True
+        }
+
+    @staticmethod
+    def _clean_llm_output(text: str) -> str:
+        """
+        Удаление служебных токенов и текста после маркера конца ответа
+        
+        Args:
+            text (str): Сгенерированный текст
+            
+        Returns:
+            str: Очищенный текст
+        """
+        for marker in ("<|end|>", "<|user|>"):
+            marker_index = text.find(marker)
+            if marker_index != -1:
+                text = text[:marker_index]
+        return text.replace("<|endoftext|>", "").replace("<|im_end|>", "").replace("<|assistant|>", "").strip()
+
+    def generate_answer_stream(self, text: str, top_n: int = 5, top_k_fragments: int = 7) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Потоковая генерация ответа: события отдаются по мере готовности,
+        токены ответа LLM — сразу после их генерации
+        
+        Args:
+            text (str): Текст запроса пользователя
+            top_n (int): Количество релевантных документов для поиска
+            top_k_fragments (int): Количество фрагментов для анализа
+            
+        Yields:
+            Tuple[str, Dict[str, Any]]: Событие и его данные:
+                "context" — источники и фрагменты (до начала генерации),
+                "token" — очередной фрагмент текста ответа,
+                "done" — итоговый ответ, источники, анализ запроса и время выполнения,
+                "error" — сообщение об ошибке
+        """
+        start_time = time.time()
+        
+        if not text.strip():
+            yield "done", {"answer": "Пустой запрос.", "sources": [], "execution_time": time.time() - start_time}
+            return
+        
+        try:
+            with tracing.span("classify_query", items=1):
+                query_classification = self.classify_query(text)
+            with self._index_lock.read():
+                fragments, recommendations_df = self.extract_relevant_fragments(
+                    text,
+                    top_n=top_n,
+                    top_k_fragments=top_k_fragments
+                )
+                source_ids = list(dict.fromkeys(frag['doc_id'] for frag in fragments))
+                sources = self._build_sources(source_ids)
+                index_version = self.model_version
+            yield "context", {"sources": sources, "fragments": fragments}
+            
+            done = {"sources": sources, "query_analysis": query_classification}
+            if not fragments:
+                answer = "К сожалению, не удалось найти точную информацию по вашему запросу в базе знаний."
+                yield "token", {"text": answer}
+                yield "done", dict(done, answer=answer, execution_time=time.time() - start_time)
+                return
+            
+            if not (self.use_llm and self.llm):
+                # LLM отключен: ответом служит лучший фрагмент
+                answer = fragments[0]['fragment']
+                yield "token", {"text": answer}
+                yield "done", dict(done, answer=answer, execution_time=time.time() - start_time)
+                return
+            
+            # Семантический кэш ответов: готовый ответ отдается одним событием
+            answer_cache = None
+            query_unit = None
+            top_doc_ids = list(recommendations_df.index)
+            if self.use_bert and self.bert_model is not None:
+                answer_cache = self._get_answer_cache()
+                query_unit = EmbeddingMatrix.normalize(self._encode_query(text))
+                cached_answer = answer_cache.lookup(query_unit, top_doc_ids, index_version)
+                if cached_answer is not None:
+                    cached_result, similarity = cached_answer
+                    yield "token", {"text": cached_result["answer"]}
+                    yield "done", dict(
+                        done,
+                        answer=cached_result["answer"],
+                        reasoning=cached_result.get("reasoning"),
+                        answer_cache={"hit": True, "similarity": similarity},
+                        execution_time=time.time() - start_time
+                    )
+                    return
+            
+            # Токены читаются из потоковой генерации среды выполнения LLM
+            prompt = self.create_prompt_for_llm(text, fragments)
+            llm_span = tracing.span("llm_answer", items=len(fragments))
+            chunks = []
+            try:
+                for chunk in self.llm.stream(prompt, **self._answer_generation_args()):
+                    chunks.append(chunk)
+                    yield "token", {"text": chunk}
+            except Exception as e:
+                logger.error("Ошибка при потоковой генерации ответа LLM: %s", e)
+                yield "error", {"detail": f"Произошла ошибка при генерации ответа: {e}"}
+                return
+            finally:
+                llm_span.stop()
+            
+            answer = self._clean_llm_output("".join(chunks))
+            if answer_cache is not None:
+                answer_cache.store(query_unit, top_doc_ids, {
+                    "answer": answer,
+                    "sources": sources,
+                    "reasoning": None,
+                    "llm_answer_raw": answer
+                }, index_version)
+            yield "done", dict(done, answer=answer, execution_time=time.time() - start_time)
+        
+        except Exception as e:
+            logger.exception("Критическая ошибка в generate_answer_stream: %s", e)
+            yield "error", {"detail": f"Произошла внутренняя ошибка при обработке запроса: {e}"}
+
+    @reads("_index_lock")
+    def _build_sources(self, doc_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        Формирование списка источников ответа по индексам документов
+        
+        
+        doc_ids (List[int]): Индексы документов в датасете
+            
+        Returns:
+            List[Dict[str, Any]]: Источники с полями doc_id, title и url
+        """
+        # Идентификатор и ссылка есть не во всех выгрузках базы знаний
+        has_id = 'id' in self.dataset.columns
+        has_url = 'Ссылка на статью' in self.dataset.columns
+        return [
+            {
+                'doc_id': self._json_value(self.dataset.at[doc_id, 'id']) if has_id else int(doc_id),
+                'title': self._json_value(self.dataset.at[doc_id, 'Заголовок статьи']),
+                'url': self._json_value(self.dataset.at[doc_id, 'Ссылка на статью']) if has_url else None,
+            }
+            for doc_id in doc_ids
+        ]
+
+    @staticmethod
+    def _json_value(value: Any) -> Any:
+        """
+        Значение ячейки датасета в виде, сериализуемом в JSON: скаляры numpy
+        приводятся к типам Python, пропуски (NaN, None) — к None
+        
+        
+        value (Any): Значение ячейки
+            
+        Returns:
+            Any: Значение для ответа API
+        """
+        if value is None or (np.isscalar(value) and pd.isna(value)):
+            return None
+        return value.item() if isinstance(value, np.generic) else value
+
+    @reads("_index_lock")
     def save_model(self, model_path: str) -> None:
         """
-        Сохранение модели в файл
+        Сохранение модели: каталог с манифестом (см. _save_bundle) или,
+        для путей с расширением .pkl, прежний файл pickle
         
         
         model_path (str): Путь для сохранения модели
         """
+        if model_path.endswith(self.LEGACY_MODEL_SUFFIX):
+            self._save_pickle(model_path)
+        else:
+            self._save_bundle(model_path)
+        print(f"Модель сохранена в {model_path}")
+
+    def _save_bundle(self, path: str) -> None:
+        """
+        Сохранение модели в каталог: метаданные документов — в parquet, эмбеддинги,
+        постинги BM25 и признаки документов — массивами .npy (загружаются через mmap),
+        словари — компактными текстовыми и JSON-файлами. Манифест хранит версию
+        формата и модели и контрольные суммы файлов.
+        
+        
+        path (str): Путь к каталогу модели
+        """
+        with BundleWriter(
+            path,
+            model_version=self.model_version,
+            num_docs=len(self.dataset),
+            dataset_path=self.dataset_path,
+            use_bert=self.use_bert,
+            use_llm=self.use_llm,
+            use_cross_encoder=self.use_cross_encoder,
+        ) as writer:
+            self.dataset.to_parquet(writer.file("documents.parquet"))
+            if self._tombstone_mask() is not None:
+                # Удаленные статьи, еще не убранные уплотнением (см. delete_documents)
+                np.save(writer.file("tombstones.npy"), self.tombstones)
+            if self.bm25 is not None:
+                self.bm25.save(writer.file("bm25"))
+            if self.bert_embeddings is not None:
+                self.bert_embeddings.save(writer.file("embeddings"))
+            if self.dense_index is not None:
+                self.dense_index.save(writer.file("dense"))
+            if self.segment_index is not None:
+                self.segment_index.save(writer.file("segments"))
+            if self.doc_label_codes is not None:
+                self._save_document_features(writer)
+            self._save_text_processor(writer)
+
+    def _save_document_features(self, writer: BundleWriter) -> None:
+        """
+        Сохранение признаков документов (см. _build_document_features) в каталог модели
+        
+        
+        writer (BundleWriter): Записываемый каталог модели
+        """
+        for label, codes in self.doc_label_codes.items():
+            np.save(writer.file(f"features/label_codes/{label}.npy"), np.ascontiguousarray(codes))
+        np.save(writer.file("features/title_lemmas_data.npy"), self.title_lemma_matrix.data)
+        np.save(writer.file("features/title_lemmas_indices.npy"), self.title_lemma_matrix.indices)
+        np.save(writer.file("features/title_lemmas_indptr.npy"), self.title_lemma_matrix.indptr)
+        np.save(writer.file("features/body_lemma_presence.npy"), np.ascontiguousarray(self.body_lemma_presence))
+        # Словари значений меток и лемм хранятся списками в порядке кодов
+        writer.write_json("features/vocabularies.json", {
+            "labels": {
+                label: sorted(vocabulary, key=vocabulary.get)
+                for label, vocabulary in self.label_vocabularies.items()
+            },
+            "title_lemmas": sorted(self.title_lemma_vocabulary, key=self.title_lemma_vocabulary.get),
+            "pricelist_lemma": self.pricelist_lemma,
+            "update_synonyms_lemmas": self.update_synonyms_lemmas,
+        })
+
+    def _save_text_processor(self, writer: BundleWriter) -> None:
+        """
+        Сохранение словарей TextProcessor, построенных при обучении; морфологический
+        анализатор и модели spaCy не сохраняются и загружаются заново
+        
+        
+        writer (BundleWriter): Записываемый каталог модели
+        """
+        processor = self.text_processor
+        writer.write_lines("text_processor/vocabulary.txt", sorted(processor.vocabulary))
+        writer.write_json("text_processor/vocabularies.json", {
+            "bigrams": sorted(processor.ngram_vocabulary.get('bigrams', ())),
+            "trigrams": sorted(processor.ngram_vocabulary.get('trigrams', ())),
+            "abbreviations": processor.abbreviations,
+            "full_forms": processor.full_forms,
+        })
+        if processor.dictionary_created:
+            writer.write_lines(
+                "text_processor/symspell_dictionary.txt",
+                (f"{word} {count}" for word, count in processor.sym_spell.words.items())
+            )
+
+    def _save_pickle(self, model_path: str) -> None:
+        """
+        Сохранение модели в файл pickle (прежний формат)
+        
+        
+        model_path (str): Путь к файлу модели
+        """
         # Временно отключаем BERT модель и LLM для сериализации
         bert_model_tmp = None
         llm_tmp = None
@@ -1442,9 +2490,39 @@ class Model:
             cross_encoder_tmp = self.cross_encoder
             self.cross_encoder = None
         
+        # Сервис пакетирования (фоновый поток) и кэши не сериализуются и создаются заново при первом запросе
+        query_encoder_tmp = getattr(self, 'query_encoder', None)
+        self.query_encoder = None
+        query_cache_tmp = getattr(self, 'query_cache', None)
+        self.query_cache = None
+        answer_cache_tmp = getattr(self, 'answer_cache', None)
+        self.answer_cache = None
+        reasoning_jobs_tmp = getattr(self, 'reasoning_jobs', None)
+        self.reasoning_jobs = None
+        
+        # Индекс BM25 сохраняется отдельно в виде массивов, чтобы загружать его через mmap
+        bm25_tmp = self.bm25
+        if bm25_tmp is not None:
+            bm25_tmp.save(self._bm25_index_path(model_path))
+            self.bm25 = None
+        
+        # Индекс плотного поиска сохраняется в собственном формате FAISS
+        dense_index_tmp = self.dense_index
+        if dense_index_tmp is not None:
+            self.save_dense_index(self._dense_index_path(model_path))
+            self.dense_index = None
+        
         # Сохранение модели
-        with open(model_path, 'wb') as f:
-            pickle.dump(self, f)
+        try:
+            with open(model_path, 'wb') as f:
+                pickle.dump(self, f)
+        finally:
+            self.bm25 = bm25_tmp
+            self.dense_index = dense_index_tmp
+            self.query_encoder = query_encoder_tmp
+            self.query_cache = query_cache_tmp
+            self.answer_cache = answer_cache_tmp
+            self.reasoning_jobs = reasoning_jobs_tmp
         
         # Восстановление BERT модели и LLM
         if bert_model_tmp is not None:
@@ -1455,24 +2533,273 @@ class Model:
         
         if cross_encoder_tmp is not None:
             self.cross_encoder = cross_encoder_tmp
+
+    def build_dense_index(self, method: str = "hnsw", search_effort: Optional[int] = None) -> None:
+        """
+        Построение индекса плотного поиска по эмбеддингам документов
         
-        print(f"Модель сохранена в {model_path}")
+        
+        method (str): Тип индекса: "hnsw", "ivf" или "flat"
+        search_effort (Optional[int]): efSearch / nprobe (по умолчанию DENSE_SEARCH_EFFORT)
+        """
+        if self.bert_embeddings is None:
+            print("Предупреждение: Эмбеддинги не созданы, индекс плотного поиска не построен.")
+            return
+        self.dense_index = DenseIndex(
+            method=method,
+            search_effort=search_effort or self.DENSE_SEARCH_EFFORT
+        ).build(self.bert_embeddings.dense())
+        print(f"Индекс плотного поиска ({method}) построен: {self.dense_index.size} документов")
+
+    def save_dense_index(self, path: str) -> None:
+        """
+        Сохранение индекса плотного поиска
+        
+        
+        path (str): Путь к каталогу индекса
+        """
+        if self.dense_index is not None:
+            self.dense_index.save(path)
+
+    def load_dense_index(self, path: str, search_effort: Optional[int] = None) -> None:
+        """
+        Загрузка индекса плотного поиска
+        
+        
+        path (str): Путь к каталогу индекса
+        search_effort (Optional[int]): Переопределение efSearch / nprobe
+        """
+        self.dense_index = DenseIndex.load(path, search_effort=search_effort)
 
     @staticmethod
-    def load_model(model_path: str) -> 'Model':
+    def _dense_index_path(model_path: str) -> str:
         """
-        Загрузка модели из файла
+        Путь к каталогу индекса плотного поиска для файла модели
         
         
-        model_path (str): Путь к файлу с моделью
+        model_path (str): Путь к файлу модели
             
         Returns:
-            Model: Загруженная модель
+            str: Путь к каталогу индекса
+        """
+        return f"{model_path}.dense"
+
+    @staticmethod
+    def _bm25_index_path(model_path: str) -> str:
+        """
+        Путь к каталогу индекса BM25 для файла модели
+        
+        
+        model_path (str): Путь к файлу модели
+            
+        Returns:
+            str: Путь к каталогу индекса
+        """
+        return f"{model_path}.bm25"
+
+    @staticmethod
+    def _load_bundle(path: str) -> 'Model':
+        """
+        Загрузка модели из каталога (см. _save_bundle). Массивы эмбеддингов,
+        постингов BM25 и признаков документов отображаются в память: загрузка
+        не читает их целиком, а процессы пула разделяют одни и те же страницы.
+        
+        
+        path (str): Путь к каталогу модели
+            
+        Returns:
+            Model: Модель без BERT, LLM и CrossEncoder (их загружает load_model)
+        """
+        manifest = read_manifest(path)
+        
+        # Объект создается без __init__, как и при распаковке pickle
+        model = Model.__new__(Model)
+        model._init_locks()
+        model.dataset_path = manifest.get("dataset_path")
+        model.version = manifest["model_version"]
+        model.use_bert = manifest["use_bert"]
+        model.use_llm = manifest["use_llm"]
+        model.use_cross_encoder = manifest["use_cross_encoder"]
+        model.bert_model = None
+        model.cross_encoder = None
+        model.llm = None
+        model.query_encoder = None
+        model.query_cache = None
+        model.answer_cache = None
+        model.reasoning_jobs = None
+        model.tfidf_matrix = None
+        model.lsa_matrix = None
+        
+        model.dataset = pd.read_parquet(os.path.join(path, "documents.parquet"))
+        tombstones_path = os.path.join(path, "tombstones.npy")
+        model.tombstones = np.load(tombstones_path) if os.path.isfile(tombstones_path) else None
+        # Метки документов хранятся столбцами датасета (см. _classify_documents)
+        model.document_categories = Model._labels_by_doc(model.dataset, 'query_type')
+        model.document_roles = Model._labels_by_doc(model.dataset, 'user_role')
+        model.document_topics = Model._labels_by_doc(model.dataset, 'component')
+        
+        bm25_path = os.path.join(path, "bm25")
+        model.bm25 = BM25Index.load(bm25_path, mmap=True) if os.path.isdir(bm25_path) else None
+        
+        embeddings_path = os.path.join(path, "embeddings")
+        model.bert_embeddings = EmbeddingMatrix.load(embeddings_path, mmap=True) if os.path.isdir(embeddings_path) else None
+        
+        dense_path = os.path.join(path, "dense")
+        model.dense_index = None
+        if os.path.isdir(dense_path):
+            model.load_dense_index(dense_path)
+        elif model.bert_embeddings is not None:
+            model.build_dense_index()
+        
+        segments_path = os.path.join(path, "segments")
+        model.segment_index = SegmentIndex.load(segments_path, mmap=True) if os.path.isdir(segments_path) else None
+        
+        model._load_document_features(path)
+        model.text_processor = Model._load_text_processor(path)
+        return model
+
+    @staticmethod
+    def _labels_by_doc(dataset: pd.DataFrame, column: str) -> Dict[Any, Any]:
+        """
+        Метки документов по индексу датасета
+        
+        
+        dataset (pd.DataFrame): Датасет базы знаний
+        column (str): Столбец метки
+            
+        Returns:
+            Dict[Any, Any]: Индекс документа -> метка (пусто, если модель не обучена)
+        """
+        if column not in dataset.columns:
+            return {}
+        values = dataset[column].astype(object).where(dataset[column].notna(), None)
+        return dict(zip(dataset.index, values))
+
+    def _load_document_features(self, path: str) -> None:
+        """
+        Загрузка признаков документов из каталога модели
+        
+        
+        path (str): Путь к каталогу модели
+        """
+        self.label_vocabularies = {}
+        self.doc_label_codes = None
+        self.title_lemma_vocabulary = {}
+        self.title_lemma_matrix = None
+        self.body_lemma_presence = None
+        features_path = os.path.join(path, "features")
+        if not os.path.isdir(features_path):
+            return
+        
+        vocabularies = read_json(path, "features/vocabularies.json")
+        self.label_vocabularies = {
+            label: {value: code for code, value in enumerate(values)}
+            for label, values in vocabularies["labels"].items()
+        }
+        self.doc_label_codes = {
+            label: np.load(os.path.join(features_path, "label_codes", f"{label}.npy"), mmap_mode="r")
+            for label in self.label_vocabularies
+        }
+        self.title_lemma_vocabulary = {lemma: i for i, lemma in enumerate(vocabularies["title_lemmas"])}
+        self.title_lemma_matrix = sparse.csr_matrix(
+            tuple(
+                np.load(os.path.join(features_path, f"title_lemmas_{name}.npy"), mmap_mode="r")
+                for name in ("data", "indices", "indptr")
+            ),
+            shape=(len(self.dataset), len(self.title_lemma_vocabulary)), copy=False
+        )
+        self.body_lemma_presence = np.load(os.path.join(features_path, "body_lemma_presence.npy"), mmap_mode="r")
+        self.pricelist_lemma = vocabularies["pricelist_lemma"]
+        self.update_synonyms_lemmas = vocabularies["update_synonyms_lemmas"]
+
+    @staticmethod
+    def _load_text_processor(path: str) -> 'utils.TextProcessor':
+        """
+        Создание TextProcessor со словарями, сохраненными в каталоге модели
+        
+        
+        path (str): Путь к каталогу модели
+            
+        Returns:
+            utils.TextProcessor: Обработчик текста
+        """
+        processor = utils.TextProcessor()
+        processor.vocabulary = set(read_lines(path, "text_processor/vocabulary.txt"))
+        vocabularies = read_json(path, "text_processor/vocabularies.json")
+        processor.ngram_vocabulary = {
+            'bigrams': set(vocabularies["bigrams"]),
+            'trigrams': set(vocabularies["trigrams"]),
+        }
+        processor.abbreviations = vocabularies["abbreviations"]
+        processor.full_forms = vocabularies["full_forms"]
+        
+        dictionary_path = os.path.join(path, "text_processor", "symspell_dictionary.txt")
+        if os.path.isfile(dictionary_path):
+            processor.dictionary_created = processor.sym_spell.load_dictionary(
+                dictionary_path, encoding='utf-8', term_index=0, count_index=1
+            )
+        return processor
+
+    @staticmethod
+    def _load_pickle(model_path: str) -> 'Model':
+        """
+        Загрузка модели из файла pickle (прежний формат)
+        
+        
+        model_path (str): Путь к файлу модели
+            
+        Returns:
+            Model: Модель без BERT, LLM и CrossEncoder (их загружает load_model)
         """
-        # Загрузка модели
         with open(model_path, 'rb') as f:
             model = pickle.load(f)
         
+        # Загрузка индекса BM25 (массивы отображаются в память, а не читаются целиком)
+        bm25_path = Model._bm25_index_path(model_path)
+        if os.path.isdir(bm25_path):
+            model.bm25 = BM25Index.load(bm25_path, mmap=True)
+        elif model.bm25 is not None and not isinstance(model.bm25, BM25Index):
+            # Модели, сохраненные с rank_bm25.BM25Okapi, переводятся на новый индекс
+            model.bm25 = BM25Index.from_okapi(model.bm25, model.bm25_indices, len(model.dataset))
+        
+        # Эмбеддинги старых моделей хранились ненормализованным массивом numpy
+        if isinstance(getattr(model, 'bert_embeddings', None), np.ndarray):
+            model.bert_embeddings = EmbeddingMatrix.from_embeddings(model.bert_embeddings, dtype=Model.EMBEDDINGS_DTYPE)
+        
+        # Загрузка индекса плотного поиска; для старых моделей он строится по сохраненным эмбеддингам
+        dense_path = Model._dense_index_path(model_path)
+        if os.path.isdir(dense_path):
+            model.load_dense_index(dense_path)
+        elif getattr(model, 'bert_embeddings', None) is not None:
+            model.build_dense_index()
+        else:
+            model.dense_index = None
+        return model
+
+    @staticmethod
+    def load_model(model_path: str, shared: Optional['Model'] = None) -> 'Model':
+        """
+        Загрузка модели из каталога с манифестом или из файла pickle (прежний формат)
+        
+        
+        model_path (str): Путь к каталогу или файлу с моделью
+        shared (Optional[Model]): Работающая модель, чьи SentenceTransformer, CrossEncoder и LLM
+            используются вместо повторной загрузки (см. _share_runtime)
+            
+        Returns:
+            Model: Загруженная модель
+        """
+        if is_bundle(model_path):
+            model = Model._load_bundle(model_path)
+        else:
+            model = Model._load_pickle(model_path)
+        
+        if shared is not None:
+            # LLM, как и при обычной загрузке, используется независимо от флага в файле
+            model.use_llm = True
+            model._share_runtime(shared)
+            return model
+        
         # Если нужно, восстанавливаем BERT модель
         if model.use_bert:
             try:
@@ -1491,8 +2818,9 @@ class Model:
             if not hasattr(model, 'llm'):
                  model.llm = None
             
-            # Пытаемся загрузить pipeline
-            model.llm = pipeline("text-generation", model="microsoft/Phi-3-mini-4k-instruct", trust_remote_code=True)
+            # Пытаемся загрузить LLM в среде выполнения из настроек (NEYRO_LLM_BACKEND)
+            model.llm = create_llm_backend()
+            model._register_prompt_prefixes()
             print("LLM модель успешно загружена (принудительная попытка в load_model)")
             # Устанавливаем флаг в True, так как загрузка удалась
             model.use_llm = True 
@@ -1519,7 +2847,7 @@ class Model:
 if __name__ == "__main__":
     retrain = False
     query = """  Какие шаги необходимо выполнить для создания коммерческого предложения через портал поставщиков? """
-    model_path = "model.pkl"
+    model_path = "model.bundle"
     dataset_path = "docs/dataset.parquet"
     top_n = 10
     
@@ -1561,7 +2889,7 @@ if __name__ == "__main__":
         print(f"Режим переранжирования: {'CrossEncoder' if model.use_cross_encoder else 'BiEncoder + BM25'}")
         
         # Анализ запроса
-        query_analysis = model.text_processor.classify_query(query)
+        query_analysis = model.classify_query(query)
         print(f"Анализ запроса:")
         print(f"  Тип запроса: {query_analysis['query_type']}")
         print(f"  Роль пользователя: {query_analysis['user_role']}")
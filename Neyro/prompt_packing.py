@@ -0,0 +1,102 @@
+"""
+Модуль упаковки фрагментов в промпт LLM с ограничением по количеству токенов
+"""
+
+# Импорт типов для аннотаций
+from typing import Any, Callable, Dict, List, Tuple  # Для типизации кода
+
+from nltk.tokenize import sent_tokenize  # Для разбиения фрагментов на предложения
+
+MIN_TRIMMED_WORDS = 20  # Фрагмент, от которого после удаления повторов осталось меньше слов, не добавляется
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Грубая оценка количества токенов, когда токенизатор LLM недоступен
+    (для русского текста у Phi-3 — около трех символов на токен)
+
+    Args:
+        text (str): Текст
+
+    Returns:
+        int: Оценка количества токенов
+    """
+    return len(text) // 3 + 1
+
+
+def deduplicate_fragments(fragments: List[Dict[str, Any]],
+                          split_sentences: Callable[[str], List[str]] = sent_tokenize) -> List[Tuple[Dict[str, Any], str]]:
+    """
+    Удаление предложений, повторяющихся в соседних сегментах одной статьи
+    (сегменты нарезаются с перекрытием в 50 слов). Предложение остается в более
+    релевантном фрагменте; фрагменты, от которых почти ничего не осталось, отбрасываются.
+
+    Args:
+        fragments (List[Dict[str, Any]]): Фрагменты по убыванию релевантности
+        split_sentences (Callable[[str], List[str]]): Разбиение текста на предложения
+
+    Returns:
+        List[Tuple[Dict[str, Any], str]]: Фрагмент и его текст без повторов, в исходном порядке
+    """
+    seen_sentences: Dict[Any, set] = {}
+    result = []
+    for fragment in fragments:
+        doc_sentences = seen_sentences.setdefault(fragment['doc_id'], set())
+        sentences = split_sentences(fragment['fragment'])
+        new_sentences = [sentence for sentence in sentences if sentence not in doc_sentences]
+        doc_sentences.update(sentences)
+        if not new_sentences:
+            continue
+        if len(new_sentences) < len(sentences) and len(" ".join(new_sentences).split()) < MIN_TRIMMED_WORDS:
+            continue
+        result.append((fragment, " ".join(new_sentences)))
+    return result
+
+
+def pack_fragments(fragments: List[Dict[str, Any]], render_block: Callable[[int, Dict[str, Any], str], str],
+                   count_tokens: Callable[[str], int], budget: int,
+                   split_sentences: Callable[[str], List[str]] = sent_tokenize) -> List[str]:
+    """
+    Выбор фрагментов для промпта в пределах бюджета токенов.
+
+    После удаления повторов фрагменты отбираются жадно по релевантности на токен:
+    фрагмент, который не помещается в остаток бюджета, пропускается, а более
+    короткие продолжают рассматриваться. Отобранные блоки возвращаются в порядке
+    убывания релевантности. Если не помещается ни один фрагмент, самый
+    релевантный обрезается по предложениям.
+
+    Args:
+        fragments (List[Dict[str, Any]]): Фрагменты по убыванию релевантности
+        render_block (Callable[[int, Dict[str, Any], str], str]): Текст блока промпта по номеру, фрагменту и его тексту
+        count_tokens (Callable[[str], int]): Подсчет токенов токенизатором LLM
+        budget (int): Бюджет токенов для всех блоков
+        split_sentences (Callable[[str], List[str]]): Разбиение текста на предложения
+
+    Returns:
+        List[str]: Блоки промпта, пронумерованные по порядку
+    """
+    candidates = []
+    for position, (fragment, text) in enumerate(deduplicate_fragments(fragments, split_sentences)):
+        tokens = max(1, count_tokens(render_block(position + 1, fragment, text)))
+        candidates.append((position, fragment, text, tokens))
+
+    remaining = budget
+    selected = []
+    for position, fragment, text, tokens in sorted(
+            candidates, key=lambda item: item[1].get('relevance', 0.0) / item[3], reverse=True):
+        if tokens <= remaining:
+            selected.append((position, fragment, text))
+            remaining -= tokens
+
+    if not selected and candidates:
+        # Ни один фрагмент не помещается целиком: самый релевантный обрезается по предложениям
+        _, fragment, text, _ = candidates[0]
+        kept = []
+        for sentence in split_sentences(text):
+            if kept and count_tokens(render_block(1, fragment, " ".join(kept + [sentence]))) > budget:
+                break
+            kept.append(sentence)
+        selected.append((0, fragment, " ".join(kept)))
+
+    selected.sort(key=lambda item: item[0])
+    return [render_block(number, fragment, text) for number, (_, fragment, text) in enumerate(selected, 1)]
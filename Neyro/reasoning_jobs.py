@@ -0,0 +1,148 @@
+"""
+Модуль отложенной генерации объяснений (reasoning): фоновые задачи с получением результата по идентификатору
+"""
+
+# Импорт стандартных библиотек
+import concurrent.futures  # Пул потоков генерации объяснений
+import contextvars  # Перенос контекста (трассировки) в поток пула
+import os  # Для чтения переменных окружения
+import threading  # Блокировка реестра задач
+import uuid  # Идентификаторы фоновых задач
+
+# Импорт типов для аннотаций
+from typing import Any, Callable, Dict, Optional  # Для типизации кода
+
+from cache import TTLCache  # Хранение готовых объяснений с ограничением размера и времени жизни
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+# Режимы генерации объяснения
+REASONING_MODES = ("sync", "skip", "background", "parallel")
+
+# Параметры генерации объяснений (переменные окружения)
+REASONING_MODE = os.getenv("NEYRO_REASONING_MODE", "sync")  # Режим по умолчанию, если запрос его не задает
+REASONING_WORKERS = int(os.getenv("NEYRO_REASONING_WORKERS", "1"))  # Потоков генерации объяснений
+REASONING_RESULTS_SIZE = int(os.getenv("NEYRO_REASONING_RESULTS_SIZE", "1024"))  # Максимум хранимых объяснений
+REASONING_RESULTS_TTL = float(os.getenv("NEYRO_REASONING_RESULTS_TTL", "3600"))  # Время хранения объяснения, сек
+
+
+def resolve_reasoning_mode(mode: Optional[str]) -> str:
+    """
+    Проверка режима генерации объяснения
+
+    Args:
+        mode (Optional[str]): Режим из запроса (None — режим по умолчанию)
+
+    Returns:
+        str: Один из REASONING_MODES
+
+    Raises:
+        ValueError: Неизвестный режим
+    """
+    mode = (mode or REASONING_MODE).strip().lower()
+    if mode not in REASONING_MODES:
+        raise ValueError(f"Неизвестный режим объяснения: {mode} (допустимо: {', '.join(REASONING_MODES)})")
+    return mode
+
+
+class ReasoningJobs:
+    """
+    Пул генерации объяснений, отдельный от пула ответов.
+
+    В режиме "parallel" объяснение генерируется одновременно с ответом и
+    дожидается вызывающий код (submit возвращает Future). В режиме "background"
+    задача регистрируется под идентификатором, а результат сохраняется в
+    ограниченном хранилище и забирается позже через get().
+    """
+
+    def __init__(self, workers: int = REASONING_WORKERS, max_results: int = REASONING_RESULTS_SIZE,
+                 ttl: float = REASONING_RESULTS_TTL):
+        """
+        Args:
+            workers (int): Количество потоков генерации
+            max_results (int): Максимум хранимых готовых объяснений
+            ttl (float): Время хранения готового объяснения, сек
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="neyro-reasoning"
+        )
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._results = TTLCache(max_size=max_results, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def submit(self, function: Callable[..., Any], *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Генерация объяснения одновременно с ответом (замеры попадают в трассировку запроса)
+
+        Args:
+            function (Callable[..., Any]): Функция генерации объяснения
+            *args: Позиционные аргументы функции
+            **kwargs: Именованные аргументы функции
+
+        Returns:
+            concurrent.futures.Future: Результат функции
+        """
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, function, *args, **kwargs)
+
+    def submit_background(self, function: Callable[..., Any], *args, **kwargs) -> str:
+        """
+        Фоновая генерация объяснения
+
+        Args:
+            function (Callable[..., Any]): Функция генерации объяснения, возвращает словарь результата
+            *args: Позиционные аргументы функции
+            **kwargs: Именованные аргументы функции
+
+        Returns:
+            str: Идентификатор задачи для get()
+        """
+        job_id = uuid.uuid4().hex
+        # Фоновая задача переживает запрос, поэтому выполняется без его трассировки
+        future = self._executor.submit(contextvars.Context().run, function, *args, **kwargs)
+        with self._lock:
+            self._pending[job_id] = future
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+        return job_id
+
+    def _finish(self, job_id: str, future: concurrent.futures.Future) -> None:
+        """Перенос завершенной задачи в хранилище результатов"""
+        try:
+            result = {"status": "done", **future.result()}
+        except Exception as e:
+            logger.error("Ошибка фоновой генерации объяснения %s: %s", job_id, e)
+            result = {"status": "error", "reasoning": None, "detail": str(e)}
+        self._results.set(job_id, result)
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Состояние фоновой задачи
+
+        Args:
+            job_id (str): Идентификатор задачи
+
+        Returns:
+            Optional[Dict[str, Any]]: {"status": "pending"}, готовый результат со статусом
+                "done" или "error", либо None, если задача неизвестна или результат устарел
+        """
+        result = self._results.get(job_id)
+        if result is not None:
+            return result
+        with self._lock:
+            if job_id in self._pending:
+                return {"status": "pending", "reasoning": None}
+        # Задача могла завершиться между проверками
+        return self._results.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Количество выполняемых задач и хранимых результатов"""
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "results": len(self._results)}
+
+    def shutdown(self) -> None:
+        """Остановка пула без ожидания незавершенных задач"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,233 @@
+"""
+Модуль реестра поколений модели: подмена модели без остановки обработки запросов
+"""
+
+# Импорт стандартных библиотек
+import os  # Для чтения переменных окружения
+import threading  # Счетчики запросов поколений и фоновая сборка
+import time  # Время активации и вывода поколений
+from contextlib import contextmanager  # Захват поколения на время запроса
+
+# Импорт типов для аннотаций
+from typing import Any, Callable, Dict, Iterator, List, Optional  # Для типизации кода
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+# Запросы прогрева нового поколения перед подменой (через ";")
+WARMUP_QUERIES = [
+    query.strip()
+    for query in os.getenv(
+        "NEYRO_WARMUP_QUERIES",
+        "Как зарегистрироваться на портале поставщиков;Ошибка при подписании контракта;Как загрузить прайслист"
+    ).split(";")
+    if query.strip()
+]
+DRAIN_TIMEOUT = float(os.getenv("NEYRO_DRAIN_TIMEOUT", "300"))  # Ожидание завершения запросов старого поколения, сек
+
+
+class ModelGeneration:
+    """Поколение модели: модель и количество обрабатываемых ею запросов"""
+
+    def __init__(self, number: int, model: Any, source: str):
+        """
+        Args:
+            number (int): Номер поколения
+            model (Any): Модель (model.Model)
+            source (str): Происхождение: load, retrain, reload и т.п.
+        """
+        self.number = number
+        self.model = model
+        self.source = source
+        self.activated_at = time.time()
+        self.retired_at = None
+        self.in_flight = 0
+
+    def describe(self) -> Dict[str, Any]:
+        """Описание поколения для эндпоинта администратора"""
+        return {
+            "generation": self.number,
+            "model_version": self.model.model_version,
+            "source": self.source,
+            "activated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.activated_at)),
+            "retired_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.retired_at))
+            if self.retired_at is not None else None,
+            "in_flight": self.in_flight,
+        }
+
+
+class ModelRegistry:
+    """
+    Реестр поколений модели.
+
+    Запрос захватывает активное поколение (acquire) и работает с ним до конца,
+    даже если за это время активным стало другое. Новое поколение собирается
+    в фоне (start_build), прогревается запросами из WARMUP_QUERIES и становится
+    активным одной заменой ссылки (publish). Прежнее поколение выводится:
+    ссылка на него освобождается, когда завершатся начатые на нем запросы
+    (но не позже DRAIN_TIMEOUT).
+    """
+
+    def __init__(self, warmup_queries: Optional[List[str]] = None, drain_timeout: float = DRAIN_TIMEOUT):
+        """
+        Args:
+            warmup_queries (Optional[List[str]]): Запросы прогрева (по умолчанию NEYRO_WARMUP_QUERIES)
+            drain_timeout (float): Ожидание завершения запросов выводимого поколения, сек
+        """
+        self.warmup_queries = WARMUP_QUERIES if warmup_queries is None else warmup_queries
+        self.drain_timeout = drain_timeout
+        self._active: Optional[ModelGeneration] = None
+        self._draining: List[ModelGeneration] = []
+        self._condition = threading.Condition()
+        self._generations = 0
+        self._build_thread: Optional[threading.Thread] = None
+        self._build_state: Dict[str, Any] = {"status": "idle"}
+
+    @property
+    def active_model(self) -> Any:
+        """Модель активного поколения (None, если модель еще не опубликована)"""
+        generation = self._active
+        return generation.model if generation is not None else None
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        """
+        Захват активного поколения на время запроса
+
+        Yields:
+            Any: Модель поколения
+
+        Raises:
+            RuntimeError: Модель еще не опубликована
+        """
+        with self._condition:
+            generation = self._active
+            if generation is None:
+                raise RuntimeError("Модель не инициализирована")
+            generation.in_flight += 1
+        try:
+            yield generation.model
+        finally:
+            with self._condition:
+                generation.in_flight -= 1
+                if not generation.in_flight:
+                    self._condition.notify_all()
+
+    def warm_up(self, model: Any) -> None:
+        """
+        Прогрев модели перед подменой: кодирование запросов, чтение страниц
+        отображенных в память индексов и заполнение кэша запросов нового поколения
+
+        Args:
+            model (Any): Модель нового поколения
+        """
+        started = time.perf_counter()
+        for query in self.warmup_queries:
+            try:
+                model.extract_relevant_fragments(query)
+            except Exception as e:
+                logger.warning("Ошибка прогрева модели запросом '%s': %s", query, e)
+        logger.info("Модель прогрета %d запросами за %.2f с", len(self.warmup_queries), time.perf_counter() - started)
+
+    def publish(self, model: Any, source: str) -> ModelGeneration:
+        """
+        Подмена активного поколения
+
+        Args:
+            model (Any): Модель нового поколения (уже прогретая, если нужно)
+            source (str): Происхождение поколения
+
+        Returns:
+            ModelGeneration: Новое активное поколение
+        """
+        with self._condition:
+            self._generations += 1
+            generation = ModelGeneration(self._generations, model, source)
+            previous, self._active = self._active, generation
+            if previous is not None:
+                previous.retired_at = time.time()
+                self._draining.append(previous)
+        logger.info("Активно поколение модели %d (%s, версия %s)", generation.number, source, model.model_version)
+        if previous is not None:
+            threading.Thread(
+                target=self._drain, args=(previous,), name=f"neyro-drain-{previous.number}", daemon=True
+            ).start()
+        return generation
+
+    def _drain(self, generation: ModelGeneration) -> None:
+        """Ожидание завершения запросов выводимого поколения и освобождение ссылки на него"""
+        deadline = time.monotonic() + self.drain_timeout
+        with self._condition:
+            while generation.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Поколение модели %d выведено с незавершенными запросами: %d",
+                                   generation.number, generation.in_flight)
+                    break
+                self._condition.wait(remaining)
+            self._draining.remove(generation)
+            active_model = self.active_model
+
+        # Сервис кодирования запросов останавливается, если новое поколение не использует его совместно
+        encoder = getattr(generation.model, 'query_encoder', None)
+        if encoder is not None and encoder is not getattr(active_model, 'query_encoder', None):
+            encoder.close()
+        logger.info("Поколение модели %d выведено", generation.number)
+
+    def start_build(self, source: str, build: Callable[[], None]) -> bool:
+        """
+        Фоновая сборка следующего поколения (одновременно выполняется только одна)
+
+        Args:
+            source (str): Происхождение поколения (для статуса)
+            build (Callable[[], None]): Сборка, прогрев и публикация поколения
+
+        Returns:
+            bool: Сборка запущена (False — уже выполняется другая)
+        """
+        with self._condition:
+            if self._build_thread is not None and self._build_thread.is_alive():
+                return False
+            self._build_state = {"status": "building", "source": source, "started_at": time.time()}
+            self._build_thread = threading.Thread(
+                target=self._run_build, args=(build,), name="neyro-model-build", daemon=True
+            )
+            self._build_thread.start()
+        return True
+
+    def _run_build(self, build: Callable[[], None]) -> None:
+        started_at = self._build_state["started_at"]
+        try:
+            build()
+            state = {"status": "done"}
+        except Exception as e:
+            logger.error("Ошибка сборки поколения модели: %s", e)
+            state = {"status": "failed", "error": str(e)}
+        with self._condition:
+            self._build_state = {
+                **self._build_state, **state, "duration_s": round(time.time() - started_at, 1)
+            }
+
+    @property
+    def building(self) -> bool:
+        """Выполняется ли фоновая сборка поколения"""
+        thread = self._build_thread
+        return thread is not None and thread.is_alive()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Состояние реестра для эндпоинта администратора
+
+        Returns:
+            Dict[str, Any]: Активное и выводимые поколения, состояние фоновой сборки
+        """
+        with self._condition:
+            active = self._active
+            draining = list(self._draining)
+            build_state = dict(self._build_state)
+        return {
+            "active": active.describe() if active is not None else None,
+            "draining": [generation.describe() for generation in draining],
+            "build": build_state,
+        }
@@ -0,0 +1,254 @@
+"""
+Модуль с таблицей сегментов статей базы знаний для извлечения релевантных фрагментов
+"""
+
+# Импорт библиотек для работы с данными и математических операций
+import json  # Для хранения сущностей сегментов
+import os  # Для работы с файловой системой
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+import pandas as pd  # Библиотека для обработки и анализа структурированных данных
+from nltk.tokenize import sent_tokenize, word_tokenize  # Для разбиения текста на предложения и слова
+
+# Импорт типов для аннотаций
+from typing import List, Optional, Tuple  # Для типизации кода
+
+from embeddings import EmbeddingMatrix  # Нормализованные эмбеддинги со скалярным произведением
+
+
+def split_text_into_segments(text: str, segment_size: int = 150, overlap: int = 50) -> List[str]:
+    """
+    Разбиение текста на перекрывающиеся сегменты
+
+    Args:
+        text (str): Текст для разбиения
+        segment_size (int): Размер сегмента в словах
+        overlap (int): Размер перекрытия между сегментами в словах
+
+    Returns:
+        List[str]: Список сегментов текста
+    """
+    if not text or pd.isna(text):
+        return []
+        
+    # Разбиваем текст на предложения
+    sentences = sent_tokenize(text)
+    segments = []
+    
+    # Если текст короткий, возвращаем его целиком
+    if len(sentences) <= 3:
+        return [text]
+        
+    # Разбиваем текст на сегменты с перекрытием
+    current_segment = []
+    current_word_count = 0
+    
+    for sentence in sentences:
+        words = word_tokenize(sentence)
+        current_segment.append(sentence)
+        current_word_count += len(words)
+        
+        # Если достигнут размер сегмента, сохраняем его
+        if current_word_count >= segment_size:
+            segments.append(' '.join(current_segment))
+            
+            # Оставляем последние слова для перекрытия
+            overlap_sentences = []
+            overlap_word_count = 0
+            
+            # Идем с конца и собираем предложения до достижения нужного перекрытия
+            for sent in reversed(current_segment):
+                sent_words = word_tokenize(sent)
+                if overlap_word_count + len(sent_words) <= overlap:
+                    overlap_sentences.insert(0, sent)
+                    overlap_word_count += len(sent_words)
+                else:
+                    break
+            
+            # Начинаем новый сегмент с предложений перекрытия
+            current_segment = overlap_sentences
+            current_word_count = overlap_word_count
+    
+    # Добавляем последний сегмент, если он не пустой
+    if current_segment:
+        segments.append(' '.join(current_segment))
+        
+    return segments
+
+
+class SegmentIndex:
+    """
+    Таблица сегментов статей, рассчитанная один раз при обучении модели.
+
+    Для каждого документа (позиции в датасете) хранятся его сегменты, их длины
+    в словах, именованные сущности spaCy и нормализованные эмбеддинги.
+    Сегменты документа занимают непрерывный диапазон строк
+    [doc_offsets[doc], doc_offsets[doc + 1]).
+    """
+    MIN_SEGMENT_WORDS = 20  # Более короткие сегменты не участвуют в выдаче фрагментов
+
+    # Имена файлов таблицы на диске
+    TABLE_FILE = "segments.parquet"
+    OFFSETS_FILE = "doc_offsets.npy"
+    EMBEDDINGS_DIR = "embeddings"
+
+    def __init__(self):
+        self.texts: List[str] = []  # Тексты сегментов
+        self.word_counts = np.zeros(0, dtype=np.int32)  # Количество слов в сегменте
+        self.entities: List[List[Tuple[str, str]]] = []  # Сущности spaCy каждого сегмента
+        self.doc_offsets = np.zeros(1, dtype=np.int64)  # Границы диапазонов сегментов по документам
+        self.embeddings: Optional[EmbeddingMatrix] = None  # Эмбеддинги сегментов
+
+    @staticmethod
+    def article_text(title: str, description) -> str:
+        """
+        Текст статьи, который разбивается на сегменты
+
+        Args:
+            title (str): Заголовок статьи
+            description: Описание статьи (может быть NaN)
+
+        Returns:
+            str: Заголовок и описание одной строкой
+        """
+        description = description if not pd.isna(description) else ""
+        return f"{title}. {description}"
+
+    @classmethod
+    def from_documents(cls, doc_segments: List[List[Tuple[str, int, List[Tuple[str, str]]]]],
+                       embeddings: Optional[EmbeddingMatrix] = None) -> 'SegmentIndex':
+        """
+        Сборка таблицы из сегментов, рассчитанных по документам отдельно
+        (например, в процессах пула обучения)
+
+        Args:
+            doc_segments (List[List[Tuple[str, int, List[Tuple[str, str]]]]]): Для каждого документа
+                его сегменты: текст, количество слов и сущности spaCy
+            embeddings (Optional[EmbeddingMatrix]): Эмбеддинги всех сегментов в том же порядке
+
+        Returns:
+            SegmentIndex: Собранная таблица
+        """
+        index = cls()
+        offsets = [0]
+        word_counts = []
+        for segments in doc_segments:
+            for text, word_count, entities in segments:
+                index.texts.append(text)
+                word_counts.append(word_count)
+                index.entities.append([tuple(entity) for entity in entities])
+            offsets.append(len(index.texts))
+        index.word_counts = np.asarray(word_counts, dtype=np.int32)
+        index.doc_offsets = np.asarray(offsets, dtype=np.int64)
+        index.embeddings = embeddings
+        return index
+
+    def appended(self, doc_segments: List[List[Tuple[str, int, List[Tuple[str, str]]]]],
+                 embeddings: Optional[EmbeddingMatrix] = None) -> 'SegmentIndex':
+        """
+        Новая таблица с сегментами добавленных документов после существующих
+
+        Args:
+            doc_segments (List[List[Tuple[str, int, List[Tuple[str, str]]]]]): Сегменты добавляемых
+                документов (см. from_documents)
+            embeddings (Optional[EmbeddingMatrix]): Эмбеддинги добавляемых сегментов
+
+        Returns:
+            SegmentIndex: Новая таблица (эта не изменяется и может использоваться запросами)
+        """
+        added = SegmentIndex.from_documents(doc_segments, embeddings)
+        index = SegmentIndex()
+        index.texts = self.texts + added.texts
+        index.word_counts = np.concatenate([self.word_counts, added.word_counts]).astype(np.int32)
+        index.entities = self.entities + added.entities
+        index.doc_offsets = np.concatenate([self.doc_offsets, added.doc_offsets[1:] + self.doc_offsets[-1]])
+        if not added.texts:
+            index.embeddings = self.embeddings
+        elif not self.texts:
+            index.embeddings = added.embeddings
+        elif self.embeddings is not None and added.embeddings is not None:
+            index.embeddings = self.embeddings.appended(added.embeddings)
+        return index
+
+    def select_documents(self, positions: List[int]) -> 'SegmentIndex':
+        """
+        Новая таблица только с сегментами указанных документов (уплотнение после удалений)
+
+        Args:
+            positions (List[int]): Позиции сохраняемых документов в новом порядке
+
+        Returns:
+            SegmentIndex: Новая таблица
+        """
+        segment_ids = [self.segment_ids(position) for position in positions]
+        counts = [len(ids) for ids in segment_ids]
+        rows = np.concatenate(segment_ids).astype(np.int64) if segment_ids else np.zeros(0, dtype=np.int64)
+        index = SegmentIndex()
+        index.texts = [self.texts[row] for row in rows]
+        index.word_counts = np.asarray(self.word_counts[rows], dtype=np.int32)
+        index.entities = [self.entities[row] for row in rows]
+        index.doc_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        if self.embeddings is not None:
+            index.embeddings = self.embeddings.select(rows)
+        return index
+
+    @property
+    def num_docs(self) -> int:
+        """Количество документов в таблице"""
+        return len(self.doc_offsets) - 1
+
+    def has_document(self, doc_idx: int) -> bool:
+        """Есть ли в таблице сегменты для документа"""
+        return 0 <= doc_idx < self.num_docs
+
+    def segment_ids(self, doc_idx: int) -> np.ndarray:
+        """
+        Номера строк таблицы с сегментами документа
+
+        Args:
+            doc_idx (int): Позиция документа в датасете
+
+        Returns:
+            np.ndarray: Номера сегментов
+        """
+        return np.arange(self.doc_offsets[doc_idx], self.doc_offsets[doc_idx + 1])
+
+    def save(self, path: str) -> None:
+        """
+        Сохранение таблицы в каталог: тексты, длины и сущности — в колоночном
+        файле parquet, границы документов и эмбеддинги — в формате .npy
+
+        Args:
+            path (str): Путь к каталогу таблицы
+        """
+        os.makedirs(path, exist_ok=True)
+        pd.DataFrame({
+            "text": self.texts,
+            "word_count": np.asarray(self.word_counts, dtype=np.int32),
+            "entities": [json.dumps(entities, ensure_ascii=False) for entities in self.entities],
+        }).to_parquet(os.path.join(path, self.TABLE_FILE), index=False)
+        np.save(os.path.join(path, self.OFFSETS_FILE), np.ascontiguousarray(self.doc_offsets))
+        if self.embeddings is not None:
+            self.embeddings.save(os.path.join(path, self.EMBEDDINGS_DIR))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SegmentIndex':
+        """
+        Загрузка таблицы из каталога
+
+        Args:
+            path (str): Путь к каталогу таблицы
+            mmap (bool): Открывать ли эмбеддинги через отображение в память
+
+        Returns:
+            SegmentIndex: Загруженная таблица
+        """
+        index = cls()
+        table = pd.read_parquet(os.path.join(path, cls.TABLE_FILE))
+        index.texts = table["text"].tolist()
+        index.word_counts = table["word_count"].to_numpy(dtype=np.int32)
+        index.entities = [[tuple(entity) for entity in json.loads(entities)] for entities in table["entities"]]
+        index.doc_offsets = np.load(os.path.join(path, cls.OFFSETS_FILE))
+        embeddings_path = os.path.join(path, cls.EMBEDDINGS_DIR)
+        if os.path.isdir(embeddings_path):
+            index.embeddings = EmbeddingMatrix.load(embeddings_path, mmap=mmap)
+        return index
@@ -0,0 +1,475 @@
+"""
+Модуль пула выполнения запросов к модели: ограниченная очередь допуска, таймауты,
+вынос синхронного инференса из цикла событий FastAPI и клиент отдельного процесса инференса
+"""
+
+# Импорт стандартных библиотек
+import asyncio  # Ожидание результатов пула из асинхронных эндпоинтов
+import concurrent.futures  # Пулы потоков и процессов
+import contextvars  # Перенос контекста (трассировки) в поток пула
+import functools  # Для частичного применения функций
+import itertools  # Номера запросов к процессу инференса
+import multiprocessing  # Контекст запуска процессов пула
+import os  # Для чтения переменных окружения
+import pickle  # Сериализация сообщений процесса инференса
+import struct  # Заголовок длины сообщения
+import tempfile  # Каталог сокета процесса инференса по умолчанию
+import threading  # Семафор допуска
+
+# Импорт типов для аннотаций
+from typing import Any, AsyncIterator, Callable, Dict, Optional  # Для типизации кода
+
+from log_config import get_logger  # Неблокирующее логирование Neyro
+
+logger = get_logger(__name__)
+
+# Параметры пула (переменные окружения)
+POOL_KIND = os.getenv("NEYRO_POOL_KIND", "thread")  # thread, process или remote (см. RemotePool)
+POOL_WORKERS = int(os.getenv("NEYRO_POOL_WORKERS", "2"))  # Количество параллельно обрабатываемых запросов
+POOL_MAX_PENDING = int(os.getenv("NEYRO_POOL_MAX_PENDING", "16"))  # Запросов в работе и в очереди, сверх — 503
+REQUEST_TIMEOUT = float(os.getenv("NEYRO_REQUEST_TIMEOUT", "120"))  # Таймаут запроса, сек
+RETRY_AFTER = int(os.getenv("NEYRO_RETRY_AFTER", "5"))  # Значение заголовка Retry-After при отказе, сек
+# Каталог сокета доступен только пользователю сервиса: по сокету передаются сообщения pickle
+RUNTIME_DIR = os.getenv(
+    "NEYRO_RUNTIME_DIR",
+    os.path.join(os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"neyro-{os.getuid()}"),
+)
+INFERENCE_SOCKET = os.getenv("NEYRO_INFERENCE_SOCKET", os.path.join(RUNTIME_DIR, "inference.sock"))  # Unix-сокет процесса инференса
+
+
+class PoolBusyError(Exception):
+    """Очередь допуска заполнена, запрос не принят"""
+
+
+class PoolTimeoutError(Exception):
+    """Запрос не выполнен за отведенное время"""
+
+
+class InferenceUnavailableError(PoolBusyError):
+    """Процесс инференса недоступен: еще загружает модели, остановлен или разорвал соединение"""
+
+
+class RemoteCallError(Exception):
+    """Ошибка метода модели в процессе инференса, которую нельзя передать как есть"""
+
+
+_MESSAGE_HEADER = struct.Struct(">I")  # Длина сообщения перед его содержимым
+
+
+async def read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    """
+    Чтение сообщения протокола процесса инференса
+
+    Raises:
+        asyncio.IncompleteReadError: Соединение закрыто
+    """
+    (size,) = _MESSAGE_HEADER.unpack(await reader.readexactly(_MESSAGE_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_message(writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+    """Запись сообщения протокола процесса инференса (отправляется при writer.drain)"""
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+# Объект, методы которого вызываются внутри процесса пула
+_worker_target = None
+
+
+def _init_worker(factory: Callable[[], Any]) -> None:
+    """Создание объекта модели в процессе пула (один раз на процесс)"""
+    global _worker_target
+    _worker_target = factory()
+
+
+def _call_in_worker(method: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+    """Вызов метода объекта модели внутри процесса пула"""
+    return getattr(_worker_target, method)(*args, **kwargs)
+
+
+class InferencePool:
+    """
+    Пул выполнения синхронных методов модели для асинхронных эндпоинтов.
+
+    Количество принятых запросов (выполняемых и ожидающих) ограничено max_pending:
+    сверх лимита вызов сразу завершается PoolBusyError, чтобы сервис отвечал 503,
+    а не копил очередь. Если ответ не получен за timeout секунд, вызов завершается
+    PoolTimeoutError; место в очереди освобождается, когда работа действительно закончится.
+
+    В режиме "thread" методы вызываются у переданного объекта target в пуле потоков.
+    В режиме "process" каждый процесс пула создает собственный объект через factory.
+    """
+    KINDS = ("thread", "process")
+
+    def __init__(self, target: Any = None, factory: Optional[Callable[[], Any]] = None,
+                 kind: str = POOL_KIND, workers: int = POOL_WORKERS,
+                 max_pending: int = POOL_MAX_PENDING, timeout: float = REQUEST_TIMEOUT):
+        """
+        Args:
+            target (Any): Объект модели для режима "thread"
+            factory (Optional[Callable[[], Any]]): Сериализуемая фабрика объекта модели для режима "process"
+            kind (str): Тип пула: "thread" или "process"
+            workers (int): Количество потоков или процессов
+            max_pending (int): Максимум принятых запросов (включая выполняемые)
+            timeout (float): Таймаут одного запроса, сек
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестный тип пула: {kind}")
+        if kind == "thread" and target is None:
+            raise ValueError("Для пула потоков нужен объект модели (target)")
+        if kind == "process" and factory is None:
+            raise ValueError("Для пула процессов нужна фабрика объекта модели (factory)")
+
+        self.kind = kind
+        self.target = target
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.timeout = timeout
+        self._admission = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        if kind == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="neyro-inference"
+            )
+        else:
+            # spawn: процессы не наследуют потоки и состояние torch родительского процесса
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(factory,),
+            )
+        logger.info("Пул инференса: %s, исполнителей %d, очередь %d, таймаут %.0f с",
+                    kind, workers, self.max_pending, timeout)
+
+    @property
+    def pending(self) -> int:
+        """Количество принятых и еще не завершенных запросов"""
+        return self._pending
+
+    def _release(self, _future) -> None:
+        with self._pending_lock:
+            self._pending -= 1
+        self._admission.release()
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Вызов метода модели в пуле
+
+        Args:
+            method (str): Имя метода объекта модели
+            *args: Позиционные аргументы метода
+            timeout (Optional[float]): Таймаут запроса (по умолчанию из настроек пула)
+            **kwargs: Именованные аргументы метода
+
+        Returns:
+            Any: Результат метода
+
+        Raises:
+            PoolBusyError: Очередь допуска заполнена
+            PoolTimeoutError: Истек таймаут запроса
+        """
+        if not self._admission.acquire(blocking=False):
+            raise PoolBusyError("Очередь запросов заполнена")
+        with self._pending_lock:
+            self._pending += 1
+
+        try:
+            if self.kind == "thread":
+                # Контекст копируется, чтобы замеры tracing попадали в трассировку запроса
+                context = contextvars.copy_context()
+                call = functools.partial(getattr(self.target, method), *args, **kwargs)
+                future = self._executor.submit(context.run, call)
+            else:
+                future = self._executor.submit(_call_in_worker, method, args, kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"Запрос не выполнен за {timeout or self.timeout:.0f} с")
+
+    def stream(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Потоковый вызов метода-генератора модели в пуле потоков.
+        Место в очереди допуска занимается сразу (PoolBusyError выбрасывается до начала потока),
+        элементы передаются в цикл событий по мере их появления.
+
+        Args:
+            method (str): Имя метода-генератора объекта модели
+            *args: Позиционные аргументы метода
+            timeout (Optional[float]): Таймаут всего потока (по умолчанию из настроек пула)
+            **kwargs: Именованные аргументы метода
+
+        Returns:
+            AsyncIterator[Any]: Асинхронный итератор по элементам генератора
+
+        Raises:
+            PoolBusyError: Очередь допуска заполнена
+        """
+        if self.kind != "thread":
+            raise NotImplementedError("Потоковые вызовы поддерживаются только пулом потоков")
+        if not self._admission.acquire(blocking=False):
+            raise PoolBusyError("Очередь запросов заполнена")
+        with self._pending_lock:
+            self._pending += 1
+
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()  # Клиент отключился: генератор закрывается после текущего элемента
+        generator_function = getattr(self.target, method)
+
+        def produce():
+            try:
+                generator = generator_function(*args, **kwargs)
+                try:
+                    for item in generator:
+                        loop.call_soon_threadsafe(items.put_nowait, ("item", item))
+                        if stop.is_set():
+                            break
+                finally:
+                    generator.close()
+                loop.call_soon_threadsafe(items.put_nowait, ("end", None))
+            except Exception as e:
+                loop.call_soon_threadsafe(items.put_nowait, ("error", e))
+
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, produce)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        deadline = loop.time() + (timeout or self.timeout)
+
+        async def iterate():
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    try:
+                        kind, value = await asyncio.wait_for(items.get(), max(remaining, 0))
+                    except asyncio.TimeoutError:
+                        raise PoolTimeoutError(f"Запрос не выполнен за {timeout or self.timeout:.0f} с")
+                    if kind == "end":
+                        return
+                    if kind == "error":
+                        raise value
+                    yield value
+            finally:
+                stop.set()
+
+        return iterate()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние пула для эндпоинта проверки здоровья"""
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "timeout": self.timeout,
+        }
+
+    def shutdown(self) -> None:
+        """Остановка пула без ожидания незавершенных запросов"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RemotePool:
+    """
+    Клиент процесса инференса для HTTP-воркеров (режим "remote").
+
+    Модели загружены один раз в отдельном процессе (см. inference_server.py), а
+    воркеры uvicorn только пересылают вызовы через Unix-сокет и не занимают
+    память копиями моделей. Все вызовы воркера идут через одно соединение:
+    сообщения снабжаются номером запроса, ответы разбираются фоновой задачей.
+    Очередь допуска и таймауты — у пула процесса инференса, общего для всех
+    воркеров; ошибки вызова (PoolBusyError, PoolTimeoutError, ошибки модели)
+    передаются обратно и выбрасываются здесь. Сообщения сериализуются pickle,
+    поэтому сокет доступен только пользователю сервиса.
+    """
+    kind = "remote"
+
+    def __init__(self, path: str = INFERENCE_SOCKET, timeout: float = REQUEST_TIMEOUT):
+        """
+        Args:
+            path (str): Путь к Unix-сокету процесса инференса
+            timeout (float): Таймаут одного запроса, сек
+        """
+        self.path = path
+        self.timeout = timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._waiters: Dict[int, Any] = {}  # Номер запроса -> Future (вызов) или Queue (поток)
+        self._ids = itertools.count(1)
+
+    @property
+    def pending(self) -> int:
+        """Количество отправленных и еще не завершенных запросов этого воркера"""
+        return len(self._waiters)
+
+    async def _connection(self) -> asyncio.StreamWriter:
+        """Соединение с процессом инференса (устанавливается при первом запросе и после разрыва)"""
+        if self._writer is not None and not self._writer.is_closing():
+            return self._writer
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path)
+                except OSError as e:
+                    raise InferenceUnavailableError(f"Процесс инференса недоступен: {e}")
+                self._writer = writer
+                self._write_lock = asyncio.Lock()
+                asyncio.get_running_loop().create_task(self._read_responses(reader, writer))
+                logger.info("Соединение с процессом инференса %s установлено", self.path)
+        return self._writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Разбор ответов процесса инференса по номерам запросов"""
+        try:
+            while True:
+                message = await read_message(reader)
+                waiter = self._waiters.get(message["id"])
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(message)
+                elif waiter is not None and not waiter.done():
+                    waiter.set_result(message)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+            # Запросы, ответ на которые уже не придет, завершаются ошибкой
+            error = InferenceUnavailableError("Соединение с процессом инференса разорвано")
+            for request_id, waiter in list(self._waiters.items()):
+                message = {"id": request_id, "kind": "error", "error": error}
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(message)
+                elif not waiter.done():
+                    waiter.set_result(message)
+                del self._waiters[request_id]
+            logger.warning("Соединение с процессом инференса %s закрыто", self.path)
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        writer = await self._connection()
+        async with self._write_lock:
+            try:
+                write_message(writer, message)
+                await writer.drain()
+            except OSError as e:
+                writer.close()
+                raise InferenceUnavailableError(f"Процесс инференса недоступен: {e}")
+
+    @staticmethod
+    def _result(message: Dict[str, Any]) -> Any:
+        """Результат ответа или выброс переданной ошибки"""
+        if message["kind"] == "error":
+            raise message["error"]
+        return message.get("value")
+
+    async def _request(self, operation: str, method: str, args: tuple, kwargs: Dict[str, Any],
+                       timeout: Optional[float]) -> Any:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        try:
+            await self._send({"id": request_id, "op": operation, "method": method,
+                              "args": args, "kwargs": kwargs, "timeout": timeout})
+            try:
+                message = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeoutError(f"Запрос не выполнен за {timeout:.0f} с")
+        finally:
+            self._waiters.pop(request_id, None)
+        return self._result(message)
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Вызов метода модели в пуле процесса инференса (аналог InferencePool.call)
+
+        Raises:
+            PoolBusyError: Очередь допуска процесса инференса заполнена
+            InferenceUnavailableError: Процесс инференса недоступен
+            PoolTimeoutError: Истек таймаут запроса
+        """
+        return await self._request("call", method, args, kwargs, timeout or self.timeout)
+
+    async def control(self, method: str, *args, **kwargs) -> Any:
+        """
+        Вызов управляющего метода процесса инференса вне очереди допуска
+        (изменения базы знаний, состояние модели, готовые объяснения)
+
+        Raises:
+            InferenceUnavailableError: Процесс инференса недоступен
+        """
+        return await self._request("control", method, args, kwargs, None)
+
+    async def stream(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Потоковый вызов метода-генератора модели в процессе инференса (аналог InferencePool.stream).
+        Возвращает итератор после того, как процесс инференса принял запрос; при
+        закрытии итератора до конца потока генерация в процессе инференса прекращается
+
+        Raises:
+            PoolBusyError: Очередь допуска процесса инференса заполнена
+            InferenceUnavailableError: Процесс инференса недоступен
+        """
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        request_id = next(self._ids)
+        messages: asyncio.Queue = asyncio.Queue()
+        self._waiters[request_id] = messages
+        try:
+            await self._send({"id": request_id, "op": "stream", "method": method,
+                              "args": args, "kwargs": kwargs, "timeout": timeout})
+            self._result(await messages.get())  # Запрос принят или отклонен очередью допуска
+        except BaseException:
+            self._waiters.pop(request_id, None)
+            raise
+
+        async def iterate():
+            finished = False
+            try:
+                while True:
+                    try:
+                        message = await asyncio.wait_for(messages.get(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        raise PoolTimeoutError(f"Запрос не выполнен за {timeout:.0f} с")
+                    if message["kind"] == "item":
+                        yield message["value"]
+                        continue
+                    finished = True
+                    self._result(message)
+                    return
+            finally:
+                self._waiters.pop(request_id, None)
+                if not finished:
+                    try:
+                        await self._send({"id": request_id, "op": "cancel"})
+                    except InferenceUnavailableError:
+                        pass
+
+        return iterate()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние клиента для эндпоинта проверки здоровья"""
+        return {
+            "kind": self.kind,
+            "socket": self.path,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "pending": self.pending,
+            "timeout": self.timeout,
+        }
+
+    def shutdown(self) -> None:
+        """Закрытие соединения с процессом инференса"""
+        if self._writer is not None:
+            self._writer.close()
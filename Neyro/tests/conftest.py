@@ -0,0 +1,8 @@
+"""
+Общие настройки модульных тестов Neyro: модули сервиса импортируются из каталога Neyro
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
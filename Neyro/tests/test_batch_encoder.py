@@ -0,0 +1,73 @@
+"""
+Пакетирование запросов к SentenceTransformer: каждый вызов encode получает ответ,
+в том числе при одновременной остановке кодировщика
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from batch_encoder import BatchingEncoder
+
+
+class CountingModel:
+    """Модель, кодирующая текст его длиной; запоминает размеры пакетов"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def encode(self, texts, batch_size=None):
+        if self.fail:
+            raise RuntimeError("CUDA out of memory")
+        if isinstance(texts, str):
+            return np.array([len(texts)], dtype=np.float32)
+        self.batches.append(len(texts))
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+def encode_concurrently(encoder, texts, close_after=None):
+    results = {}
+
+    def worker(text):
+        results[text] = encoder.encode(text)
+
+    threads = [threading.Thread(target=worker, args=(text,)) for text in texts]
+    for i, thread in enumerate(threads):
+        thread.start()
+        if i == close_after:
+            encoder.close()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    return results
+
+
+def test_concurrent_calls_share_a_batch():
+    model = CountingModel()
+    encoder = BatchingEncoder(model, max_batch_size=8, max_wait_ms=50)
+
+    results = encode_concurrently(encoder, ["а" * n for n in range(1, 9)])
+
+    assert {text: float(vector[0]) for text, vector in results.items()} == {"а" * n: n for n in range(1, 9)}
+    assert len(model.batches) < 8
+    encoder.close()
+
+
+def test_close_during_calls_answers_every_caller():
+    for _ in range(20):
+        encoder = BatchingEncoder(CountingModel(), max_batch_size=4, max_wait_ms=1)
+
+        results = encode_concurrently(encoder, ["а" * n for n in range(1, 33)], close_after=10)
+
+        assert len(results) == 32
+    assert float(encoder.encode("ааа")[0]) == 3  # После остановки — прямое кодирование
+
+
+def test_encoding_error_is_raised_in_caller():
+    encoder = BatchingEncoder(CountingModel(fail=True), max_batch_size=4, max_wait_ms=1)
+
+    with pytest.raises(RuntimeError):
+        encoder.encode("запрос")
+    encoder.close()
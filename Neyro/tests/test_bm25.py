@@ -0,0 +1,87 @@
+"""
+Совпадение оценок BM25Index с rank_bm25.BM25Okapi
+"""
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from bm25 import BM25Index
+
+CORPUS = [
+    ["заявка", "поставщик", "контракт", "заявка"],
+    ["контракт", "подписание", "электронный", "подпись"],
+    [],
+    ["поставщик", "регистрация", "портал"],
+    ["заявка", "котировочный", "сессия", "поставщик", "контракт"],
+    ["портал", "поставщик", "прайслист", "загрузка", "поставщик"],
+    [],
+    ["контракт", "поставщик", "исполнение"],
+]
+QUERIES = [
+    ["заявка"],
+    ["поставщик", "контракт"],  # Термины из большинства документов: отрицательный IDF заменяется epsilon
+    ["заявка", "заявка", "портал"],  # Повтор токена учитывается дважды
+    ["неизвестный"],
+    [],
+]
+
+
+def okapi_scores(corpus, query, **params):
+    """Оценки BM25Okapi, обученного без пустых документов, на позициях исходного корпуса"""
+    positions = [position for position, tokens in enumerate(corpus) if tokens]
+    okapi = BM25Okapi([corpus[position] for position in positions], **params)
+    scores = np.zeros(len(corpus))
+    if query:
+        scores[positions] = okapi.get_scores(query)
+    return scores
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("params", [{}, {"k1": 1.2, "b": 0.5, "epsilon": 0.5}])
+def test_scores_match_okapi(query, params):
+    index = BM25Index.build(CORPUS, **params)
+    np.testing.assert_allclose(index.get_scores(query), okapi_scores(CORPUS, query, **params), rtol=1e-9)
+
+
+def test_negative_idf_replaced_with_epsilon():
+    index = BM25Index.build(CORPUS)
+    okapi = BM25Okapi([tokens for tokens in CORPUS if tokens])
+    term = "поставщик"
+    assert okapi.idf[term] == pytest.approx(0.25 * okapi.average_idf)
+    assert index.idf[index.vocabulary[term]] == pytest.approx(okapi.idf[term])
+    assert index.avgdl == pytest.approx(okapi.avgdl)
+
+
+def test_empty_documents_are_not_found():
+    index = BM25Index.build(CORPUS)
+    scores = index.get_scores(["заявка", "поставщик", "портал"])
+    assert scores[2] == 0 and scores[6] == 0
+    assert not {2, 6} & set(index.top_k(["заявка", "поставщик", "портал"], k=len(CORPUS))[0].tolist())
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_top_k_matches_scores(query):
+    index = BM25Index.build(CORPUS)
+    expected = okapi_scores(CORPUS, query)
+    positive = np.flatnonzero(expected > 0)
+    expected_order = positive[np.argsort(-expected[positive], kind="stable")]
+
+    doc_ids, scores = index.top_k(query, k=3)
+    assert doc_ids.tolist() == expected_order[:3].tolist()
+    np.testing.assert_allclose(scores, expected[doc_ids], rtol=1e-9)
+
+
+def test_batch_scores_match_single_queries():
+    index = BM25Index.build(CORPUS)
+    batch = index.get_batch_scores(QUERIES)
+    for row, query in zip(batch, QUERIES):
+        np.testing.assert_allclose(row, index.get_scores(query))
+
+
+def test_saved_index_scores_the_same(tmp_path):
+    index = BM25Index.build(CORPUS)
+    index.save(str(tmp_path / "bm25"))
+    loaded = BM25Index.load(str(tmp_path / "bm25"))
+    for query in QUERIES:
+        np.testing.assert_allclose(loaded.get_scores(query), index.get_scores(query))
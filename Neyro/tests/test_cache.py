@@ -0,0 +1,155 @@
+"""
+Вытеснение и время жизни записей кэша запросов, очистка при смене версии модели
+"""
+
+import gc
+import re
+
+import numpy as np
+
+from cache import QueryCache, SemanticAnswerCache, TTLCache, normalize_query, render_prometheus
+
+
+class FakeClock:
+    """Управляемый источник времени"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" использована позже "b"
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_overwrite_refreshes_entry():
+    clock = FakeClock()
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    clock.now = 5
+    cache.set("a", 10)
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    clock.now = 12  # "a" перезаписана в момент 5 и еще не истекла
+    assert cache.get("a") == 10
+
+
+def test_expired_entry_is_removed():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10  # Чтение не продлевает время жизни
+    assert cache.get("a", "нет") == "нет"
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_query_cache_cleared_on_version_change():
+    cache = QueryCache(max_size=4, ttl=60)
+    cache.ensure_version("v1")
+    key = (normalize_query("  Как  загрузить ПРАЙСЛИСТ "), 5)
+    for layer in QueryCache.LAYERS:
+        cache.set(layer, key, layer)
+
+    cache.ensure_version("v1")
+    assert cache.get("ranking", (normalize_query("как загрузить прайслист"), 5)) == "ranking"
+
+    cache.ensure_version("v2")
+    assert all(cache.get(layer, key) is None for layer in QueryCache.LAYERS)
+    assert cache.version == "v2"
+
+
+def test_disabled_query_cache_stores_nothing():
+    cache = QueryCache(enabled=False)
+    cache.set("ranking", "запрос", [1, 2])
+    assert cache.get("ranking", "запрос") is None
+
+
+def metric(text, name, layer):
+    """Значение метрики слоя в тексте /metrics (0, если слой еще не встречался)"""
+    match = re.search(rf'^{name}{{layer="{layer}"}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_prometheus_counters_survive_previous_generation():
+    before = render_prometheus()
+    old = QueryCache(max_size=4, ttl=60)
+    old.set("ranking", "запрос", [1])
+    old.get("ranking", "запрос")
+    old.get("ranking", "другой запрос")
+    assert metric(render_prometheus(), "neyro_query_cache_entries", "ranking") >= 1
+
+    del old  # Кэш прежнего поколения модели удален
+    gc.collect()
+    after = render_prometheus()
+
+    for name in ("neyro_query_cache_hits_total", "neyro_query_cache_misses_total"):
+        assert metric(after, name, "ranking") == metric(before, name, "ranking") + 1
+    assert metric(after, "neyro_query_cache_entries", "ranking") == 0
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_answer_cache_reuses_close_query_with_same_sources():
+    cache = SemanticAnswerCache(threshold=0.95, max_size=4, ttl=60, top_sources=2, enabled=True, clock=FakeClock())
+    cache.ensure_version("v1")
+    cache.store(unit([1, 0, 0]), [5, 7, 9], "ответ", "v1")
+
+    answer, similarity = cache.lookup(unit([1, 0.1, 0]), [7, 5, 1], "v1")
+    assert answer == "ответ" and similarity > 0.95
+    assert cache.lookup(unit([1, 0.1, 0]), [5, 8], "v1") is None  # Другие лучшие статьи
+    assert cache.lookup(unit([0, 1, 0]), [5, 7], "v1") is None  # Далекий запрос
+
+
+def test_answer_cache_eviction_ttl_and_version():
+    clock = FakeClock()
+    cache = SemanticAnswerCache(threshold=0.99, max_size=2, ttl=10, top_sources=1, enabled=True, clock=clock)
+    cache.ensure_version("v1")
+    cache.store(unit([1, 0, 0]), [1], "первый", "v1")
+    cache.store(unit([0, 1, 0]), [2], "второй", "v1")
+    assert cache.lookup(unit([1, 0, 0]), [1], "v1")[0] == "первый"
+    cache.store(unit([0, 0, 1]), [3], "третий", "v1")  # Вытесняется давно не использованный "второй"
+
+    assert cache.lookup(unit([0, 1, 0]), [2], "v1") is None
+    assert cache.lookup(unit([1, 0, 0]), [1], "v1")[0] == "первый"
+    assert cache.evictions == 1
+
+    clock.now = 10
+    assert cache.lookup(unit([0, 0, 1]), [3], "v1") is None
+
+    cache.store(unit([0, 1, 0]), [2], "второй", "v1")
+    cache.ensure_version("v2")
+    assert len(cache) == 0 and cache.lookup(unit([0, 1, 0]), [2], "v2") is None
+
+
+def test_answer_cache_drops_answers_of_previous_version():
+    cache = SemanticAnswerCache(threshold=0.99, max_size=4, ttl=60, top_sources=1, enabled=True, clock=FakeClock())
+    cache.ensure_version("v1")
+    cache.store(unit([1, 0, 0]), [1], "ответ v1", "v1")
+
+    # Пока генерировался ответ, база знаний обновилась
+    cache.ensure_version("v2")
+    cache.store(unit([0, 1, 0]), [2], "устаревший ответ", "v1")
+
+    assert len(cache) == 0
+    cache.store(unit([0, 1, 0]), [2], "ответ v2", "v2")
+    assert cache.lookup(unit([0, 1, 0]), [2], "v1") is None  # Статьи найдены по прежней версии
+    assert cache.lookup(unit([0, 1, 0]), [2], "v2")[0] == "ответ v2"
@@ -0,0 +1,160 @@
+"""
+Журнал изменений базы знаний: пакеты /ingest не переписывают каталог модели,
+но сохраняются между перезапусками ассистента и при переобучении
+"""
+
+import pytest
+
+import assistant
+from assistant import HybridAssistant
+from change_log import ChangeLog
+
+
+class FakeModel:
+    """Модель со статьями в словаре; каталоги модели хранятся в памяти по пути"""
+
+    bundles = {}
+    saves = 0
+
+    def __init__(self, articles, version):
+        self.articles = dict(articles)
+        self.version = version
+
+    @property
+    def model_version(self):
+        return self.version
+
+    @classmethod
+    def load_model(cls, model_path, shared=None):
+        return cls(*cls.bundles[model_path])
+
+    def save_model(self, model_path):
+        FakeModel.saves += 1
+        FakeModel.bundles[model_path] = (dict(self.articles), self.version)
+
+    def _bump(self):
+        self.version = f"v{len(self.articles)}-{sorted(self.articles.items())}"
+
+    def upsert_documents(self, documents):
+        changed = [document for document in documents if self.articles.get(document["id"]) != document["title"]]
+        for document in changed:
+            self.articles[document["id"]] = document["title"]
+        if changed:
+            self._bump()
+        return {"model_version": self.version, "documents": len(self.articles), "deleted": 0}
+
+    def delete_documents(self, ids):
+        removed = [self.articles.pop(document_id) for document_id in ids if document_id in self.articles]
+        if removed:
+            self._bump()
+        return {"model_version": self.version, "documents": len(self.articles), "deleted": 0}
+
+    def compact(self):
+        return {"model_version": self.version, "documents": len(self.articles), "deleted": 0}
+
+    def live_documents(self):
+        return dict(self.articles)
+
+
+class RetrainedModel(FakeModel):
+    """Модель, обучаемая заново: статьи — из dataset или, без него, из файла с данными"""
+
+    def __init__(self, dataset_path, use_bert=True, use_llm=True, shared=None, dataset=None):
+        super().__init__(dataset if dataset is not None else {1: "Регистрация"}, "untrained")
+
+    @classmethod
+    def load_model(cls, model_path, shared=None):
+        return FakeModel.load_model(model_path, shared)
+
+    def train(self):
+        self._bump()
+
+
+@pytest.fixture
+def make_assistant(tmp_path, monkeypatch):
+    monkeypatch.setattr(assistant, "Model", FakeModel)
+    monkeypatch.setattr(FakeModel, "bundles", {})
+    monkeypatch.setattr(FakeModel, "saves", 0)
+    model_path = str(tmp_path / "model.bundle")
+    dataset_path = tmp_path / "dataset.parquet"
+    dataset_path.touch()
+    (tmp_path / "model.bundle").mkdir()
+    FakeModel.bundles[model_path] = ({1: "Регистрация"}, "v0")
+
+    def make():
+        return HybridAssistant(model_path=model_path, dataset_path=str(dataset_path), legacy_model_path=None)
+
+    return make
+
+
+def test_batches_are_logged_instead_of_saving_the_bundle(make_assistant):
+    helper = make_assistant()
+
+    helper.apply_changes(upserts=[{"id": 2, "title": "Контракт"}])
+    helper.apply_changes(upserts=[{"id": 3, "title": "Прайслист"}], deletes=[1])
+    helper.apply_changes(upserts=[{"id": 2, "title": "Контракт"}])  # Повтор пакета ничего не меняет
+
+    assert FakeModel.saves == 0
+    assert helper.change_log.read("v0") == [
+        ([{"id": 2, "title": "Контракт"}], []),
+        ([{"id": 3, "title": "Прайслист"}], [1]),
+    ]
+
+
+def test_logged_changes_survive_restart(make_assistant):
+    make_assistant().apply_changes(upserts=[{"id": 2, "title": "Контракт"}], deletes=[1])
+
+    restarted = make_assistant()
+
+    assert restarted.model.articles == {2: "Контракт"}
+    assert FakeModel.saves == 0
+
+
+def test_compaction_saves_bundle_and_clears_log(make_assistant):
+    helper = make_assistant()
+    helper.apply_changes(upserts=[{"id": 2, "title": "Контракт"}])
+
+    helper.compact_index()
+
+    assert FakeModel.saves == 1
+    assert helper.change_log.read(helper.model.model_version) == []
+    assert make_assistant().model.articles == {1: "Регистрация", 2: "Контракт"}
+
+
+def test_full_log_triggers_a_save(make_assistant):
+    helper = make_assistant()
+    helper.change_log.max_bytes = 1
+
+    helper.apply_changes(upserts=[{"id": 2, "title": "Контракт"}])
+
+    assert FakeModel.saves == 1
+    assert not helper.change_log.full
+    assert make_assistant().model.articles == {1: "Регистрация", 2: "Контракт"}
+
+
+def test_log_skips_records_of_another_bundle_and_torn_tail(tmp_path):
+    change_log = ChangeLog(str(tmp_path / "model.bundle.changes.jsonl"))
+    change_log.append("v1", [{"id": 1, "title": "Старый каталог"}], [])
+    change_log.append("v2", [{"id": 2, "title": "Текущий каталог"}], [7])
+    with open(change_log.path, "a", encoding="utf-8") as f:
+        f.write('{"base_version": "v2", "upse')  # Запись, прерванная остановкой процесса
+
+    reopened = ChangeLog(change_log.path)
+    reopened.append("v2", [], [8])
+
+    assert reopened.read("v2") == [([{"id": 2, "title": "Текущий каталог"}], [7]), ([], [8])]
+
+    reopened.clear()
+    assert reopened.read("v2") == []
+
+
+def test_retrain_keeps_ingested_changes(make_assistant, monkeypatch):
+    helper = make_assistant()
+    helper.apply_changes(upserts=[{"id": 2, "title": "Контракт"}], deletes=[1])
+    monkeypatch.setattr(assistant, "Model", RetrainedModel)
+
+    helper._build_generation("retrain")
+
+    assert isinstance(helper.model, RetrainedModel)
+    assert helper.model.articles == {2: "Контракт"}
+    assert make_assistant().model.articles == {2: "Контракт"}
@@ -0,0 +1,253 @@
+"""
+Обновление базы знаний без переобучения: upsert_documents, delete_documents и compact.
+Удаленные и замененные статьи не должны находиться ни BM25, ни плотным поиском,
+ни в рекомендациях, а идентификаторы статей сохраняются после уплотнения
+"""
+
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from model import DocumentIdsError, Model
+
+
+class SimpleTextProcessor:
+    """Обработчик текста без spaCy и словарей pymorphy2: слова в нижнем регистре"""
+
+    stop_words = {"и", "в", "на", "по", "для"}
+
+    def __init__(self):
+        self.vocabulary = set()
+
+    def _words(self, text):
+        return [word for word in re.findall(r"\w+", str(text).lower()) if word not in self.stop_words]
+
+    def classify_query(self, text):
+        words = set(self._words(text))
+        return {
+            "query_type": "error" if "ошибка" in words else "info",
+            "user_role": "поставщик" if "поставщик" in words else None,
+            "component": None,
+            "actions": [],
+            "organizations": [],
+            "persons": [],
+            "locations": [],
+        }
+
+    def _preprocess_for_bm25(self, text):
+        return [word for word in self._words(text) if len(word) > 1]
+
+    def lemmatize(self, token):
+        return token
+
+    def extract_entities_spacy(self, text):
+        return []
+
+    def extract_entities_spacy_batch(self, texts, batch_size=64):
+        return [[] for _ in texts]
+
+    def build_vocabulary(self, texts):
+        self.vocabulary = {word for text in texts for word in self._words(text)}
+
+    def update_vocabulary(self, added_texts=(), removed_texts=()):
+        self.vocabulary |= {word for text in added_texts for word in self._words(text)}
+
+
+class HashingEncoder:
+    """Детерминированный «SentenceTransformer»: мешок слов, хэшированный в 64 измерения"""
+
+    DIMENSION = 64
+
+    def _vector(self, text):
+        vector = np.zeros(self.DIMENSION, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % self.DIMENSION] += 1.0
+        return vector
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.stack([self._vector(text) for text in texts])
+
+
+def article(document_id, topic):
+    """Статья, найти которую можно только по уникальному слову topic"""
+    return {
+        "id": document_id,
+        "title": f"Статья {topic}",
+        "description": " ".join(
+            f"Раздел {number} описывает {topic} в личном кабинете портала." for number in range(8)
+        ),
+    }
+
+
+def dataset_of(articles, with_ids=True):
+    dataset = pd.DataFrame({
+        "Заголовок статьи": [document["title"] for document in articles],
+        "Описание": [document["description"] for document in articles],
+    })
+    if with_ids:
+        dataset.insert(0, "id", [document["id"] for document in articles])
+    return dataset
+
+
+TOPICS = {101: "регистрация", 102: "контракт", 103: "прайслист", 104: "котировка", 105: "оферта", 106: "рейтинг"}
+
+
+@pytest.fixture
+def make_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "TextProcessor", SimpleTextProcessor)
+    monkeypatch.chdir(tmp_path)  # Кэш обучения (train_cache) создается во временном каталоге
+
+    def make(articles, with_ids=True):
+        path = tmp_path / "dataset.parquet"
+        dataset_of(articles, with_ids).to_parquet(path)
+        model = Model(str(path), use_bert=False, use_llm=False, use_cross_encoder=False)
+        model.use_bert, model.bert_model = True, HashingEncoder()
+        model.COMPACTION_RATIO = 1.0  # Уплотнение только явным вызовом compact
+        model.train()
+        return model
+
+    return make
+
+
+@pytest.fixture
+def model(make_model):
+    return make_model([article(document_id, topic) for document_id, topic in TOPICS.items()])
+
+
+def bm25_hits(model, word):
+    """Идентификаторы статей с ненулевой оценкой BM25 по слову"""
+    scores = model.bm25.get_scores([word])
+    return set(model.dataset["id"].iloc[np.flatnonzero(scores > 0)])
+
+
+def dense_hits(model, word):
+    """Идентификаторы статей с ненулевой оценкой predict (кандидаты BM25 и плотного поиска)"""
+    similarity, _ = model.predict(word)
+    return set(model.dataset["id"].iloc[np.flatnonzero(similarity > 0)])
+
+
+def recommendations(model, word):
+    """Рекомендации с ненулевой релевантностью"""
+    result = model.get_recommendations(word, top_n=len(model.dataset))
+    return result[result["релевантность"] > 0]
+
+
+def recommended_ids(model, word):
+    return set(model.dataset["id"].loc[recommendations(model, word).index])
+
+
+def test_upsert_adds_new_and_hides_replaced_versions(model):
+    stats = model.upsert_documents([
+        dict(article(102, "аккредитация"), title="Статья аккредитация"),
+        article(107, "закупка"),
+    ])
+
+    assert stats["documents"] == 7
+    assert stats["deleted"] == 1
+    assert not bm25_hits(model, "контракт")
+    assert bm25_hits(model, "аккредитация") == {102}
+    assert bm25_hits(model, "закупка") == {107}
+    assert "Статья контракт" not in set(recommendations(model, "контракт")["Заголовок статьи"])
+    assert 102 in recommended_ids(model, "аккредитация")
+
+
+def test_upsert_of_unchanged_article_changes_nothing(model):
+    version = model.model_version
+
+    stats = model.upsert_documents([article(101, TOPICS[101])])
+
+    assert stats == {"model_version": version, "documents": 6, "deleted": 0}
+
+
+def test_deleted_articles_are_hidden_from_every_index(model):
+    assert 103 in bm25_hits(model, "прайслист")
+    assert 103 in dense_hits(model, "прайслист")
+    assert 103 in recommended_ids(model, "прайслист")
+
+    stats = model.delete_documents([103, 999])
+
+    assert stats["documents"] == 5 and stats["deleted"] == 1
+    assert 103 not in bm25_hits(model, "прайслист")
+    assert 103 not in dense_hits(model, "прайслист")
+    assert 103 not in recommended_ids(model, "прайслист")
+    assert 103 not in recommended_ids(model, "портала")
+
+
+def test_compact_keeps_ids_and_search_results(model):
+    model.upsert_documents([article(102, "аккредитация"), article(107, "закупка")])
+    model.delete_documents([104])
+    before = {topic: recommended_ids(model, topic) for topic in ("регистрация", "аккредитация", "закупка", "оферта")}
+
+    stats = model.compact()
+
+    assert stats["deleted"] == 0 and stats["documents"] == 6
+    assert model.dataset["id"].tolist() == [101, 103, 105, 106, 102, 107]
+    assert model.bm25.get_scores(["регистрация"]).shape == (6,)
+    assert model.bert_embeddings.dense().shape[0] == 6
+    assert model.segment_index.num_docs == 6
+    assert {topic: recommended_ids(model, topic) for topic in before} == before
+    assert bm25_hits(model, "котировка") == set()
+    assert 104 not in dense_hits(model, "котировка")
+
+
+def test_compacted_model_matches_full_retraining(model, make_model):
+    model.upsert_documents([article(102, "аккредитация"), article(107, "закупка")])
+    model.delete_documents([104])
+    model.compact()
+
+    retrained = make_model(
+        [article(document_id, TOPICS[document_id]) for document_id in (101, 103, 105, 106)]
+        + [article(102, "аккредитация"), article(107, "закупка")]
+    )
+
+    assert model.dataset["id"].tolist() == retrained.dataset["id"].tolist()
+    for words in (["регистрация"], ["аккредитация", "портала"], ["закупка", "раздел"]):
+        np.testing.assert_allclose(model.bm25.get_scores(words), retrained.bm25.get_scores(words))
+    np.testing.assert_allclose(model.bert_embeddings.dense(), retrained.bert_embeddings.dense())
+    assert model.segment_index.texts == retrained.segment_index.texts
+
+
+def test_updates_require_article_ids(make_model):
+    model = make_model([article(document_id, topic) for document_id, topic in TOPICS.items()], with_ids=False)
+
+    with pytest.raises(DocumentIdsError):
+        model.upsert_documents([article(107, "закупка")])
+    with pytest.raises(DocumentIdsError):
+        model.delete_documents([101])
+    assert len(model.dataset) == 6 and model._tombstone_mask() is None
+
+
+def test_retraining_on_live_documents_keeps_ingested_changes(model):
+    model.upsert_documents([article(102, "аккредитация"), article(107, "закупка")])
+    model.delete_documents([104])
+
+    retrained = Model(model.dataset_path, use_bert=False, use_llm=False, use_cross_encoder=False,
+                      dataset=model.live_documents())
+    retrained.train()
+
+    assert sorted(retrained.dataset["id"]) == [101, 102, 103, 105, 106, 107]
+    assert bm25_hits(retrained, "закупка") == {107}
+    assert bm25_hits(retrained, "аккредитация") == {102}
+    assert bm25_hits(retrained, "котировка") == set()
+    assert len(model.dataset) == 8  # Датасет работающей модели не меняется
+
+
+def test_failed_query_encoding_skips_dense_scores_for_that_request_only(model):
+    encoder = model.bert_model
+
+    class FailingEncoder:
+        def encode(self, texts, **kwargs):
+            raise RuntimeError("CUDA out of memory")
+
+    model.bert_model = FailingEncoder()
+    assert 103 in dense_hits(model, "прайслист")  # Кандидаты BM25 без плотных оценок
+    assert model.use_bert
+
+    model.bert_model = encoder
+    assert 103 in dense_hits(model, "прайслист")
@@ -0,0 +1,103 @@
+"""
+Упаковка фрагментов в бюджет токенов промпта
+"""
+
+import re
+
+from prompt_packing import deduplicate_fragments, pack_fragments
+
+
+def split_sentences(text):
+    """Разбиение на предложения по точке (без данных punkt)"""
+    return [sentence for sentence in re.split(r"(?<=\.)\s+", text.strip()) if sentence]
+
+
+def count_tokens(text):
+    """Токен — слово"""
+    return len(text.split())
+
+
+def render_block(number, fragment, text):
+    return f"[{number}] {text}"
+
+
+def sentences(prefix, count, words=5):
+    return " ".join(f"{prefix}{i} " + "слово " * (words - 2) + "конец." for i in range(count))
+
+
+def fragment(doc_id, text, relevance):
+    return {"doc_id": doc_id, "fragment": text, "relevance": relevance}
+
+
+def pack(fragments, budget):
+    return pack_fragments(fragments, render_block, count_tokens, budget, split_sentences=split_sentences)
+
+
+def test_blocks_fit_budget_and_keep_relevance_order():
+    fragments = [
+        fragment(1, sentences("а", 6), 0.9),   # 31 токен с номером блока
+        fragment(2, sentences("б", 2), 0.8),   # 11 токенов
+        fragment(3, sentences("в", 2), 0.1),   # 11 токенов
+    ]
+
+    blocks = pack(fragments, budget=45)
+
+    assert sum(count_tokens(block) for block in blocks) <= 45
+    # Длинный фрагмент менее выгоден на токен, но помещается после коротких; порядок — по релевантности
+    assert [block.split()[1][0] for block in blocks] == ["а", "б"]
+    assert [block.split()[0] for block in blocks] == ["[1]", "[2]"]
+
+
+def test_fragment_that_does_not_fit_is_skipped_for_shorter_ones():
+    fragments = [
+        fragment(1, sentences("а", 2), 0.9),
+        fragment(2, sentences("б", 10), 0.8),
+        fragment(3, sentences("в", 2), 0.5),
+    ]
+
+    blocks = pack(fragments, budget=25)
+
+    assert [block.split()[1][0] for block in blocks] == ["а", "в"]
+
+
+def test_most_relevant_fragment_truncated_by_sentences_when_nothing_fits():
+    fragments = [fragment(1, sentences("а", 10), 0.9), fragment(2, sentences("б", 8), 0.8)]
+
+    blocks = pack(fragments, budget=18)
+
+    assert len(blocks) == 1
+    assert blocks[0] == "[1] " + sentences("а", 3)
+    assert count_tokens(blocks[0]) <= 18
+
+
+def test_first_sentence_kept_even_if_longer_than_budget():
+    blocks = pack([fragment(1, sentences("а", 2, words=30), 0.9)], budget=10)
+
+    assert blocks == ["[1] " + sentences("а", 1, words=30)]
+
+
+def test_overlapping_sentences_removed_from_less_relevant_fragment():
+    shared = sentences("общ", 4)
+    fragments = [
+        fragment(1, sentences("а", 1) + " " + shared, 0.9),
+        fragment(1, shared + " " + sentences("б", 5), 0.8),  # Соседний сегмент той же статьи
+        fragment(2, shared, 0.7),  # Другая статья: повтор допустим
+        fragment(1, shared, 0.6),  # Ничего нового
+    ]
+
+    deduplicated = deduplicate_fragments(fragments, split_sentences)
+
+    assert [text for _, text in deduplicated] == [sentences("а", 1) + " " + shared, sentences("б", 5), shared]
+
+
+def test_almost_empty_remainder_is_dropped():
+    fragments = [
+        fragment(1, sentences("общ", 4), 0.9),
+        fragment(1, sentences("общ", 4) + " " + sentences("б", 1), 0.8),  # Осталось 5 слов < MIN_TRIMMED_WORDS
+    ]
+
+    assert [item["relevance"] for item, _ in deduplicate_fragments(fragments, split_sentences)] == [0.9]
+
+
+def test_empty_input():
+    assert pack([], budget=100) == []
@@ -0,0 +1,53 @@
+"""
+Источники ответа сериализуются в JSON при любых типах столбцов датасета
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from model import Model
+
+
+def model_with_dataset(dataset):
+    """Модель без обучения: для источников нужен только датасет"""
+    model = Model.__new__(Model)
+    model._init_locks()
+    model.dataset = dataset
+    return model
+
+
+def render(sources):
+    """Сериализация так же, как в ответе эндпоинта FastAPI"""
+    return json.loads(JSONResponse(content=jsonable_encoder({"sources": sources})).body)["sources"]
+
+
+def test_sources_with_numpy_ids_and_missing_urls():
+    # Столбец id появляется после обновления статей (upsert_documents) и в выгрузке neyro_sync.py --export
+    model = model_with_dataset(pd.DataFrame({
+        "id": np.array([11, 12, 13], dtype=np.int64),
+        "Заголовок статьи": ["Регистрация", "Подписание контракта", "Прайслист"],
+        "Описание": ["а", "б", "в"],
+        "Ссылка на статью": ["https://zakupki.mos.ru/1", None, np.nan],
+    }))
+
+    sources = model._build_sources([2, 0, 1])
+
+    assert render(sources) == [
+        {"doc_id": 13, "title": "Прайслист", "url": None},
+        {"doc_id": 11, "title": "Регистрация", "url": "https://zakupki.mos.ru/1"},
+        {"doc_id": 12, "title": "Подписание контракта", "url": None},
+    ]
+    assert all(type(source["doc_id"]) is int for source in sources)
+
+
+def test_sources_without_id_column_use_positions():
+    model = model_with_dataset(pd.DataFrame({"Заголовок статьи": ["Регистрация", "Прайслист"], "Описание": ["а", "б"]}))
+
+    assert render(model._build_sources(np.array([1, 0]))) == [
+        {"doc_id": 1, "title": "Прайслист", "url": None},
+        {"doc_id": 0, "title": "Регистрация", "url": None},
+    ]
@@ -0,0 +1,236 @@
+"""
+Модуль трассировки этапов обработки запроса: время выполнения и объемы данных по этапам
+"""
+
+# Импорт стандартных библиотек
+import bisect  # Для поиска корзины гистограммы
+import threading  # Для блокировки при обновлении общих гистограмм
+import time  # Для измерения реального и процессорного времени
+from contextvars import ContextVar  # Трассировка текущего запроса (отдельная для каждого потока и задачи)
+
+# Импорт типов для аннотаций
+from typing import Dict, Optional, Tuple  # Для типизации кода
+
+
+class Trace:
+    """
+    Трассировка одного запроса.
+
+    Для каждого именованного этапа накапливаются реальное время, процессорное
+    время потока, количество обработанных элементов и число вызовов
+    (этап может выполняться несколько раз, например для каждого варианта запроса).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, wall: float, cpu: float, items: int = 0) -> None:
+        """
+        Добавление замера этапа
+
+        Args:
+            name (str): Название этапа
+            wall (float): Реальное время, сек
+            cpu (float): Процессорное время потока, сек
+            items (int): Количество обработанных элементов
+        """
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "items": 0, "calls": 0})
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["items"] += items
+        stage["calls"] += 1
+
+    @property
+    def total(self) -> float:
+        """Полное время запроса, сек"""
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        Замеры запроса для ответа API
+
+        Returns:
+            Dict[str, object]: Полное время и замеры этапов в миллисекундах
+        """
+        return {
+            "total_ms": round(self.total * 1000, 3),
+            "stages": {
+                name: {
+                    "wall_ms": round(stage["wall"] * 1000, 3),
+                    "cpu_ms": round(stage["cpu"] * 1000, 3),
+                    "items": int(stage["items"]),
+                    "calls": int(stage["calls"]),
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+
+class Span:
+    """
+    Замер одного этапа. Используется как контекстный менеджер или вручную через stop().
+    Вне трассировки запроса ничего не записывает.
+    """
+
+    def __init__(self, name: str, trace: Optional[Trace], items: int = 0):
+        self.name = name
+        self.trace = trace
+        self.items = items
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._stopped = False
+
+    def stop(self, items: Optional[int] = None) -> None:
+        """
+        Завершение замера
+
+        Args:
+            items (Optional[int]): Количество обработанных элементов (переопределяет заданное ранее)
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        if items is not None:
+            self.items = items
+        if self.trace is not None:
+            self.trace.record(
+                self.name,
+                time.perf_counter() - self._wall_start,
+                time.thread_time() - self._cpu_start,
+                self.items,
+            )
+
+    def __enter__(self) -> 'Span':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+
+class LatencyHistograms:
+    """
+    Накопительные гистограммы времени этапов по всем запросам процесса
+    (кумулятивные корзины в формате Prometheus).
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (метрика, этап) -> [счетчики корзин..., +Inf], сумма
+        self._counts: Dict[Tuple[str, str], list] = {}
+        self._sums: Dict[Tuple[str, str], float] = {}
+        self._items: Dict[str, int] = {}
+
+    def _observe(self, metric: str, stage: str, value: float) -> None:
+        key = (metric, stage)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def observe_trace(self, trace: Trace) -> None:
+        """
+        Учет завершенной трассировки запроса
+
+        Args:
+            trace (Trace): Трассировка запроса
+        """
+        with self._lock:
+            self._observe("request", "", trace.total)
+            for name, stage in trace.stages.items():
+                self._observe("stage_wall", name, stage["wall"])
+                self._observe("stage_cpu", name, stage["cpu"])
+                self._items[name] = self._items.get(name, 0) + int(stage["items"])
+
+    def render_prometheus(self, prefix: str = "neyro") -> str:
+        """
+        Гистограммы в текстовом формате Prometheus
+
+        Args:
+            prefix (str): Префикс имен метрик
+
+        Returns:
+            str: Текст для эндпоинта /metrics
+        """
+        names = {
+            "request": ("request_seconds", "Полное время обработки запроса"),
+            "stage_wall": ("stage_wall_seconds", "Реальное время этапа обработки запроса"),
+            "stage_cpu": ("stage_cpu_seconds", "Процессорное время этапа обработки запроса"),
+        }
+        lines = []
+        with self._lock:
+            for metric, (suffix, help_text) in names.items():
+                name = f"{prefix}_{suffix}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (key_metric, stage), counts in sorted(self._counts.items()):
+                    if key_metric != metric:
+                        continue
+                    label = f'stage="{stage}",' if stage else ""
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label}le="{bound}"}} {cumulative}')
+                    cumulative += counts[-1]
+                    lines.append(f'{name}_bucket{{{label}le="+Inf"}} {cumulative}')
+                    total_label = f'{{stage="{stage}"}}' if stage else ""
+                    lines.append(f"{name}_sum{total_label} {self._sums[(key_metric, stage)]:.6f}")
+                    lines.append(f"{name}_count{total_label} {cumulative}")
+
+            name = f"{prefix}_stage_items_total"
+            lines.append(f"# HELP {name} Количество элементов, обработанных этапом")
+            lines.append(f"# TYPE {name} counter")
+            for stage, items in sorted(self._items.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {items}')
+        return "\n".join(lines) + "\n"
+
+
+# Трассировка текущего запроса и общие гистограммы процесса
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("neyro_trace", default=None)
+metrics = LatencyHistograms()
+
+
+class start_trace:
+    """
+    Контекстный менеджер трассировки запроса: замеры этапов внутри него
+    попадают в возвращаемый Trace, а по завершении — в общие гистограммы.
+    """
+
+    def __init__(self, histograms: Optional[LatencyHistograms] = None):
+        self.histograms = histograms if histograms is not None else metrics
+        self.trace = Trace()
+        self._token = None
+
+    def __enter__(self) -> Trace:
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_trace.reset(self._token)
+        self.trace.finished = time.perf_counter()
+        self.histograms.observe_trace(self.trace)
+
+
+def span(name: str, items: int = 0) -> Span:
+    """
+    Начало замера этапа в текущей трассировке
+
+    Args:
+        name (str): Название этапа
+        items (int): Количество обрабатываемых элементов
+
+    Returns:
+        Span: Замер этапа (контекстный менеджер)
+    """
+    return Span(name, _current_trace.get(), items)
+
+
+def current_trace() -> Optional[Trace]:
+    """Трассировка текущего запроса (None вне запроса)"""
+    return _current_trace.get()
@@ -0,0 +1,469 @@
+"""
+Модуль поэтапного обучения модели: обработка документов пулом процессов по частям
+и повторное использование результатов для неизмененных документов
+"""
+
+# Импорт стандартных библиотек
+import concurrent.futures  # Пул процессов обработки документов
+import hashlib  # Ключи документов по содержимому
+import json  # Хранение токенов и сегментов в кэше обучения
+import multiprocessing  # Контекст запуска процессов пула
+import os  # Для работы с файловой системой и переменных окружения
+
+# Импорт библиотек для работы с данными и математических операций
+import numpy as np  # Библиотека для научных вычислений и работы с массивами
+import pandas as pd  # Библиотека для обработки и анализа структурированных данных
+
+# Импорт типов для аннотаций
+from typing import Any, Dict, List, Optional, Sequence, Tuple  # Для типизации кода
+
+import tracing  # Замеры времени этапов обучения
+import utils  # TextProcessor для процессов пула
+from bm25 import BM25Index  # Инвертированный индекс BM25
+from bundle import BundleWriter, is_bundle, read_manifest  # Каталог кэша обучения с манифестом
+from embeddings import EmbeddingMatrix  # Нормализованные эмбеддинги со скалярным произведением
+from log_config import get_logger  # Неблокирующее логирование Neyro
+from segments import SegmentIndex, split_text_into_segments  # Таблица сегментов статей
+
+logger = get_logger(__name__)
+
+# Параметры обучения (переменные окружения)
+TRAIN_WORKERS = int(os.getenv("NEYRO_TRAIN_WORKERS", str(os.cpu_count() or 1)))  # Процессов обработки документов
+TRAIN_CHUNK_SIZE = int(os.getenv("NEYRO_TRAIN_CHUNK_SIZE", "64"))  # Документов в одной задаче пула
+TRAIN_ENCODE_BATCH_SIZE = int(os.getenv("NEYRO_TRAIN_ENCODE_BATCH_SIZE", "64"))  # Размер пакета кодирования SentenceTransformer
+TRAIN_CACHE_PATH = os.getenv("NEYRO_TRAIN_CACHE", "train_cache")  # Каталог кэша обучения ("" — без кэша)
+
+# Увеличивается при изменении результатов обработки документа: старый кэш тогда не используется
+TRAIN_PIPELINE_VERSION = 1
+
+
+def document_key(title: Any, description: Any) -> str:
+    """
+    Ключ документа по содержимому: результаты обработки документа зависят только от него
+
+    Args:
+        title (Any): Заголовок статьи
+        description (Any): Описание статьи (может быть NaN)
+
+    Returns:
+        str: Шестнадцатеричный ключ
+    """
+    description = description if not pd.isna(description) else ""
+    return hashlib.sha1(f"{title}\x00{description}".encode("utf-8")).hexdigest()
+
+
+def process_documents(text_processor, records: Sequence[Tuple[str, Any, Any]]) -> List[Dict[str, Any]]:
+    """
+    Обработка документов, не зависящая от остального корпуса: классификация,
+    токены BM25, сегменты и сущности сегментов
+
+    Args:
+        text_processor: TextProcessor
+        records (Sequence[Tuple[str, Any, Any]]): Объединенный текст, заголовок и описание документов
+
+    Returns:
+        List[Dict[str, Any]]: Результаты по документам в том же порядке
+    """
+    results = []
+    segment_texts = []
+    for combined_text, title, description in records:
+        classification = text_processor.classify_query(combined_text.lower())
+        segments = []
+        for segment in split_text_into_segments(SegmentIndex.article_text(title, description)):
+            word_count = len(segment.split())
+            if word_count >= SegmentIndex.MIN_SEGMENT_WORDS:
+                segments.append([segment, word_count, []])
+                segment_texts.append(segment)
+        results.append({
+            "query_type": classification['query_type'],
+            "user_role": classification['user_role'],
+            "component": classification['component'],
+            "tokens": text_processor._preprocess_for_bm25(combined_text),
+            "segments": segments,
+        })
+
+    # Сущности сегментов извлекаются одним проходом spaCy на всю часть
+    entities = iter(text_processor.extract_entities_spacy_batch(segment_texts))
+    for result in results:
+        for segment in result["segments"]:
+            segment[2] = [list(entity) for entity in next(entities)]
+    return results
+
+
+# TextProcessor процесса пула (pymorphy2 и spaCy загружаются один раз на процесс)
+_worker_processor = None
+
+
+def _init_worker() -> None:
+    """Создание TextProcessor в процессе пула"""
+    global _worker_processor
+    _worker_processor = utils.TextProcessor()
+
+
+def _process_chunk(records: Sequence[Tuple[str, Any, Any]]) -> List[Dict[str, Any]]:
+    """Обработка части документов внутри процесса пула"""
+    return process_documents(_worker_processor, records)
+
+
+class TrainingCache:
+    """
+    Результаты обработки документов предыдущего обучения, найденные по ключу содержимого.
+
+    Хранится каталогом с манифестом (см. bundle.BundleWriter): таблица документов
+    с классификацией, токенами BM25 и сегментами, а также эмбеддинги документов
+    и сегментов. Кэш с другими параметрами обучения не используется.
+    """
+
+    def __init__(self, documents: Optional[pd.DataFrame] = None,
+                 doc_embeddings: Optional[EmbeddingMatrix] = None,
+                 segment_embeddings: Optional[EmbeddingMatrix] = None):
+        self.documents = documents
+        self.doc_embeddings = doc_embeddings
+        self.segment_embeddings = segment_embeddings
+        self.rows: Dict[str, int] = {}
+        if documents is not None:
+            for row, key in enumerate(documents["key"]):
+                self.rows.setdefault(key, row)
+
+    @classmethod
+    def load(cls, path: str, settings: Dict[str, Any]) -> 'TrainingCache':
+        """
+        Загрузка кэша; при отсутствии, повреждении или других параметрах — пустой кэш
+
+        Args:
+            path (str): Путь к каталогу кэша
+            settings (Dict[str, Any]): Параметры обучения, при которых кэш пригоден
+
+        Returns:
+            TrainingCache: Кэш обучения
+        """
+        if not path or not is_bundle(path):
+            return cls()
+        try:
+            manifest = read_manifest(path)
+            if manifest.get("settings") != settings:
+                logger.info("Кэш обучения %s создан с другими параметрами и не используется", path)
+                return cls()
+            doc_embeddings = segment_embeddings = None
+            if settings["embeddings"]:
+                doc_embeddings = EmbeddingMatrix.load(os.path.join(path, "doc_embeddings"))
+                segment_embeddings = EmbeddingMatrix.load(os.path.join(path, "segment_embeddings"))
+            return cls(pd.read_parquet(os.path.join(path, "documents.parquet")), doc_embeddings, segment_embeddings)
+        except Exception as e:
+            logger.warning("Не удалось загрузить кэш обучения %s: %s", path, e)
+            return cls()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row(self, key: str) -> Optional[int]:
+        """Строка кэша для ключа документа (None — документ не обрабатывался)"""
+        return self.rows.get(key)
+
+    def document(self, row: int) -> Dict[str, Any]:
+        """
+        Результаты обработки документа из строки кэша
+
+        Args:
+            row (int): Строка кэша
+
+        Returns:
+            Dict[str, Any]: Результаты в формате process_documents
+        """
+        record = self.documents.iloc[row]
+        label = lambda value: None if pd.isna(value) else value
+        return {
+            "query_type": label(record["query_type"]),
+            "user_role": label(record["user_role"]),
+            "component": label(record["component"]),
+            "tokens": json.loads(record["tokens"]),
+            "segments": json.loads(record["segments"]),
+            "segment_start": int(record["segment_start"]),
+        }
+
+    @staticmethod
+    def save(path: str, settings: Dict[str, Any], keys: Sequence[str], documents: Sequence[Dict[str, Any]],
+             doc_embeddings: Optional[EmbeddingMatrix], segment_embeddings: Optional[EmbeddingMatrix]) -> None:
+        """
+        Сохранение результатов обучения в кэш (заменяет прежний кэш целиком)
+
+        Args:
+            path (str): Путь к каталогу кэша
+            settings (Dict[str, Any]): Параметры обучения
+            keys (Sequence[str]): Ключи документов
+            documents (Sequence[Dict[str, Any]]): Результаты обработки документов
+            doc_embeddings (Optional[EmbeddingMatrix]): Эмбеддинги документов
+            segment_embeddings (Optional[EmbeddingMatrix]): Эмбеддинги всех сегментов по порядку документов
+        """
+        segment_starts = np.cumsum([0] + [len(document["segments"]) for document in documents])[:-1]
+        with BundleWriter(path, settings=settings) as writer:
+            pd.DataFrame({
+                "key": list(keys),
+                "query_type": [document["query_type"] for document in documents],
+                "user_role": [document["user_role"] for document in documents],
+                "component": [document["component"] for document in documents],
+                "tokens": [json.dumps(document["tokens"], ensure_ascii=False) for document in documents],
+                "segments": [json.dumps(document["segments"], ensure_ascii=False) for document in documents],
+                "segment_start": segment_starts.astype(np.int64),
+            }).to_parquet(writer.file("documents.parquet"), index=False)
+            if settings["embeddings"]:
+                doc_embeddings.save(writer.file("doc_embeddings"))
+                segment_embeddings.save(writer.file("segment_embeddings"))
+
+
+class TrainingPipeline:
+    """
+    Поэтапное обучение модели.
+
+    Обработка отдельных документов (классификация, токены BM25, сегменты и их
+    сущности) выполняется пулом процессов частями по chunk_size документов;
+    этапы, которым нужен весь корпус (словари, BM25, индекс плотного поиска),
+    выполняются после нее. Результаты и эмбеддинги документов, содержимое
+    которых не изменилось с прошлого обучения, берутся из кэша обучения, поэтому
+    после правки базы знаний заново обрабатываются только измененные статьи.
+    Время каждого этапа записывается в трассировку и возвращается из run().
+    """
+
+    def __init__(self, model, workers: int = TRAIN_WORKERS, chunk_size: int = TRAIN_CHUNK_SIZE,
+                 encode_batch_size: int = TRAIN_ENCODE_BATCH_SIZE, cache_path: str = TRAIN_CACHE_PATH):
+        """
+        Args:
+            model: Обучаемая модель (model.Model)
+            workers (int): Количество процессов обработки документов (1 — в текущем процессе)
+            chunk_size (int): Документов в одной задаче пула
+            encode_batch_size (int): Размер пакета кодирования эмбеддингов
+            cache_path (str): Каталог кэша обучения ("" — без кэша)
+        """
+        self.model = model
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.encode_batch_size = encode_batch_size
+        self.cache_path = cache_path
+        # Замеры обучения не смешиваются с гистограммами запросов в /metrics
+        self.histograms = tracing.LatencyHistograms()
+
+    def _settings(self) -> Dict[str, Any]:
+        """Параметры, от которых зависят результаты в кэше обучения"""
+        return {
+            "pipeline_version": TRAIN_PIPELINE_VERSION,
+            "embeddings": bool(self.model.use_bert),
+            "embeddings_dtype": str(self.model.EMBEDDINGS_DTYPE),
+            "min_segment_words": SegmentIndex.MIN_SEGMENT_WORDS,
+        }
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Выполнение всех этапов обучения
+
+        Returns:
+            Dict[str, Any]: Замеры этапов (формат tracing.Trace.to_dict)
+        """
+        model = self.model
+        dataset = model.dataset
+        with tracing.start_trace(self.histograms) as trace:
+            with tracing.span("train_prepare", items=len(dataset)):
+                # Объединяем заголовок и описание для лучшего поиска
+                dataset['combined_text'] = dataset['Заголовок статьи'] + ' ' + dataset['Описание'].fillna('')
+                keys = [document_key(title, description)
+                        for title, description in zip(dataset['Заголовок статьи'], dataset['Описание'])]
+                settings = self._settings()
+                cache = TrainingCache.load(self.cache_path, settings)
+                cached_rows = [cache.row(key) for key in keys]
+                changed = [position for position, row in enumerate(cached_rows) if row is None]
+            print(f"Документов: {len(dataset)}, из кэша обучения: {len(dataset) - len(changed)}, "
+                  f"к обработке: {len(changed)}")
+
+            # Обработка документов (классификация, токены BM25, сегменты и сущности)
+            with tracing.span("train_documents", items=len(changed)):
+                processed = self._process(changed)
+            documents = [
+                processed[position] if row is None else cache.document(row)
+                for position, row in enumerate(cached_rows)
+            ]
+
+            # Классификация документов по типам
+            with tracing.span("train_classify", items=len(documents)):
+                model._classify_documents([
+                    (document["query_type"], document["user_role"], document["component"])
+                    for document in documents
+                ])
+                model._build_document_features()
+
+            # Построение словаря для исправления опечаток и извлечения аббревиатур
+            with tracing.span("train_vocabulary", items=len(dataset)):
+                model.text_processor.build_vocabulary(dataset['combined_text'])
+
+            # Обучение BM25. Пустые документы остаются в индексе на своих позициях,
+            # но не учитываются в статистиках BM25 и никогда не получают ненулевую оценку
+            with tracing.span("train_bm25", items=len(documents)):
+                tokenized_corpus = [document["tokens"] for document in documents]
+                if any(tokenized_corpus):
+                    model.bm25 = BM25Index.build(tokenized_corpus)
+                else:
+                    print("Ошибка: Корпус для обучения BM25 пуст после фильтрации.")
+
+            doc_embeddings = segment_embeddings = None
+            if model.use_bert:
+                try:
+                    # Эмбеддинги нормализуются один раз: дальше косинусное сходство — скалярное произведение
+                    with tracing.span("train_doc_embeddings", items=len(changed)):
+                        doc_embeddings = self._embeddings(
+                            dataset['combined_text'].tolist(), changed, cached_rows, cache.doc_embeddings
+                        )
+                    model.bert_embeddings = doc_embeddings
+                    with tracing.span("train_dense_index", items=len(documents)):
+                        model.build_dense_index()
+                    with tracing.span("train_segment_embeddings") as stage:
+                        segment_embeddings = self._segment_embeddings(documents, changed, cached_rows, cache)
+                        stage.items = len(segment_embeddings) if segment_embeddings is not None else 0
+                except Exception as e:
+                    print(f"Ошибка при создании BERT эмбеддингов: {e}")
+                    model.use_bert = False
+                    doc_embeddings = segment_embeddings = None
+
+            # Таблица сегментов статей для извлечения фрагментов
+            with tracing.span("train_segments", items=len(documents)):
+                model.segment_index = SegmentIndex.from_documents(
+                    [document["segments"] for document in documents], embeddings=segment_embeddings
+                )
+
+            if self.cache_path:
+                with tracing.span("train_cache", items=len(documents)):
+                    try:
+                        TrainingCache.save(self.cache_path, self._settings(), keys, documents,
+                                           doc_embeddings, segment_embeddings)
+                    except Exception as e:
+                        logger.warning("Не удалось сохранить кэш обучения %s: %s", self.cache_path, e)
+
+        timings = trace.to_dict()
+        for name, stage in timings["stages"].items():
+            print(f"  {name}: {stage['wall_ms'] / 1000:.2f} с ({stage['items']} элементов)")
+        return timings
+
+    def _process(self, positions: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Обработка документов на указанных позициях датасета
+
+        Args:
+            positions (List[int]): Позиции документов
+
+        Returns:
+            Dict[int, Dict[str, Any]]: Позиция -> результаты обработки
+        """
+        dataset = self.model.dataset
+        records = list(zip(
+            dataset['combined_text'].iloc[positions],
+            dataset['Заголовок статьи'].iloc[positions],
+            dataset['Описание'].iloc[positions],
+        ))
+        chunks = [records[start:start + self.chunk_size] for start in range(0, len(records), self.chunk_size)]
+
+        if self.workers == 1 or len(chunks) <= 1:
+            # Несколько измененных статей быстрее обработать здесь, чем запускать процессы
+            results = [process_documents(self.model.text_processor, chunk) for chunk in chunks]
+        else:
+            # spawn: процессы не наследуют потоки и состояние torch родительского процесса
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self.workers, len(chunks)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            ) as executor:
+                results = list(executor.map(_process_chunk, chunks))
+
+        processed = [result for chunk_results in results for result in chunk_results]
+        return dict(zip(positions, processed))
+
+    def _encode(self, texts: List[str]) -> Optional[EmbeddingMatrix]:
+        """Кодирование текстов SentenceTransformer (None для пустого списка)"""
+        if not texts:
+            return None
+        return EmbeddingMatrix.from_embeddings(
+            self.model.bert_model.encode(texts, batch_size=self.encode_batch_size, show_progress_bar=True),
+            dtype=self.model.EMBEDDINGS_DTYPE
+        )
+
+    @staticmethod
+    def _assemble(size: int, new_rows: Sequence[int], new: Optional[EmbeddingMatrix],
+                  cached_rows: Sequence[int], cached_sources: Sequence[int],
+                  cached: Optional[EmbeddingMatrix], dtype) -> EmbeddingMatrix:
+        """
+        Матрица эмбеддингов из новых строк и строк кэша
+
+        Args:
+            size (int): Количество строк результата
+            new_rows (Sequence[int]): Строки результата для новых эмбеддингов (по порядку new)
+            new (Optional[EmbeddingMatrix]): Новые эмбеддинги
+            cached_rows (Sequence[int]): Строки результата для эмбеддингов из кэша
+            cached_sources (Sequence[int]): Соответствующие строки кэша
+            cached (Optional[EmbeddingMatrix]): Эмбеддинги кэша
+            dtype: Тип хранения эмбеддингов
+
+        Returns:
+            EmbeddingMatrix: Собранная матрица
+        """
+        source = new if new is not None else cached
+        dimension = source.shape[1] if source is not None else 0
+        vectors = np.zeros((size, dimension), dtype=dtype)
+        norms = np.zeros(size, dtype=np.float32)
+        if new is not None:
+            vectors[new_rows] = new.vectors
+            norms[new_rows] = new.norms
+        if len(cached_rows):
+            sources = np.asarray(cached_sources, dtype=np.int64)
+            vectors[cached_rows] = cached.vectors[sources]
+            norms[cached_rows] = cached.norms[sources]
+        return EmbeddingMatrix(vectors, norms)
+
+    def _embeddings(self, texts: List[str], changed: List[int], cached_rows: List[Optional[int]],
+                    cached: Optional[EmbeddingMatrix]) -> EmbeddingMatrix:
+        """
+        Эмбеддинги документов: кодируются только измененные документы
+
+        Args:
+            texts (List[str]): Объединенные тексты всех документов
+            changed (List[int]): Позиции измененных документов
+            cached_rows (List[Optional[int]]): Строка кэша для каждого документа
+            cached (Optional[EmbeddingMatrix]): Эмбеддинги документов из кэша
+
+        Returns:
+            EmbeddingMatrix: Эмбеддинги всех документов
+        """
+        new = self._encode([texts[position] for position in changed])
+        reused = [position for position, row in enumerate(cached_rows) if row is not None]
+        return self._assemble(
+            len(texts), changed, new, reused, [cached_rows[position] for position in reused],
+            cached, self.model.EMBEDDINGS_DTYPE
+        )
+
+    def _segment_embeddings(self, documents: List[Dict[str, Any]], changed: List[int],
+                            cached_rows: List[Optional[int]], cache: TrainingCache) -> Optional[EmbeddingMatrix]:
+        """
+        Эмбеддинги сегментов всех документов по порядку: кодируются только сегменты измененных документов
+
+        Args:
+            documents (List[Dict[str, Any]]): Результаты обработки документов
+            changed (List[int]): Позиции измененных документов
+            cached_rows (List[Optional[int]]): Строка кэша для каждого документа
+            cache (TrainingCache): Кэш обучения
+
+        Returns:
+            Optional[EmbeddingMatrix]: Эмбеддинги сегментов (None, если сегментов нет)
+        """
+        offsets = np.cumsum([0] + [len(document["segments"]) for document in documents])
+        if offsets[-1] == 0:
+            return None
+
+        changed_set = set(changed)
+        new_rows, new_texts, reused_rows, reused_sources = [], [], [], []
+        for position, document in enumerate(documents):
+            rows = range(offsets[position], offsets[position + 1])
+            if position in changed_set:
+                new_rows.extend(rows)
+                new_texts.extend(segment[0] for segment in document["segments"])
+            else:
+                reused_rows.extend(rows)
+                reused_sources.extend(document["segment_start"] + i for i in range(len(rows)))
+        return self._assemble(
+            int(offsets[-1]), new_rows, self._encode(new_texts), reused_rows, reused_sources,
+            cache.segment_embeddings, self.model.EMBEDDINGS_DTYPE
+        )
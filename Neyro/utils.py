@@ -16,6 +16,8 @@ import pymorphy2  # Морфологический анализатор для 
 from collections import Counter  # Для подсчета частоты элементов
 import numpy as np  # Библиотека для научных вычислений
 import spacy  # Библиотека для обработки естественного языка и NER
+import logging  # Уровни логирования
+from log_config import get_logger  # Неблокирующее логирование Neyro
 
 # Импорт типов для аннотаций
 from typing import List, Dict, Set, Tuple, Optional, Any, Union  # Для типизации кода
@@ -31,6 +33,8 @@ try:
 except LookupError:
     nltk.download('punkt')  # Если нет, загружаем его
 
+logger = get_logger(__name__)
+
 class TextProcessor:
     """
     Класс для предварительной обработки текста запросов пользователей Портала поставщиков
@@ -194,6 +198,59 @@ class TextProcessor:
             except Exception as e:
                 print(f"Ошибка при создании словаря: {e}")
 
+    def _vocabulary_words(self, text):
+        """
+        Слова текста в том виде, в котором их учитывает build_vocabulary
+        
+        Args:
+            text (str): Текст
+            
+        Returns:
+            List[str]: Слова текста
+        """
+        if pd.isna(text):
+            return []
+        return word_tokenize(re.sub(r'[^\w\s]', ' ', str(text).lower()))
+
+    def update_vocabulary(self, added_texts=(), removed_texts=()):
+        """
+        Инкрементальное обновление словаря и частотного словаря SymSpell при
+        добавлении и удалении документов без перестроения по всему корпусу.
+        Словарь n-грамм (только частые n-граммы) не пересчитывается и
+        уточняется при следующем полном обучении.
+        
+        Args:
+            added_texts (Iterable[str]): Тексты добавленных документов
+            removed_texts (Iterable[str]): Тексты удаленных документов
+        """
+        frequency = Counter()  # Изменение частоты слова
+        for text in added_texts:
+            if pd.isna(text):
+                continue
+            self._extract_abbreviations(str(text).lower())  # Аббревиатуры новых документов
+            frequency.update(self._vocabulary_words(text))
+        for text in removed_texts:
+            frequency.subtract(self._vocabulary_words(text))
+        
+        for word, delta in frequency.items():
+            if delta > 0:
+                self.vocabulary.add(word)
+            # Частоты SymSpell ведутся, как и в build_vocabulary, только для буквенных слов длиной более 1 символа
+            if not delta or not (word.isalpha() and len(word) > 1):
+                continue
+            count = self.sym_spell.words.get(word, 0) + delta
+            if delta > 0:
+                self.sym_spell.create_dictionary_entry(word, delta)
+            elif count > 0:
+                self.sym_spell.delete_dictionary_entry(word)
+                self.sym_spell.create_dictionary_entry(word, count)
+            else:
+                # Слово больше не встречается в базе знаний
+                self.sym_spell.delete_dictionary_entry(word)
+                self.vocabulary.discard(word)
+        if frequency:
+            self.dictionary_created = True
+
     def _extract_abbreviations(self, text):
         """
         Извлечение аббревиатур и их полных форм из текста
@@ -344,6 +401,29 @@ class TextProcessor:
             print(f"Ошибка при извлечении именованных сущностей с помощью spaCy: {e}")
             return []
 
+    def extract_entities_spacy_batch(self, texts: List[str], batch_size: int = 64) -> List[List[Tuple[str, str]]]:
+        """
+        Извлечение именованных сущностей для списка текстов одним проходом spaCy (nlp.pipe)
+
+        Args:
+            texts (List[str]): Тексты для анализа
+            batch_size (int): Размер пакета для spaCy
+
+        Returns:
+            List[List[Tuple[str, str]]]: Для каждого текста список пар (текст сущности, метка сущности)
+        """
+        if not self.use_spacy_ner:
+            return [[] for _ in texts]
+
+        try:
+            return [
+                [(ent.text, ent.label_) for ent in doc.ents]
+                for doc in self.nlp.pipe(texts, batch_size=batch_size)
+            ]
+        except Exception as e:
+            logger.warning("Ошибка при пакетном извлечении именованных сущностей с помощью spaCy, извлечение по одному тексту: %s", e)
+            return [self.extract_entities_spacy(text) for text in texts]
+
     def extract_ngrams(self, tokens):
         """
         Извлечение n-грамм из токенов текста
@@ -491,13 +571,13 @@ class TextProcessor:
         Returns:
             str: Обработанный текст, готовый для векторизации
         """
-        print(f"\n--- [DEBUG preprocess_text] --- Входной текст: '{text[:100]}...'") # Отладка
+        logger.debug("[preprocess_text] Входной текст: '%.100s...'", text)
         if pd.isna(text):  # Если текст пустой (NaN)
             return ""  # Возвращаем пустую строку
         
         # Сначала исправляем запрос полностью - это поможет исправить ошибки до дальнейшей обработки
         corrected_text, corrections = self.check_query_spelling(text)
-        print(f"--- [DEBUG preprocess_text] --- После check_query_spelling: '{corrected_text[:100]}...'") # Отладка
+        logger.debug("[preprocess_text] После check_query_spelling: '%.100s...'", corrected_text)
         
         # Если текст был исправлен, используем его для дальнейшей обработки
         if corrected_text != text:
@@ -515,12 +595,13 @@ class TextProcessor:
         # Нормализация текста
         text_norm = str(text).lower()  # Приводим текст к нижнему регистру
         text_norm = re.sub(r'[^a-zA-Zа-яА-Я0-9\s]', ' ', text_norm, flags=re.UNICODE) # Более явный regex
-        print(f"--- [DEBUG preprocess_text] --- После lower() и re.sub(): '{text_norm[:100]}...'") # Отладка
+        logger.debug("[preprocess_text] После lower() и re.sub(): '%.100s...'", text_norm)
         
         # Токенизация
         try:
             tokens = word_tokenize(text_norm)  # Разбиваем нормализованный текст на слова
-            print(f"--- [DEBUG preprocess_text] --- Токены (первые 20): {tokens[:20]}") # Отладка
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[preprocess_text] Токены (первые 20): %s", tokens[:20])
         except:
             return ""  # Возвращаем пустую строку
 
@@ -551,7 +632,7 @@ class TextProcessor:
                 
         # Формирование результата
         result = ' '.join(processed_tokens)  # Объединяем обработанные токены в строку
-        print(f"--- [DEBUG preprocess_text] --- Результат после join (до сущностей): '{result[:100]}...'") # Отладка
+        logger.debug("[preprocess_text] Результат после join (до сущностей): '%.100s...'", result)
         
         # Добавление n-грамм и предметных сущностей
         if ngrams_found:  # Если найдены n-граммы
@@ -573,7 +654,7 @@ class TextProcessor:
         if expanded_terms:  # Если есть расширенные термины
             result += ' ' + ' '.join([term.replace(' ', '_') for term in expanded_terms])  # Добавляем термины, заменяя пробелы на подчеркивания
             
-        print(f"--- [DEBUG preprocess_text] --- Итоговый результат: '{result[:100]}...'") # Отладка
+        logger.debug("[preprocess_text] Итоговый результат: '%.100s...'", result)
         return result.strip()  # Возвращаем обработанный текст
         
     def _preprocess_for_bm25(self, text: str) -> List[str]:
@@ -592,7 +673,7 @@ class TextProcessor:
         try:
             tokens = word_tokenize(text_norm)
         except Exception as e:
-            print(f"Ошибка токенизации в _preprocess_for_bm25: {e}")
+            logger.warning("Ошибка токенизации в _preprocess_for_bm25: %s", e)
             return []
 
         # 3. Удаление стоп-слов и лемматизация